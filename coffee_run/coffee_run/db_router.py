@@ -0,0 +1,66 @@
+"""
+Primary/replica database routing.
+
+Writes always go to the primary ('default'). Reads go to one of DATABASE_REPLICAS only inside a
+request_routing context with replica_reads on, which ReplicaRoutingMiddleware opens for GET and
+HEAD requests. Everything else, including management commands, the completion worker and requests
+that write, reads from the primary. The routing state also records whether the request wrote
+anything, and if it did the middleware pins that client to the primary for REPLICA_STICKY_SECONDS,
+so it reads its own writes even if the replicas lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+
+
+@dataclass
+class RequestRouting:
+    replica_reads: bool = False
+    # mutated rather than reassigned, so writes made in sync_to_async threads are seen by the caller
+    wrote: bool = False
+
+
+_routing: ContextVar[Optional[RequestRouting]] = ContextVar('routing', default=None)
+
+
+@contextmanager
+def request_routing(replica_reads: bool = False):
+    routing = RequestRouting(replica_reads=replica_reads)
+    token = _routing.set(routing)
+    try:
+        yield routing
+    finally:
+        _routing.reset(token)
+
+
+def read_database() -> str:
+    replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+    routing = _routing.get()
+    if replicas and routing is not None and routing.replica_reads:
+        return random.choice(replicas)
+    return 'default'
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # related objects are read from wherever the instance they hang off came from
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return read_database()
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
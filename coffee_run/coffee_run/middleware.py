@@ -0,0 +1,189 @@
+"""
+Per-request query counting, Server-Timing headers and opt-in profiling.
+
+RequestTimingMiddleware wraps every database connection for the duration of a request to count
+queries and add up the time spent in them, reports both along with the total time in a
+Server-Timing header, and logs requests that cross SLOW_REQUEST_MS or SLOW_REQUEST_QUERIES.
+With PROFILE_REQUESTS enabled, a PROFILE_SAMPLE_RATE fraction of requests is run under cProfile
+and the stats are dumped to PROFILE_DIR. Only one request per process is profiled at a time, a
+sampled request that overlaps one being profiled runs unprofiled: concurrent requests would show up
+in each other's profiles, and from Python 3.12 a second profiler can't be enabled at all. Under
+ASGI the profiler runs on the request's sync thread, where the ORM does its work.
+
+ReplicaRoutingMiddleware decides which requests may read from the read replicas, see
+coffee_run.db_router.
+"""
+import cProfile
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .db_router import request_routing
+
+logger = logging.getLogger('coffee_run.requests')
+
+# held while a request is being profiled
+PROFILE_LOCK = threading.Lock()
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def install_query_stats(stats: QueryStats) -> None:
+    for connection in connections.all():
+        connection.execute_wrappers.append(stats)
+
+
+def uninstall_query_stats(stats: QueryStats) -> None:
+    for connection in connections.all():
+        if stats in connection.execute_wrappers:
+            connection.execute_wrappers.remove(stats)
+
+
+@contextmanager
+def sampled_profiler():
+    """
+    a cProfile.Profile for a PROFILE_SAMPLE_RATE fraction of requests, None for the rest and while another is profiled
+    """
+    if not getattr(settings, 'PROFILE_REQUESTS', False) or random.random() >= getattr(settings, 'PROFILE_SAMPLE_RATE', 0.01):
+        yield None
+        return
+    if not PROFILE_LOCK.acquire(blocking=False):
+        yield None
+        return
+    try:
+        yield cProfile.Profile()
+    finally:
+        PROFILE_LOCK.release()
+
+
+def start_request(stats: QueryStats, profiler) -> None:
+    install_query_stats(stats)
+    if profiler is not None:
+        profiler.enable()
+
+
+def stop_request(stats: QueryStats, profiler) -> None:
+    if profiler is not None:
+        profiler.disable()
+    uninstall_query_stats(stats)
+
+
+def server_timing(stats: QueryStats, total: float) -> str:
+    return f'db;desc="{stats.count} queries";dur={stats.duration * 1000:.1f}, total;dur={total * 1000:.1f}'
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with sampled_profiler() as profiler:
+            stats = QueryStats()
+            started = time.perf_counter()
+            start_request(stats, profiler)
+            try:
+                response = self.get_response(request)
+            finally:
+                stop_request(stats, profiler)
+            return self.finish(request, response, stats, profiler, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        # the async ORM runs its queries on the request's sync thread, whose connections are
+        # not the ones visible from the event loop, so the wrappers are installed over there.
+        # So is the profiler, cProfile only sees the thread it is enabled on before 3.12
+        with sampled_profiler() as profiler:
+            stats = QueryStats()
+            started = time.perf_counter()
+            await sync_to_async(start_request)(stats, profiler)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stop_request)(stats, profiler)
+            return self.finish(request, response, stats, profiler, time.perf_counter() - started)
+
+    def finish(self, request, response, stats: QueryStats, profiler, total: float):
+        response['Server-Timing'] = server_timing(stats, total)
+        if profiler is not None:
+            self.dump_profile(request, profiler)
+        if (total * 1000 >= getattr(settings, 'SLOW_REQUEST_MS', 500)
+                or stats.count >= getattr(settings, 'SLOW_REQUEST_QUERIES', 50)):
+            logger.warning(
+                "Slow request %s %s: %.1fms total, %d queries in %.1fms",
+                request.method, request.path, total * 1000, stats.count, stats.duration * 1000,
+            )
+        return response
+
+    def dump_profile(self, request, profiler: cProfile.Profile) -> None:
+        profile_dir = Path(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'index'
+        path = profile_dir / f"{datetime.now():%Y%m%dT%H%M%S%f}-{request.method}-{slug}.prof"
+        profiler.dump_stats(path)
+        logger.info("Profiled %s %s to %s", request.method, request.path, path)
+
+
+# set on responses to requests that wrote to the database, the client reads from the primary while it is present
+PRIMARY_COOKIE = 'coffee_run_primary'
+REPLICA_SAFE_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with request_routing(self.use_replica(request)) as routing:
+            response = self.get_response(request)
+        return self.pin_writer(routing, response)
+
+    async def __acall__(self, request):
+        # the context is copied into sync_to_async threads, so the async ORM sees it too
+        with request_routing(self.use_replica(request)) as routing:
+            response = await self.get_response(request)
+        return self.pin_writer(routing, response)
+
+    def use_replica(self, request) -> bool:
+        return request.method in REPLICA_SAFE_METHODS and PRIMARY_COOKIE not in request.COOKIES
+
+    def pin_writer(self, routing, response):
+        # only requests that actually wrote, so read-only POSTs such as the payer preview don't pin
+        if routing.wrote and response.status_code < 400:
+            response.set_cookie(
+                PRIMARY_COOKIE, '1', max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10), httponly=True, samesite='Lax',
+            )
+        return response
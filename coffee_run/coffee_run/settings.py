@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'coffee_run.middleware.RequestTimingMiddleware',
+    'coffee_run.middleware.ReplicaRoutingMiddleware',
+    'payments.middleware.TeamMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +89,68 @@ DATABASES = {
     }
 }
 
+# Read replicas
+# Set COFFEE_RUN_REPLICA_HOSTS to a comma separated list of hosts streaming from the primary, e.g.
+# COFFEE_RUN_REPLICA_HOSTS=db to use the primary itself as a stand-in replica locally. GET requests
+# read from a replica (see coffee_run.db_router), everything else uses the primary, and a client
+# that has just written keeps reading from the primary for REPLICA_STICKY_SECONDS.
+
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('COFFEE_RUN_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['coffee_run.db_router.PrimaryReplicaRouter']
+REPLICA_STICKY_SECONDS = 10
+
+
+# Teams
+# Every user and group order belongs to a team, and each request works on the team picked on the
+# /teams/ page (see payments.middleware). Until one is picked that is DEFAULT_TEAM_ID, the team the
+# migrations put the existing users and orders in.
+
+DEFAULT_TEAM_ID = 1
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Holds each team's user roster (payments.roster). Local memory is per process, run several workers
+# against a shared backend such as memcached or redis so that invalidations reach all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'coffee_run',
+    }
+}
+
+
+# Request timing
+# Every response carries a Server-Timing header with its query count, DB time and total time.
+# Requests over either threshold are logged to the coffee_run.requests logger.
+
+SLOW_REQUEST_MS = 500
+SLOW_REQUEST_QUERIES = 50
+
+# Set COFFEE_RUN_PROFILE_REQUESTS=1 to run a sample of requests under cProfile
+PROFILE_REQUESTS = os.environ.get('COFFEE_RUN_PROFILE_REQUESTS') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('COFFEE_RUN_PROFILE_SAMPLE_RATE', '0.01'))
+PROFILE_DIR = BASE_DIR / 'profiles'
+
+
+# Group order completion
+# With COMPLETE_ORDERS_ASYNC on, new group orders are saved as pending and completed in the
+# background by `python manage.py complete_pending_orders`.
+
+COMPLETE_ORDERS_ASYNC = os.environ.get('COFFEE_RUN_COMPLETE_ORDERS_ASYNC') == '1'
+
+
+# Archival
+# `python manage.py archive_orders` moves completed group orders older than ARCHIVE_AFTER_DAYS
+# (rounded down to whole months) into monthly per-user summaries, see payments.archive.
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('COFFEE_RUN_ARCHIVE_AFTER_DAYS', '365'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
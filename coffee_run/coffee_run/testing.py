@@ -0,0 +1,42 @@
+"""
+Test helpers for holding views to a query budget.
+"""
+import re
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    mixin for django TestCases
+
+    assertMaxQueries is assertNumQueries with an upper bound instead of an exact count, and
+    assertQueryBudget checks the Server-Timing header RequestTimingMiddleware puts on a response
+    """
+    def assertMaxQueries(self, budget: int, using: str = 'default'):
+        return _MaxQueriesContext(self, budget, connections[using])
+
+    def assertQueryBudget(self, response, budget: int):
+        header = response.get('Server-Timing', '')
+        match = re.search(r'db;desc="(\d+) queries"', header)
+        self.assertIsNotNone(match, f"Response has no Server-Timing query count: {header!r}")
+        queries = int(match.group(1))
+        self.assertLessEqual(queries, budget, f"{queries} queries executed, the budget is {budget}")
+
+
+class _MaxQueriesContext(CaptureQueriesContext):
+    def __init__(self, test_case, budget: int, connection):
+        self.test_case = test_case
+        self.budget = budget
+        super().__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        queries = "\n".join(f"{i}. {query['sql']}" for i, query in enumerate(self.captured_queries, start=1))
+        self.test_case.assertLessEqual(
+            len(self), self.budget,
+            f"{len(self)} queries executed, the budget is {self.budget}\nCaptured queries were:\n{queries}",
+        )
@@ -1,6 +1,10 @@
 from django.contrib import admin
-from .models import User, OrderItem, GroupOrder
+from .models import Team, User, OrderItem, GroupOrder, CreditLedgerEntry, BalanceCheckpoint, BalanceSnapshot
 
+admin.site.register(Team)
 admin.site.register(User)
 admin.site.register(OrderItem)
-admin.site.register(GroupOrder)
\ No newline at end of file
+admin.site.register(GroupOrder)
+admin.site.register(CreditLedgerEntry)
+admin.site.register(BalanceCheckpoint)
+admin.site.register(BalanceSnapshot)
\ No newline at end of file
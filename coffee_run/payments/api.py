@@ -0,0 +1,168 @@
+"""
+Compact JSON API over users, group orders and order items.
+
+Every list takes ``fields`` (a comma separated subset of the resource's fields, all of them by
+default), ``limit`` and the ``cursor`` of the previous page, and group orders and order items take
+``embed`` to include related rows. Only the selected fields are loaded, payers and users are joined
+with select_related and the items of a page of orders are fetched with one prefetch_related query,
+so a page costs the same number of queries however many rows it has. Responses are encoded with
+orjson and carry an ETag of their body so unchanged pages can be answered with a 304.
+
+Money is stored in cents and goes out as decimal strings ("2.50"), the same as everywhere else in
+the app.
+"""
+import hashlib
+from typing import Optional, Sequence
+
+import orjson
+from django.db.models import Prefetch, QuerySet
+
+from .models import GroupOrder, OrderItem
+from .money import format_cents
+from .pagination import PAGE_SIZE
+
+API_MAX_PAGE_SIZE = 500
+
+USER_FIELDS = ['id', 'name', 'net_credit', 'last_payment_date']
+GROUP_ORDER_FIELDS = ['id', 'order_date', 'status', 'payer_id', 'order_total', 'item_count']
+ORDER_ITEM_FIELDS = ['id', 'group_order_id', 'name', 'price', 'ordered_by_id']
+
+GROUP_ORDER_EMBEDS = ['payer', 'items']
+ORDER_ITEM_EMBEDS = ['ordered_by']
+# the fields of embedded users and items
+EMBEDDED_USER_FIELDS = ['id', 'name']
+EMBEDDED_ITEM_FIELDS = ['id', 'name', 'price', 'ordered_by_id']
+# the fields holding money
+MONEY_FIELDS = {'net_credit', 'order_total', 'price'}
+
+# keyset ordering of each resource, see payments.pagination
+GROUP_ORDER_KEYS = ['-order_date', '-id']
+ORDER_ITEM_KEYS = ['id']
+
+
+class InvalidQuery(ValueError):
+    def __init__(self, param: str, message: str):
+        super().__init__(message)
+        self.param = param
+
+
+def _parse_list(value: Optional[str], allowed: Sequence[str], param: str, default: Sequence[str]) -> list[str]:
+    if value is None:
+        return list(default)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise InvalidQuery(param, f"Unknown {param} {', '.join(unknown)}, expected some of {', '.join(allowed)}")
+    return names
+
+
+def parse_fields(params, allowed: Sequence[str]) -> list[str]:
+    fields = _parse_list(params.get('fields'), allowed, 'fields', allowed)
+    if not fields:
+        raise InvalidQuery('fields', "fields cannot be empty")
+    return fields
+
+
+def parse_embeds(params, allowed: Sequence[str]) -> list[str]:
+    return _parse_list(params.get('embed'), allowed, 'embed', [])
+
+
+def parse_limit(params) -> int:
+    limit = params.get('limit')
+    if not limit:
+        return PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidQuery('limit', f"Invalid limit {limit}")
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        raise InvalidQuery('limit', f"limit must be between 1 and {API_MAX_PAGE_SIZE}")
+    return limit
+
+
+def parse_id(params, param: str) -> Optional[int]:
+    value = params.get(param)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidQuery(param, f"Invalid {param} {value}")
+
+
+def _field_name(field: str) -> str:
+    # only() takes the name of a foreign key rather than its column
+    return field[:-3] if field.endswith('_id') and field != 'id' else field
+
+
+def _only(fields: Sequence[str], keys: Sequence[str], *extra: str) -> list[str]:
+    names = {_field_name(field) for field in fields} | {key.lstrip('-') for key in keys} | set(extra)
+    return sorted(names)
+
+
+def group_order_queryset(fields: Sequence[str], embeds: Sequence[str]) -> QuerySet:
+    extra = []
+    queryset = GroupOrder.objects.all()
+    if 'payer' in embeds:
+        extra += ['payer'] + [f'payer__{field}' for field in EMBEDDED_USER_FIELDS]
+        queryset = queryset.select_related('payer')
+    if 'items' in embeds:
+        items = OrderItem.objects.only(*_only(EMBEDDED_ITEM_FIELDS, ['id'], 'group_order')).order_by('id')
+        queryset = queryset.prefetch_related(Prefetch('orderitem_set', queryset=items, to_attr='embedded_items'))
+    return queryset.only(*_only(fields, GROUP_ORDER_KEYS, *extra))
+
+
+def order_item_queryset(fields: Sequence[str], embeds: Sequence[str]) -> QuerySet:
+    extra = []
+    queryset = OrderItem.objects.all()
+    if 'ordered_by' in embeds:
+        extra += ['ordered_by'] + [f'ordered_by__{field}' for field in EMBEDDED_USER_FIELDS]
+        queryset = queryset.select_related('ordered_by')
+    return queryset.only(*_only(fields, ORDER_ITEM_KEYS, *extra))
+
+
+def _user(user) -> Optional[dict]:
+    if user is None:
+        return None
+    return {field: getattr(user, field) for field in EMBEDDED_USER_FIELDS}
+
+
+def _json_value(field: str, value):
+    if field in MONEY_FIELDS:
+        return format_cents(value)
+    return value
+
+
+def row_json(row, fields: Sequence[str]) -> dict:
+    """
+    the fields of a model instance, or of a dict like the cached roster's users
+    """
+    if isinstance(row, dict):
+        return {field: _json_value(field, row[field]) for field in fields}
+    return {field: _json_value(field, getattr(row, field)) for field in fields}
+
+
+def group_order_json(group_order: GroupOrder, fields: Sequence[str], embeds: Sequence[str]) -> dict:
+    data = row_json(group_order, fields)
+    if 'payer' in embeds:
+        data['payer'] = _user(group_order.payer)
+    if 'items' in embeds:
+        data['items'] = [
+            row_json(item, EMBEDDED_ITEM_FIELDS) for item in group_order.embedded_items
+        ]
+    return data
+
+
+def order_item_json(order_item: OrderItem, fields: Sequence[str], embeds: Sequence[str]) -> dict:
+    data = row_json(order_item, fields)
+    if 'ordered_by' in embeds:
+        data['ordered_by'] = _user(order_item.ordered_by)
+    return data
+
+
+def encode(data) -> bytes:
+    return orjson.dumps(data)
+
+
+def body_etag(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
@@ -0,0 +1,176 @@
+"""
+Archival of old group orders.
+
+archive_orders moves the completed group orders from before a cutoff out of the hot tables, one
+calendar month at a time and one transaction per month. Each archived month is replaced by one
+MonthlySummary row per user holding what that month added to their stats and balance, so the
+history stays exactly reproducible:
+
+- rebuild_stats adds the summaries to what it aggregates from the remaining orders,
+- a user's net_credit still equals the net_change of their summaries plus their remaining ledger entries,
+- the last day of every archived month is checkpointed before its ledger entries are deleted, so
+  balances_at stays exact at the end of each archived month and on every day after the last one.
+
+Only closed months are archived (see payments.ledger.closed_through): a month with an order still
+waiting for the background worker stays in the hot tables with every month after it, its checkpoint
+couldn't include that order. A month is archived once. Orders completed in an archived month anyway
+are left in the hot tables, deleting them would drop ledger entries its checkpoint doesn't include.
+
+With a dump file each month's orders are first appended to it as gzipped NDJSON, one order per line
+with its items and ledger entries and amounts as decimal strings ("2.50") like the exports, which
+is then the only copy of the individual rows. An existing dump is never truncated, a later run
+adds another gzip member to it, which gzip and gzip.open read back as one stream.
+
+Item suggestions are left alone, a later rebuild_suggestions only sees the orders still in the hot tables.
+"""
+import gzip
+import json
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import IO, Iterator, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max, Min, QuerySet, Sum
+
+from .ledger import closed_through, take_checkpoint
+from .models import GroupOrder, OrderItem, CreditLedgerEntry, BalanceCheckpoint, MonthlySummary, GROUP_ORDER_STATUS
+from .money import format_cents
+
+ARCHIVE_CHUNK_SIZE = 500
+
+
+@dataclass
+class ArchivedMonth:
+    month: date
+    orders: int
+    items: int
+    summaries: int
+    # completed group orders left in the hot tables as the month was archived before
+    skipped: int = 0
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def archive_cutoff(older_than_days: int, today: Optional[date] = None) -> date:
+    """
+    the first day of the month containing the day older_than_days ago, only whole months before it are archived
+    """
+    return month_start((today or date.today()) - timedelta(days=older_than_days))
+
+
+def month_orders(month: date) -> QuerySet:
+    return GroupOrder.objects.filter(
+        status=GROUP_ORDER_STATUS['complete'], order_date__gte=month, order_date__lt=next_month(month),
+    )
+
+
+def month_summaries(month: date, orders: QuerySet) -> dict[int, MonthlySummary]:
+    summaries = {}
+
+    def summary(user_id: int) -> MonthlySummary:
+        return summaries.setdefault(user_id, MonthlySummary(user_id=user_id, month=month))
+
+    spent = OrderItem.objects.filter(group_order__in=orders).values('ordered_by_id').annotate(
+        order_count=Count('group_order', distinct=True), item_count=Count('id'), total_spent=Sum('price'),
+        last_order_date=Max('group_order__order_date'),
+    ).order_by()
+    for row in spent:
+        user_summary = summary(row['ordered_by_id'])
+        user_summary.order_count = row['order_count']
+        user_summary.item_count = row['item_count']
+        user_summary.total_spent = row['total_spent']
+        user_summary.last_order_date = row['last_order_date']
+    paid = orders.filter(payer__isnull=False).values('payer_id').annotate(
+        payer_count=Count('id'), total_paid=Sum('order_total'),
+    ).order_by()
+    for row in paid:
+        summary(row['payer_id']).payer_count = row['payer_count']
+        summary(row['payer_id']).total_paid = row['total_paid']
+    ledger = CreditLedgerEntry.objects.filter(group_order__in=orders).values('user_id').annotate(
+        net_change=Sum('delta'),
+    ).order_by()
+    for row in ledger:
+        summary(row['user_id']).net_change = row['net_change']
+    return summaries
+
+
+def dump_lines(orders: QuerySet, chunk_size: int = ARCHIVE_CHUNK_SIZE) -> Iterator[str]:
+    orders = orders.order_by('order_date', 'id').prefetch_related('orderitem_set', 'creditledgerentry_set')
+    for group_order in orders.iterator(chunk_size=chunk_size):
+        row = {
+            'id': group_order.pk,
+            'order_date': group_order.order_date,
+            'status': group_order.status,
+            'payer_id': group_order.payer_id,
+            'order_total': format_cents(group_order.order_total),
+            'item_count': group_order.item_count,
+            'items': [
+                {'id': item.pk, 'name': item.name, 'price': format_cents(item.price), 'ordered_by_id': item.ordered_by_id}
+                for item in sorted(group_order.orderitem_set.all(), key=lambda item: item.pk)
+            ],
+            'ledger': [
+                {'user_id': entry.user_id, 'entry_date': entry.entry_date, 'delta': format_cents(entry.delta)}
+                for entry in sorted(group_order.creditledgerentry_set.all(), key=lambda entry: entry.user_id)
+            ],
+        }
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def delete_orders(order_ids: list[int], chunk_size: int = ARCHIVE_CHUNK_SIZE) -> int:
+    items = 0
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        # the dependent rows go first so deleting the orders doesn't have to collect them
+        CreditLedgerEntry.objects.filter(group_order_id__in=chunk).delete()
+        items += OrderItem.objects.filter(group_order_id__in=chunk).delete()[0]
+        GroupOrder.objects.filter(pk__in=chunk).delete()
+    return items
+
+
+def archive_month(month: date, dump: Optional[IO[str]] = None) -> ArchivedMonth:
+    with transaction.atomic():
+        order_ids = list(month_orders(month).select_for_update().order_by('pk').values_list('pk', flat=True))
+        if not order_ids:
+            return ArchivedMonth(month, 0, 0, 0)
+        if MonthlySummary.objects.filter(month=month).exists():
+            return ArchivedMonth(month, 0, 0, 0, skipped=len(order_ids))
+        # the locked orders rather than the month's, an old pending order completing now stays in the hot tables
+        orders = GroupOrder.objects.filter(pk__in=order_ids)
+        # retaken, a checkpoint from before the month's last orders were completed doesn't include them
+        month_end = next_month(month) - timedelta(days=1)
+        BalanceCheckpoint.objects.filter(as_of=month_end).delete()
+        take_checkpoint(month_end)
+        summaries = month_summaries(month, orders)
+        if dump is not None:
+            dump.writelines(dump_lines(orders))
+            dump.flush()
+        MonthlySummary.objects.bulk_create(summaries.values())
+        items = delete_orders(order_ids)
+    return ArchivedMonth(month, len(order_ids), items, len(summaries))
+
+
+def archive_orders(before: date, dump_path: Optional[str] = None) -> list[ArchivedMonth]:
+    """
+    archive every completed group order dated before the first day of before's month, oldest month
+    first, stopping at the first month that isn't closed yet
+    """
+    cutoff = min(month_start(before), month_start(closed_through() + timedelta(days=1)))
+    oldest = GroupOrder.objects.filter(
+        status=GROUP_ORDER_STATUS['complete'], order_date__lt=cutoff,
+    ).aggregate(oldest=Min('order_date'))['oldest']
+    months = []
+    month = month_start(oldest) if oldest is not None else cutoff
+    while month < cutoff:
+        months.append(month)
+        month = next_month(month)
+    if dump_path is None:
+        return [archive_month(month) for month in months]
+    with gzip.open(dump_path, 'at', encoding='utf-8') as dump:
+        return [archive_month(month, dump) for month in months]
@@ -0,0 +1,217 @@
+"""
+Benchmarks for the payments hot paths.
+
+seed() fills the database with a configurable volume of users and completed group orders, and
+run_benchmarks() times each hot path and counts its queries. explain_access_paths() runs EXPLAIN
+on the queries behind them and checks that each one is answered by the index meant for it, from the
+index alone where the index covers the query. Results
+are plain dicts so that the bench command can write them as JSON and compare them against an
+earlier run.
+"""
+import json
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from typing import Callable, Optional
+
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .imports import import_orders
+from .models import User, GroupOrder, OrderItem, CreditLedgerEntry, GROUP_ORDER_STATUS
+from .money import format_cents, to_cents
+from .simulation import MENU as MENU_CENTS
+
+# the prices as the order form sends them
+MENU = {name: format_cents(cents) for name, cents in MENU_CENTS.items()}
+
+
+def seed(users: int = 50, orders: int = 1000, items_per_order: int = 7, seed: int = 0) -> list[User]:
+    """
+    bulk insert users and a history of completed orders, one per day up to yesterday
+
+    the history goes through import_orders, so payers and balances are what the app would have produced
+    """
+    rng = random.Random(seed)
+    seeded_users = User.objects.bulk_create([User(name=f'Bench User {seed}-{i}') for i in range(users)])
+    start = date.today() - timedelta(days=orders)
+
+    def rows():
+        for day in range(orders):
+            for _ in range(items_per_order):
+                name, price = rng.choice(list(MENU.items()))
+                yield {
+                    'order': day,
+                    'order_date': (start + timedelta(days=day)).isoformat(),
+                    'user': rng.choice(seeded_users).name,
+                    'name': name,
+                    'price': price,
+                }
+
+    import_orders(rows())
+    return list(User.objects.filter(pk__in=[user.pk for user in seeded_users]))
+
+
+def measure(fn: Callable, repeat: int, setup: Optional[Callable] = None) -> dict:
+    """
+    run fn repeat times and report its timings in milliseconds and the query count of the last run
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            fn(*args)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(captured)
+    return {
+        'queries': queries,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+    }
+
+
+def run_benchmarks(users: list[User], items_per_order: int = 7, repeat: int = 20, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    client = Client()
+
+    def order_payload():
+        return [
+            {'user': str(rng.choice(users).pk), 'name': name, 'price': str(price)}
+            for name, price in (rng.choice(list(MENU.items())) for _ in range(items_per_order))
+        ]
+
+    def put_order(payload):
+        response = client.put('/group_orders/create/', data=json.dumps(payload), content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError(f"create_group_order PUT failed: {response.content!r}")
+
+    def pending_order():
+        group_order = GroupOrder.objects.create()
+        OrderItem.objects.bulk_create([
+            OrderItem(name=item['name'], price=to_cents(item['price']), ordered_by_id=item['user'], group_order=group_order)
+            for item in order_payload()
+        ])
+        return (group_order,)
+
+    def get(url):
+        def fetch():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return fetch
+
+    latest_order = GroupOrder.objects.order_by('-order_date', '-id').first()
+    return {
+        'create_group_order_put': measure(put_order, repeat, setup=lambda: (order_payload(),)),
+        'complete_order': measure(lambda group_order: group_order.complete_order(), repeat, setup=pending_order),
+        'list_group_orders': measure(get('/group_orders/'), repeat),
+        'detail_group_order': measure(get(f'/group_orders/{latest_order.pk}/detail/'), repeat),
+        'list_users': measure(get('/users/'), repeat),
+    }
+
+
+def access_paths() -> dict:
+    """
+    the queries behind the hot paths on the current data, each with the index that should answer it
+    and whether that index covers every column the query reads
+    """
+    group_order = GroupOrder.objects.order_by('-id').first()
+    user_id = group_order.payer_id or OrderItem.objects.filter(group_order=group_order).values_list('ordered_by_id', flat=True)[0]
+    as_of = group_order.order_date
+    team_orders = GroupOrder.objects.filter(team_id=group_order.team_id)
+    return {
+        # complete_order and the background worker loading an order's items
+        'order_items': (
+            OrderItem.objects.filter(group_order=group_order).order_by('id').values_list('ordered_by_id', 'name', 'price'),
+            'orderitem_order_covering_idx', True,
+        ),
+        # the background worker finding the head of a team's queue
+        'pending_head': (
+            team_orders.filter(status=GROUP_ORDER_STATUS['pending']).order_by('id').values_list('pk', flat=True)[:1],
+            'grouporder_team_status_id_idx', True,
+        ),
+        # list_group_orders of a team, unfiltered and filtered by status or payer
+        'order_history': (team_orders.order_by('-order_date', '-id')[:50], 'grouporder_team_date_idx', False),
+        'order_history_by_status': (
+            team_orders.filter(status=GROUP_ORDER_STATUS['complete']).order_by('-order_date', '-id')[:50],
+            'grouporder_team_status_idx', False,
+        ),
+        'order_history_by_payer': (
+            GroupOrder.objects.filter(payer_id=user_id).order_by('-order_date', '-id')[:50],
+            'grouporder_payer_date_idx', False,
+        ),
+        # balance_at and balances_at summing the ledger after a checkpoint
+        'user_balance': (
+            CreditLedgerEntry.objects.filter(user_id=user_id, entry_date__lte=as_of).values('user_id').annotate(total=Sum('delta')).order_by(),
+            'ledger_user_date_idx', True,
+        ),
+        'ledger_tail': (
+            CreditLedgerEntry.objects.filter(entry_date__gt=as_of - timedelta(days=7), entry_date__lte=as_of)
+            .values('user_id').annotate(total=Sum('delta')).order_by(),
+            'ledger_date_idx', True,
+        ),
+    }
+
+
+def analyze_tables() -> None:
+    """
+    refresh the planner statistics of the tables the access paths read, so the plans are the ones the seeded volume gets
+    """
+    # outside a transaction postgres also vacuums, which sets the visibility map bits index-only scans depend on
+    command = 'VACUUM ANALYZE' if connection.vendor == 'postgresql' and not connection.in_atomic_block else 'ANALYZE'
+    with connection.cursor() as cursor:
+        for model in (GroupOrder, OrderItem, CreditLedgerEntry):
+            cursor.execute(f'{command} {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def plan_uses_index(plan: str, index: str, index_only: bool) -> bool:
+    if not index_only:
+        return index in plan
+    if connection.vendor == 'sqlite':
+        return f'USING COVERING INDEX {index}' in plan
+    return any('Index Only Scan' in line and f'using {index}' in line for line in plan.splitlines())
+
+
+def explain_access_paths() -> dict:
+    """
+    EXPLAIN every access path and report whether its plan uses the expected index, without reading
+    the table for the paths the index covers (an Index Only Scan on postgres)
+    """
+    analyze_tables()
+    results = {}
+    for name, (queryset, index, index_only) in access_paths().items():
+        plan = queryset.explain()
+        results[name] = {
+            'index': index,
+            'index_only': index_only,
+            'uses_index': plan_uses_index(plan, index, index_only),
+            'plan': plan,
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    describe every benchmark that got slower than tolerance times the baseline median or runs more
+    queries, and every access path that stopped using its index
+    """
+    regressions = []
+    for name, current in results.get('access_paths', {}).items():
+        previous = baseline.get('access_paths', {}).get(name)
+        if previous is not None and previous['uses_index'] and not current['uses_index']:
+            regressions.append(f"{name}: no longer uses {current['index']}")
+    for name, current in results.get('benchmarks', {}).items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{name}: {previous['queries']} -> {current['queries']} queries")
+        if current['median_ms'] > previous['median_ms'] * tolerance:
+            regressions.append(f"{name}: median {previous['median_ms']}ms -> {current['median_ms']}ms")
+    return regressions
@@ -0,0 +1,111 @@
+"""
+Completing many group orders with one set of writes.
+
+settle_orders runs the payer-selection rule over a sequence of new orders against balances held in
+memory, and insert_completed_orders writes the results with one bulk_create each for the orders,
+their items and their ledger entries, and one update each for the users' stats and item
+suggestions. Callers write the users' final balances once at the end. insert_pending_orders saves
+new orders for the background worker instead (see payments.queue).
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, Mapping
+
+from . import fairness
+from .models import User, GroupOrder, OrderItem, CreditLedgerEntry, GROUP_ORDER_STATUS
+from .stats import apply_stat_deltas, order_stat_deltas
+from .suggestions import apply_suggestion_deltas, order_suggestion_deltas
+
+BULK_BATCH_SIZE = 5000
+
+
+@dataclass
+class NewOrder:
+    team_id: int
+    order_date: date
+    # (user id, item name, price) for every item, all of them users of the team
+    items: list
+
+
+def settle_orders(orders: Iterable[NewOrder], accounts: Mapping[int, User]) -> list[tuple[NewOrder, fairness.Settlement]]:
+    """
+    complete each order in sequence against the in-memory accounts, which are updated in place
+    """
+    settled = []
+    for order in orders:
+        spent = {}
+        for user_id, _, price in order.items:
+            spent[user_id] = spent.get(user_id, 0) + price
+        if any(accounts[user_id].team_id != order.team_id for user_id in spent):
+            raise ValueError(f"An order of team #{order.team_id} has items ordered by users of another team")
+        settlement = fairness.settle_order(spent, accounts)
+        fairness.apply_settlement(settlement, accounts, order.order_date)
+        settled.append((order, settlement))
+    return settled
+
+
+def insert_completed_orders(settled: list[tuple[NewOrder, fairness.Settlement]]) -> list[GroupOrder]:
+    group_orders = GroupOrder.objects.bulk_create([
+        GroupOrder(
+            team_id=order.team_id,
+            order_date=order.order_date,
+            status=GROUP_ORDER_STATUS['complete'],
+            payer_id=settlement.payer,
+            order_total=settlement.total_price,
+            item_count=len(order.items),
+        )
+        for order, settlement in settled
+    ])
+    insert_items(group_orders, [order for order, _ in settled])
+    insert_ledger_entries(group_orders, [settlement for _, settlement in settled])
+    update_stats(settled)
+    update_suggestions(settled)
+    return group_orders
+
+
+def insert_pending_orders(orders: list[NewOrder]) -> list[GroupOrder]:
+    """
+    save the orders as pending, in sequence at the end of their team's queue
+    """
+    group_orders = GroupOrder.objects.bulk_create([
+        GroupOrder(
+            team_id=order.team_id,
+            order_date=order.order_date,
+            status=GROUP_ORDER_STATUS['pending'],
+            order_total=sum(price for _, _, price in order.items),
+            item_count=len(order.items),
+        )
+        for order in orders
+    ])
+    insert_items(group_orders, orders)
+    return group_orders
+
+
+def insert_items(group_orders: list[GroupOrder], orders: list[NewOrder]) -> None:
+    OrderItem.objects.bulk_create([
+        OrderItem(name=name, price=price, ordered_by_id=user_id, group_order=group_order)
+        for group_order, order in zip(group_orders, orders)
+        for user_id, name, price in order.items
+    ], batch_size=BULK_BATCH_SIZE)
+
+
+def insert_ledger_entries(group_orders: list[GroupOrder], settlements: list[fairness.Settlement]) -> None:
+    CreditLedgerEntry.objects.bulk_create([
+        CreditLedgerEntry(user_id=user_id, group_order=group_order, entry_date=group_order.order_date, delta=delta)
+        for group_order, settlement in zip(group_orders, settlements)
+        for user_id, delta in settlement.deltas.items()
+    ], batch_size=BULK_BATCH_SIZE)
+
+
+def update_stats(settled: list[tuple[NewOrder, fairness.Settlement]]) -> None:
+    deltas = {}
+    for order, settlement in settled:
+        order_stat_deltas(order.order_date, [(user_id, price) for user_id, _, price in order.items], settlement, deltas)
+    apply_stat_deltas(deltas)
+
+
+def update_suggestions(settled: list[tuple[NewOrder, fairness.Settlement]]) -> None:
+    deltas = {}
+    for order, _ in settled:
+        order_suggestion_deltas(order.order_date, order.items, deltas)
+    apply_suggestion_deltas(deltas)
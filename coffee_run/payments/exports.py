@@ -0,0 +1,111 @@
+"""
+Streaming exports of the order history and user balances.
+
+Rows are read with server-side cursors (``.iterator(chunk_size=...)``) and serialized one at a
+time, so memory use stays flat no matter how much history is exported. Under ASGI the lines are
+handed to the server as an async iterator (see astream), a server given a sync iterator there
+reads all of it into a list before sending anything. The views export the
+requesting team's rows, the export command every team's unless it is given one. Money columns are
+stored in cents and exported as decimal strings ("2.50").
+"""
+import csv
+import json
+from itertools import islice
+from typing import AsyncIterator, Generator, Iterable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import User, GroupOrder, OrderItem
+from .money import format_cents
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# dataset name -> (queryset factory, columns, lookup of the team)
+EXPORT_DATASETS = {
+    'orders': (
+        lambda: GroupOrder.objects.order_by('order_date', 'id'),
+        ['id', 'order_date', 'status', 'payer_id', 'payer__name', 'order_total', 'item_count'],
+        'team_id',
+    ),
+    'items': (
+        lambda: OrderItem.objects.order_by('group_order__order_date', 'group_order_id', 'id'),
+        ['id', 'group_order_id', 'group_order__order_date', 'group_order__payer__name',
+         'name', 'price', 'ordered_by_id', 'ordered_by__name'],
+        'group_order__team_id',
+    ),
+    'users': (
+        lambda: User.objects.order_by('id'),
+        ['id', 'name', 'net_credit', 'last_payment_date'],
+        'team_id',
+    ),
+}
+EXPORT_MONEY_COLUMNS = {'order_total', 'price', 'net_credit'}
+
+
+def _format_money(rows: Iterable[dict], columns: list[str]) -> Iterator[dict]:
+    money = [column for column in columns if column in EXPORT_MONEY_COLUMNS]
+    for row in rows:
+        for column in money:
+            row[column] = format_cents(row[column])
+        yield row
+
+
+def export_rows(dataset: str, chunk_size: int = EXPORT_CHUNK_SIZE, team_id: Optional[int] = None) -> Iterator[dict]:
+    queryset, columns, team_lookup = EXPORT_DATASETS[dataset]
+    queryset = queryset()
+    if team_id is not None:
+        queryset = queryset.filter(**{team_lookup: team_id})
+    return _format_money(queryset.values(*columns).iterator(chunk_size=chunk_size), columns)
+
+
+class Echo:
+    """
+    file-like object for csv.writer that hands back each line instead of buffering it
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_csv(dataset: str, rows: Iterable[dict]) -> Iterator[str]:
+    columns = EXPORT_DATASETS[dataset][1]
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([row[column] for column in columns])
+
+
+def stream_ndjson(dataset: str, rows: Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def stream_export(dataset: str, fmt: str, chunk_size: int = EXPORT_CHUNK_SIZE, team_id: Optional[int] = None) -> Generator[str, None, None]:
+    if dataset not in EXPORT_DATASETS:
+        raise ValueError(f"Unknown export dataset {dataset}, expected one of {', '.join(EXPORT_DATASETS)}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt}, expected one of {', '.join(EXPORT_FORMATS)}")
+    rows = export_rows(dataset, chunk_size, team_id)
+    if fmt == 'csv':
+        return stream_csv(dataset, rows)
+    return stream_ndjson(dataset, rows)
+
+
+async def astream(lines: Generator[str, None, None], chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[str]:
+    """
+    lines as an async iterator, chunk_size lines at a time read in the thread the ORM runs in
+    """
+    def next_chunk() -> str:
+        return ''.join(islice(lines, chunk_size))
+
+    try:
+        while chunk := await sync_to_async(next_chunk)():
+            yield chunk
+    finally:
+        # closes the server-side cursor when the client goes away halfway
+        await sync_to_async(lines.close)()
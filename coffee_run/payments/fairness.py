@@ -0,0 +1,71 @@
+"""
+The payer-selection rule, free of any database access.
+
+The participant with the highest net credit pays for the whole order. Ties go to whoever paid least
+recently, and participants who have never paid rank after everyone who has (the same as NULLS LAST
+in postgres). Every participant is credited with what they spent and the payer is debited the
+order total, so the sum of everyone's net credit never changes.
+
+These functions work on anything with ``net_credit`` and ``last_payment_date`` attributes, so
+GroupOrder.complete_order runs them on User instances and the simulators on plain Accounts.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Hashable, Mapping, Optional, Protocol, TypeVar
+
+Key = TypeVar('Key', bound=Hashable)
+
+
+class AccountLike(Protocol):
+    net_credit: object
+    last_payment_date: Optional[date]
+
+
+@dataclass
+class Account:
+    net_credit: object = 0
+    last_payment_date: Optional[date] = None
+
+
+@dataclass(frozen=True)
+class Settlement:
+    payer: Hashable
+    total_price: object
+    # change to each participant's net credit, including the payer's
+    deltas: dict = field(default_factory=dict)
+
+
+def payer_rank(account: AccountLike) -> tuple:
+    return (
+        -account.net_credit,
+        account.last_payment_date is None,
+        account.last_payment_date or date.min,
+    )
+
+
+def choose_payer(accounts: Mapping[Key, AccountLike]) -> Key:
+    """
+    the key of the account that should pay, ties that survive the rule go to the first key
+    """
+    if not accounts:
+        raise ValueError("Cannot choose a payer without any participants")
+    return min(accounts, key=lambda key: payer_rank(accounts[key]))
+
+
+def settle_order(spent: Mapping[Key, object], accounts: Mapping[Key, AccountLike]) -> Settlement:
+    """
+    work out who pays for an order and how everyone's net credit changes
+
+    spent maps each participant to the total price of their items, accounts maps them to their current balance
+    """
+    payer = choose_payer({key: accounts[key] for key in spent})
+    total_price = sum(spent.values())
+    deltas = dict(spent)
+    deltas[payer] = deltas[payer] - total_price
+    return Settlement(payer=payer, total_price=total_price, deltas=deltas)
+
+
+def apply_settlement(settlement: Settlement, accounts: Mapping[Key, AccountLike], order_date: date) -> None:
+    for key, delta in settlement.deltas.items():
+        accounts[key].net_credit = accounts[key].net_credit + delta
+    accounts[settlement.payer].last_payment_date = order_date
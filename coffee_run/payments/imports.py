@@ -0,0 +1,138 @@
+"""
+Bulk import of historical group orders.
+
+The input is one row per order item with the columns ``order`` (any reference shared by the items of
+one group order), ``order_date`` (YYYY-MM-DD), ``user`` (the user's name), ``name`` and ``price``.
+Rows are streamed in file order, which must be oldest first with the items of each order next to
+each other. The payer-selection rule is replayed in memory, orders, items and ledger entries are
+inserted in large bulk_create batches (see payments.bulk), and every user's final balance is written with one bulk
+update at the end. The whole import runs in one transaction and goes to a single team, whose users
+the ``user`` column names. A team with orders waiting for the background worker can't import,
+the imported orders would be completed before them.
+"""
+import csv
+import json
+from dataclasses import dataclass
+from datetime import date
+from typing import IO, Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .bulk import NewOrder, insert_completed_orders, settle_orders
+from .models import User, GroupOrder, GROUP_ORDER_STATUS
+from .money import to_cents
+from .roster import invalidate_roster
+
+IMPORT_BATCH_SIZE = 5000
+IMPORT_COLUMNS = ['order', 'order_date', 'user', 'name', 'price']
+
+
+@dataclass
+class ImportResult:
+    orders: int = 0
+    items: int = 0
+    users_created: int = 0
+
+
+def read_rows(f: IO[str], fmt: str) -> Iterator[dict]:
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_row(number: int, row: dict) -> tuple:
+    missing = [column for column in IMPORT_COLUMNS if row.get(column) is None or not str(row[column]).strip()]
+    if missing:
+        raise ValueError(f"Row {number} is missing {', '.join(missing)}")
+    try:
+        order_date = date.fromisoformat(str(row['order_date']))
+    except ValueError:
+        raise ValueError(f"Row {number} has an invalid order_date {row['order_date']!r}, expected YYYY-MM-DD")
+    try:
+        price = to_cents(row['price'])
+    except ValueError:
+        raise ValueError(f"Row {number} has an invalid price {row['price']!r}")
+    if price <= 0:
+        raise ValueError(f"Row {number} has a price that isn't positive")
+    return str(row['order']), order_date, str(row['user']).strip(), str(row['name']), price
+
+
+def iter_orders(rows: Iterable[dict]) -> Iterator[tuple[date, list]]:
+    """
+    group consecutive rows into (order_date, [(user name, item name, price), ...]) in file order
+    """
+    seen = set()
+    current_key = None
+    current_date = None
+    items = []
+    for number, row in enumerate(rows, start=1):
+        key, order_date, user, name, price = parse_row(number, row)
+        if key != current_key:
+            if items:
+                yield current_date, items
+            if key in seen:
+                raise ValueError(f"Row {number}: the items of order {key!r} are not next to each other")
+            if current_date is not None and order_date < current_date:
+                raise ValueError(f"Row {number}: orders must be sorted oldest first, {order_date} comes after {current_date}")
+            seen.add(key)
+            current_key, current_date, items = key, order_date, []
+        elif order_date != current_date:
+            raise ValueError(f"Row {number}: order {key!r} has items on different dates")
+        items.append((user, name, price))
+    if items:
+        yield current_date, items
+
+
+def import_orders(rows: Iterable[dict], create_users: bool = False, batch_size: int = IMPORT_BATCH_SIZE,
+                  team_id: Optional[int] = None) -> ImportResult:
+    """
+    import the rows into team_id, by default DEFAULT_TEAM_ID
+    """
+    if team_id is None:
+        team_id = settings.DEFAULT_TEAM_ID
+    result = ImportResult()
+    with transaction.atomic():
+        # every balance of the team may change, so all of its users are locked, in the same order and
+        # with the same lock as lock_users
+        team_users = User.objects.select_for_update(no_key=True).filter(team_id=team_id).order_by('pk')
+        users = {user.name: user for user in team_users}
+        accounts = {user.pk: user for user in users.values()}
+        latest = GroupOrder.objects.filter(team_id=team_id).aggregate(latest=Max('order_date'))['latest']
+        # the imported orders are completed right away, they can't overtake orders waiting for the worker
+        pending = GroupOrder.objects.filter(team_id=team_id, status=GROUP_ORDER_STATUS['pending']).count()
+        if pending:
+            raise ValueError(
+                f"The team has {pending} pending group orders, complete them (manage.py complete_pending_orders) "
+                f"before importing"
+            )
+        batch = []
+
+        for order_date, items in iter_orders(rows):
+            if latest is not None and order_date < latest:
+                raise ValueError(
+                    f"Can't import an order from {order_date}, the database already has orders up to {latest} "
+                    f"and balances can only be replayed forwards"
+                )
+            for user_name, _, _ in items:
+                if user_name not in users:
+                    if not create_users:
+                        raise ValueError(f"User {user_name!r} does not exist")
+                    users[user_name] = User.objects.create(team_id=team_id, name=user_name)
+                    accounts[users[user_name].pk] = users[user_name]
+                    result.users_created += 1
+            batch.append(NewOrder(team_id, order_date, [(users[user_name].pk, name, price) for user_name, name, price in items]))
+            result.orders += 1
+            result.items += len(items)
+            if len(batch) >= batch_size:
+                insert_completed_orders(settle_orders(batch, accounts))
+                batch = []
+
+        insert_completed_orders(settle_orders(batch, accounts))
+        User.objects.bulk_update(accounts.values(), ['net_credit', 'last_payment_date'], batch_size=batch_size)
+        invalidate_roster([team_id])
+    return result
@@ -0,0 +1,102 @@
+"""
+Balance history from the credit ledger.
+
+Every completed group order appends one CreditLedgerEntry per participating user. A checkpoint
+stores every user's balance as of a date, so the balance at any date is the nearest earlier
+checkpoint plus the short tail of ledger entries after it, rather than a scan of the whole ledger.
+
+Checkpoints are only correct for days that are closed, which take_checkpoint enforces: yesterday
+or earlier, and before the oldest order still waiting for the background worker, whose ledger
+entries will be dated on its order date. Retake them if history is ever imported for dates they
+already cover.
+
+payments.archive deletes the ledger entries of archived months after checkpointing the last day of
+each, so balances inside an archived month are only known at its checkpoints and asking for any
+other day there raises ValueError.
+"""
+from datetime import date, timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef, Sum
+
+from .models import User, GroupOrder, CreditLedgerEntry, BalanceCheckpoint, BalanceSnapshot, MonthlySummary, GROUP_ORDER_STATUS
+
+
+def closed_through(today: Optional[date] = None) -> date:
+    """
+    the last day no more orders can complete on: yesterday, or the day before the oldest pending order
+    """
+    closed = (today or date.today()) - timedelta(days=1)
+    pending = GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['pending']).aggregate(oldest=Min('order_date'))['oldest']
+    if pending is not None:
+        closed = min(closed, pending - timedelta(days=1))
+    return closed
+
+
+def latest_checkpoint(as_of: date) -> Optional[BalanceCheckpoint]:
+    """
+    the nearest checkpoint at or before as_of, or ValueError if a month between the two was archived
+    """
+    # an archived month starting after the checkpoint but by as_of took ledger entries of the tail with it
+    archived = MonthlySummary.objects.filter(month__gt=OuterRef('as_of'), month__lte=as_of)
+    checkpoint = BalanceCheckpoint.objects.filter(as_of__lte=as_of).annotate(
+        archived_tail=Exists(archived),
+    ).order_by('-as_of').first()
+    if checkpoint is None:
+        archived_tail = MonthlySummary.objects.filter(month__lte=as_of).exists()
+    else:
+        archived_tail = checkpoint.archived_tail
+    if archived_tail:
+        raise ValueError(f"The ledger entries up to {as_of} are archived, only the checkpoints of archived months are kept")
+    return checkpoint
+
+
+def ledger_tail(as_of: date, checkpoint: Optional[BalanceCheckpoint]):
+    entries = CreditLedgerEntry.objects.filter(entry_date__lte=as_of)
+    if checkpoint is not None:
+        entries = entries.filter(entry_date__gt=checkpoint.as_of)
+    return entries
+
+
+def balances_at(as_of: date) -> dict[int, int]:
+    """
+    every user's net credit at the end of as_of, keyed by user id (users without any entries are left out)
+    """
+    checkpoint = latest_checkpoint(as_of)
+    balances = {}
+    if checkpoint is not None:
+        balances = dict(checkpoint.balancesnapshot_set.values_list('user_id', 'net_credit'))
+    tail = ledger_tail(as_of, checkpoint).values('user_id').annotate(total=Sum('delta')).order_by()
+    for row in tail:
+        balances[row['user_id']] = balances.get(row['user_id'], 0) + row['total']
+    return balances
+
+
+def balance_at(user: User, as_of: date) -> int:
+    checkpoint = latest_checkpoint(as_of)
+    balance = 0
+    if checkpoint is not None:
+        snapshot = checkpoint.balancesnapshot_set.filter(user=user).values_list('net_credit', flat=True).first()
+        balance = snapshot or 0
+    tail = ledger_tail(as_of, checkpoint).filter(user=user).aggregate(total=Sum('delta'))['total']
+    return balance + (tail or 0)
+
+
+def take_checkpoint(as_of: date) -> BalanceCheckpoint:
+    """
+    snapshot every user's balance as of the end of as_of, built from the previous checkpoint plus the entries since
+    """
+    with transaction.atomic():
+        if BalanceCheckpoint.objects.filter(as_of=as_of).exists():
+            raise ValueError(f"A balance checkpoint for {as_of} already exists")
+        closed = closed_through()
+        if as_of > closed:
+            raise ValueError(f"Can't checkpoint {as_of}, orders can still be completed on it, the last closed day is {closed}")
+        balances = balances_at(as_of)
+        checkpoint = BalanceCheckpoint.objects.create(as_of=as_of)
+        BalanceSnapshot.objects.bulk_create([
+            BalanceSnapshot(checkpoint=checkpoint, user_id=user_id, net_credit=net_credit)
+            for user_id, net_credit in balances.items()
+        ], batch_size=2000)
+    return checkpoint
@@ -0,0 +1,109 @@
+"""
+Multi-process load test for completing group orders.
+
+run_load_test forks worker processes that each PUT a stream of random group orders at
+create_group_order through the Django test client, all for the same few users so the orders fight
+over the same balances, and then checks the invariants a lost update would break: the balances
+still sum to zero, every balance equals the sum of that user's ledger entries, and every accepted
+order was completed exactly once.
+
+The workers need a database that all of the processes can reach, an in-memory sqlite database
+can't be shared between them.
+"""
+import json
+import multiprocessing
+import random
+import statistics
+import time
+
+from django.db import connections
+from django.db.models import Count, F, Sum
+from django.test import Client
+
+from .benchmarks import MENU
+from .models import User, GroupOrder, CreditLedgerEntry, GROUP_ORDER_STATUS
+from .money import format_cents
+
+# errors kept per worker for the report
+MAX_ERRORS = 5
+
+
+def _worker(task: tuple) -> dict:
+    worker, user_ids, orders, items_per_order, seed = task
+    # a forked process must never reuse the parent's connections, it opens its own on first use
+    connections.close_all()
+    rng = random.Random(seed * 1000 + worker)
+    client = Client()
+    latencies = []
+    errors = []
+    failed = 0
+    for _ in range(orders):
+        payload = [
+            {'user': str(rng.choice(user_ids)), 'name': name, 'price': str(price)}
+            for name, price in (rng.choice(list(MENU.items())) for _ in range(items_per_order))
+        ]
+        started = time.perf_counter()
+        try:
+            response = client.put('/group_orders/create/', data=json.dumps(payload), content_type='application/json')
+            error = None if response.status_code == 200 else f"HTTP {response.status_code}: {response.content[:200]!r}"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        latencies.append((time.perf_counter() - started) * 1000)
+        if error is not None:
+            failed += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(error)
+    connections.close_all()
+    return {'latencies': latencies, 'failed': failed, 'errors': errors}
+
+
+def check_invariants(expected_orders: int) -> list[str]:
+    """
+    describe every way the balances, the ledger and the completed orders disagree
+    """
+    problems = []
+    total = User.objects.aggregate(total=Sum('net_credit'))['total'] or 0
+    if total != 0:
+        problems.append(f"balances sum to {format_cents(total)} instead of 0")
+    ledger = dict(CreditLedgerEntry.objects.values_list('user_id').annotate(total=Sum('delta')).order_by())
+    for user_id, name, net_credit in User.objects.order_by('pk').values_list('pk', 'name', 'net_credit'):
+        entries = ledger.get(user_id, 0)
+        if net_credit != entries:
+            problems.append(f"{name} has a balance of {format_cents(net_credit)} but ledger entries adding up to {format_cents(entries)}")
+    completed = GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['complete']).count()
+    if completed != expected_orders:
+        problems.append(f"{completed} orders were completed but {expected_orders} were accepted")
+    duplicated = GroupOrder.objects.annotate(
+        users=Count('creditledgerentry__user', distinct=True), entries=Count('creditledgerentry'),
+    ).filter(entries__gt=F('users')).values_list('pk', flat=True)
+    for group_order_id in duplicated[:MAX_ERRORS]:
+        problems.append(f"GroupOrder #{group_order_id} has more than one ledger entry for a user")
+    return problems
+
+
+def run_load_test(users: int = 5, processes: int = 8, orders: int = 50, items_per_order: int = 3, seed: int = 0) -> dict:
+    """
+    create users with zero balances, have processes workers PUT orders each at the same time and
+    report the throughput, latencies and any broken invariants
+    """
+    user_ids = [user.pk for user in User.objects.bulk_create([User(name=f'Load User {seed}-{i}') for i in range(users)])]
+    # the workers are forked, so no connection may be open at that point
+    connections.close_all()
+    started = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.map(_worker, [(worker, user_ids, orders, items_per_order, seed) for worker in range(processes)])
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    failed = sum(result['failed'] for result in results)
+    return {
+        'orders': len(latencies),
+        'failed': failed,
+        'errors': [error for result in results for error in result['errors']],
+        'elapsed_s': round(elapsed, 3),
+        'orders_per_s': round(len(latencies) / elapsed, 1),
+        'median_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        'max_ms': round(latencies[-1], 3),
+        'problems': check_invariants(len(latencies) - failed),
+    }
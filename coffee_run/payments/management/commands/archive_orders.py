@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.archive import archive_cutoff, archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move completed group orders older than a number of days into monthly per-user summaries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=settings.ARCHIVE_AFTER_DAYS,
+            help="archive the whole months before the one this many days ago, defaults to ARCHIVE_AFTER_DAYS",
+        )
+        parser.add_argument('--dump', help="gzipped NDJSON file to append the archived orders to, e.g. archive.ndjson.gz")
+
+    def handle(self, *args, older_than_days, dump, **options):
+        if older_than_days < 1:
+            raise CommandError("--older-than-days must be a positive number")
+        cutoff = archive_cutoff(older_than_days)
+        try:
+            months = archive_orders(cutoff, dump)
+        except ValueError as e:
+            raise CommandError(str(e))
+        for archived in months:
+            if archived.orders:
+                self.stdout.write(
+                    f"Archived {archived.month:%Y-%m}: {archived.orders} group orders and {archived.items} items "
+                    f"into {archived.summaries} summaries"
+                )
+            if archived.skipped:
+                self.stdout.write(
+                    f"Skipped {archived.skipped} group orders of {archived.month:%Y-%m}, which was archived before they were completed"
+                )
+        self.stdout.write(f"Archived {sum(archived.orders for archived in months)} group orders from before {cutoff}")
@@ -0,0 +1,79 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.runner import DiscoverRunner
+
+from payments.benchmarks import compare, explain_access_paths, run_benchmarks, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and time the payments hot paths, "
+        "optionally failing if they regressed against an earlier run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--items-per-order', type=int, default=7)
+        parser.add_argument('--repeat', type=int, default=20, help="timed runs per benchmark")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', '-o', help="write the JSON results to this file instead of stdout")
+        parser.add_argument('--compare', help="JSON results of an earlier run to check for regressions")
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=1.25,
+            help="how many times slower than the earlier run's median counts as a regression",
+        )
+        parser.add_argument(
+            '--explain',
+            action='store_true',
+            help="also EXPLAIN the hot path queries on the seeded data and check they use their indexes",
+        )
+        parser.add_argument('--keepdb', action='store_true', help="reuse the test database between runs")
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['orders'], options['items_per_order'], options['repeat']) < 1:
+            raise CommandError("--users, --orders, --items-per-order and --repeat must be positive numbers")
+
+        runner = DiscoverRunner(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        old_config = runner.setup_databases()
+        try:
+            users = seed(options['users'], options['orders'], options['items_per_order'], options['seed'])
+            benchmarks = run_benchmarks(users, options['items_per_order'], options['repeat'], options['seed'])
+            plans = explain_access_paths() if options['explain'] else None
+            vendor = connection.vendor
+        finally:
+            runner.teardown_databases(old_config)
+
+        results = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': vendor,
+            'volumes': {key: options[key] for key in ['users', 'orders', 'items_per_order', 'repeat', 'seed']},
+            'benchmarks': benchmarks,
+        }
+        if plans is not None:
+            results['access_paths'] = plans
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if plans is not None:
+            for name, plan in plans.items():
+                if not plan['uses_index']:
+                    self.stderr.write(f"{name} does not use {plan['index']}:\n{plan['plan']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Benchmarks regressed:\n" + "\n".join(regressions))
+            self.stderr.write("No regressions against " + options['compare'])
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.models import Team
+from payments.queue import QUEUE_BATCH_SIZE, complete_pending_batch, has_pending_orders
+
+
+class Command(BaseCommand):
+    help = "Complete pending group orders in the order they were created, in batches, for every team or just one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=QUEUE_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds to wait when there is nothing to complete")
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="stop as soon as no orders are pending, waiting for other workers to complete the ones they claimed",
+        )
+        parser.add_argument('--team', help="slug of the only team to complete orders for")
+
+    def handle(self, *args, batch_size, poll_interval, once, team, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive number")
+        team_id = None
+        if team is not None:
+            try:
+                team_id = Team.objects.get(slug=team).pk
+            except Team.DoesNotExist:
+                raise CommandError(f"Team {team!r} does not exist")
+        completed = 0
+        while True:
+            count = complete_pending_batch(batch_size, team_id)
+            completed += count
+            if count:
+                self.stdout.write(f"Completed {count} group orders")
+                continue
+            if once:
+                if not has_pending_orders(team_id):
+                    break
+                # another worker holds the head of a queue, the orders behind it have to wait for it
+                self.stdout.write("Waiting for another worker to complete the older pending orders")
+            time.sleep(poll_interval)
+        self.stdout.write(f"Completed {completed} group orders in total")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.exports import EXPORT_CHUNK_SIZE, EXPORT_DATASETS, EXPORT_FORMATS, stream_export
+from payments.models import Team
+
+
+class Command(BaseCommand):
+    help = "Stream the order history or user balances as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(EXPORT_DATASETS))
+        parser.add_argument('--format', dest='fmt', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help="file to write to, defaults to stdout")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--team', help="slug of the only team to export, defaults to every team")
+
+    def handle(self, *args, dataset, fmt, output, chunk_size, team, **options):
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be a positive number")
+        team_id = None
+        if team is not None:
+            try:
+                team_id = Team.objects.get(slug=team).pk
+            except Team.DoesNotExist:
+                raise CommandError(f"Team {team!r} does not exist")
+        lines = stream_export(dataset, fmt, chunk_size, team_id)
+        if output is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(output, 'w', newline='') as f:
+            f.writelines(lines)
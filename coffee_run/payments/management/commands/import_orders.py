@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.exports import EXPORT_FORMATS
+from payments.imports import IMPORT_BATCH_SIZE, import_orders, read_rows
+from payments.models import Team
+
+
+class Command(BaseCommand):
+    help = (
+        "Import historical group orders from a CSV or NDJSON file with one row per item "
+        "(order, order_date, user, name, price), oldest first, replaying the payer selection in memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            dest='fmt',
+            choices=list(EXPORT_FORMATS),
+            help="defaults to the file extension",
+        )
+        parser.add_argument('--create-users', action='store_true', help="create users that don't exist yet")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--team', help="slug of the team to import into, defaults to DEFAULT_TEAM_ID")
+
+    def handle(self, *args, path, fmt, create_users, batch_size, team, **options):
+        fmt = fmt or Path(path).suffix.lstrip('.')
+        if fmt not in EXPORT_FORMATS:
+            raise CommandError(f"Can't tell the format of {path}, pass --format")
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive number")
+        team_id = None
+        if team is not None:
+            try:
+                team_id = Team.objects.get(slug=team).pk
+            except Team.DoesNotExist:
+                raise CommandError(f"Team {team!r} does not exist")
+        try:
+            with open(path, newline='') as f:
+                result = import_orders(read_rows(f, fmt), create_users=create_users, batch_size=batch_size, team_id=team_id)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Imported {result.orders} orders with {result.items} items, created {result.users_created} users"
+        )
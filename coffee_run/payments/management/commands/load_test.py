@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.runner import DiscoverRunner
+
+from payments.loadtest import run_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        "Create group orders from several processes at once against a throwaway test database and "
+        "check that no balance update was lost"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help="fewer users means more contention")
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=50, help="orders per process")
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keepdb', action='store_true', help="reuse the test database between runs")
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['processes'], options['orders'], options['items_per_order']) < 1:
+            raise CommandError("--users, --processes, --orders and --items-per-order must be positive numbers")
+
+        runner = DiscoverRunner(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        old_config = runner.setup_databases()
+        try:
+            if connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(connection.settings_dict['NAME']):
+                raise CommandError("The load test needs a test database that several processes can share, not in-memory sqlite")
+            report = run_load_test(
+                options['users'], options['processes'], options['orders'], options['items_per_order'], options['seed'],
+            )
+        finally:
+            runner.teardown_databases(old_config)
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if report['failed'] or report['problems']:
+            raise CommandError(
+                f"{report['failed']} of {report['orders']} orders failed and {len(report['problems'])} invariants broke"
+            )
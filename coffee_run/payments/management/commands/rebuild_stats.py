@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from payments.stats import rebuild_stats
+from payments.suggestions import rebuild_suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's stats and the item name suggestions from the completed group orders"
+
+    def handle(self, *args, **options):
+        count = rebuild_stats()
+        self.stdout.write(f"Rebuilt stats for {count} users")
+        count = rebuild_suggestions()
+        self.stdout.write(f"Rebuilt {count} item suggestions")
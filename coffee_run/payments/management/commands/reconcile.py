@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.money import format_cents
+from payments.reconcile import RECONCILE_CHUNK_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the completed group orders, report every user whose balance drifted from the replay and "
+        "every team whose balances don't sum to zero, meant to be run periodically (e.g. nightly)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help="set drifted balances to the replayed ones")
+        parser.add_argument('--full', action='store_true', help="replay the whole history instead of resuming from the last checkpoint")
+        parser.add_argument('--no-checkpoint', action='store_true', help="don't save a checkpoint for the next run")
+        parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE)
+
+    def handle(self, *args, repair, full, no_checkpoint, chunk_size, **options):
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be a positive number")
+        result = reconcile(fix=repair, full=full, checkpoint=not no_checkpoint, chunk_size=chunk_size)
+        since = f"since {result.resumed_from}" if result.resumed_from is not None else "from the beginning"
+        self.stdout.write(f"Replayed {result.orders} group orders with {result.items} items {since}")
+        for drift in result.drifts:
+            self.stdout.write(
+                f"{drift.name} (#{drift.user_id}) has a balance of {format_cents(drift.stored)} but the orders add up to "
+                f"{format_cents(drift.expected)}, a drift of {format_cents(drift.drift, sign=True)}"
+            )
+        for team_id, total in result.unbalanced_teams.items():
+            self.stdout.write(f"The balances of team #{team_id} sum to {format_cents(total)} instead of 0")
+        if result.checkpoint is not None:
+            self.stdout.write(f"Checkpointed the replay as of {result.checkpoint}")
+        if result.repaired:
+            self.stdout.write(f"Repaired {result.repaired} balances")
+        elif result.drifts:
+            raise CommandError(f"{len(result.drifts)} balances drifted, run with --repair to fix them")
+        elif result.unbalanced_teams:
+            raise CommandError(f"The balances of {len(result.unbalanced_teams)} teams don't sum to zero")
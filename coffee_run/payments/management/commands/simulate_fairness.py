@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.simulation import DEFAULT_PROFILES, simulate
+
+
+class Command(BaseCommand):
+    help = "Simulate the payer-selection rule offline over many runs of the default office profiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=365, help="orders per simulation")
+        parser.add_argument('--simulations', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, orders, simulations, seed, **options):
+        if orders < 1 or simulations < 1:
+            raise CommandError("--orders and --simulations must be positive numbers")
+        result = simulate(DEFAULT_PROFILES, orders=orders, simulations=simulations, seed=seed)
+
+        self.stdout.write(f"{orders * simulations} orders across {simulations} simulations")
+        for idx, profile in enumerate(DEFAULT_PROFILES):
+            self.stdout.write(
+                f"{profile.name}: paid {result.payer_count[:, idx].mean():.1f} times on average"
+                f" | final net credit ${result.net_credit[:, idx].mean() / 100:.2f} on average"
+                f" | worst net credit ${result.peak_abs_credit[:, idx].max() / 100:.2f}"
+            )
+        fair = (result.peak_abs_credit < result.max_order_total[:, None]).all(axis=1)
+        self.stdout.write(f"net credit stayed below the largest order total in {fair.mean():.1%} of simulations")
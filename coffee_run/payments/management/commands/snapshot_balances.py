@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.ledger import take_checkpoint
+
+
+class Command(BaseCommand):
+    help = "Checkpoint every user's balance from the credit ledger, meant to be run periodically (e.g. nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--as-of',
+            type=date.fromisoformat,
+            default=None,
+            help="YYYY-MM-DD, the last day included in the snapshot, defaults to yesterday",
+        )
+
+    def handle(self, *args, as_of, **options):
+        if as_of is None:
+            as_of = date.today() - timedelta(days=1)
+        try:
+            checkpoint = take_checkpoint(as_of)
+        except ValueError as e:
+            raise CommandError(str(e))
+        count = checkpoint.balancesnapshot_set.count()
+        self.stdout.write(f"Snapshotted {count} balances as of {as_of}")
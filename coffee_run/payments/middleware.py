@@ -0,0 +1,45 @@
+"""
+Team selection.
+
+TeamMiddleware sets request.team_id from the cookie the /teams/ page sets, falling back to
+DEFAULT_TEAM_ID. The id is taken as it is, without a query: every view filters by it, so an id
+that doesn't belong to a team only ever finds nothing.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+TEAM_COOKIE = 'coffee_run_team'
+TEAM_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def request_team_id(request) -> int:
+    try:
+        return int(request.COOKIES[TEAM_COOKIE])
+    except (KeyError, ValueError):
+        return settings.DEFAULT_TEAM_ID
+
+
+class TeamMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.team_id = request_team_id(request)
+        return self.vary(self.get_response(request))
+
+    async def __acall__(self, request):
+        request.team_id = request_team_id(request)
+        return self.vary(await self.get_response(request))
+
+    def vary(self, response):
+        # the same URL shows a different team's data depending on the cookie
+        patch_vary_headers(response, ['Cookie'])
+        return response
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+
+def backfill_order_totals(apps, schema_editor):
+    GroupOrder = apps.get_model('payments', 'GroupOrder')
+    group_orders = GroupOrder.objects.filter(status='complete').annotate(
+        items_total=models.Sum('orderitem__price'),
+        items_count=models.Count('orderitem'),
+    )
+    updated = []
+    for group_order in group_orders.iterator(chunk_size=2000):
+        group_order.order_total = group_order.items_total or 0
+        group_order.item_count = group_order.items_count
+        updated.append(group_order)
+        if len(updated) >= 2000:
+            GroupOrder.objects.bulk_update(updated, ['order_total', 'item_count'])
+            updated = []
+    GroupOrder.objects.bulk_update(updated, ['order_total', 'item_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_alter_orderitem_price_alter_user_net_credit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grouporder',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='grouporder',
+            name='order_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
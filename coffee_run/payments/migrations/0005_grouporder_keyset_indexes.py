@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_grouporder_order_total_item_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['-order_date', '-id'], name='grouporder_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['status', '-order_date', '-id'], name='grouporder_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['payer', '-order_date', '-id'], name='grouporder_payer_date_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    """
+    rebuild one ledger entry per user per completed group order from the order history
+    """
+    OrderItem = apps.get_model('payments', 'OrderItem')
+    CreditLedgerEntry = apps.get_model('payments', 'CreditLedgerEntry')
+    spent_per_user = OrderItem.objects.filter(group_order__status='complete').values(
+        'group_order_id', 'ordered_by_id', 'group_order__order_date', 'group_order__payer_id', 'group_order__order_total',
+    ).annotate(spent=models.Sum('price')).order_by('group_order__order_date', 'group_order_id', 'ordered_by_id')
+
+    entries = []
+    for row in spent_per_user.iterator(chunk_size=2000):
+        delta = row['spent']
+        if row['ordered_by_id'] == row['group_order__payer_id']:
+            delta -= row['group_order__order_total']
+        entries.append(CreditLedgerEntry(
+            user_id=row['ordered_by_id'],
+            group_order_id=row['group_order_id'],
+            entry_date=row['group_order__order_date'],
+            delta=delta,
+        ))
+        if len(entries) >= 2000:
+            CreditLedgerEntry.objects.bulk_create(entries)
+            entries = []
+    CreditLedgerEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_grouporder_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateField(unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('net_credit', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.balancecheckpoint')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('checkpoint', 'user'), name='balance_snapshot_unique_user')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CreditLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_date', models.DateField()),
+                ('delta', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('group_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.grouporder')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'entry_date'], name='ledger_user_date_idx'), models.Index(fields=['entry_date'], name='ledger_date_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:57
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_credit_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='grouporder',
+            name='order_date',
+            field=models.DateField(default=datetime.date.today, editable=False),
+        ),
+    ]
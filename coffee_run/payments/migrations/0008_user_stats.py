@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_stats(apps, schema_editor):
+    """
+    one stats row per user computed from the completed group orders, as payments.stats.rebuild_stats does
+    """
+    User = apps.get_model('payments', 'User')
+    OrderItem = apps.get_model('payments', 'OrderItem')
+    GroupOrder = apps.get_model('payments', 'GroupOrder')
+    UserStats = apps.get_model('payments', 'UserStats')
+    stats = {user_id: UserStats(user_id=user_id) for user_id in User.objects.values_list('pk', flat=True)}
+    spent = OrderItem.objects.filter(group_order__status='complete').values('ordered_by_id').annotate(
+        total_spent=models.Sum('price'), item_count=models.Count('id'), last_order_date=models.Max('group_order__order_date'),
+    ).order_by()
+    for row in spent:
+        stats[row['ordered_by_id']].total_spent = row['total_spent']
+        stats[row['ordered_by_id']].item_count = row['item_count']
+        stats[row['ordered_by_id']].last_order_date = row['last_order_date']
+    paid = GroupOrder.objects.filter(status='complete', payer__isnull=False).values('payer_id').annotate(
+        payer_count=models.Count('id'), total_paid=models.Sum('order_total'),
+    ).order_by()
+    for row in paid:
+        stats[row['payer_id']].payer_count = row['payer_count']
+        stats[row['payer_id']].total_paid = row['total_paid']
+    UserStats.objects.bulk_create(stats.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_alter_grouporder_order_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='payments.user')),
+                ('payer_count', models.PositiveIntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('last_order_date', models.DateField(default=None, null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
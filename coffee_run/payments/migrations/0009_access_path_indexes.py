@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_user_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='creditledgerentry',
+            name='ledger_user_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='creditledgerentry',
+            name='ledger_date_idx',
+        ),
+        migrations.AlterField(
+            model_name='creditledgerentry',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='payments.user'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='group_order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='payments.grouporder'),
+        ),
+        migrations.AddIndex(
+            model_name='creditledgerentry',
+            index=models.Index(fields=['user', 'entry_date', 'delta'], name='ledger_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='creditledgerentry',
+            index=models.Index(fields=['entry_date', 'user', 'delta'], name='ledger_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['status', 'id'], name='grouporder_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['group_order', 'id', 'ordered_by', 'price', 'name'], name='orderitem_order_covering_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_suggestions(apps, schema_editor):
+    """
+    one suggestion per user and item name from the completed group orders, as
+    payments.suggestions.rebuild_suggestions does
+    """
+    OrderItem = apps.get_model('payments', 'OrderItem')
+    ItemSuggestion = apps.get_model('payments', 'ItemSuggestion')
+    items = OrderItem.objects.filter(group_order__status='complete').order_by(
+        'group_order__order_date', 'group_order_id', 'id',
+    ).values_list('group_order__order_date', 'ordered_by_id', 'name', 'price')
+    suggestions = {}
+    for order_date, user_id, name, price in items.iterator(chunk_size=2000):
+        key = (user_id, ' '.join(name.lower().split()))
+        suggestion = suggestions.setdefault(key, ItemSuggestion(user_id=user_id, name_key=key[1], order_count=0))
+        suggestion.order_count += 1
+        suggestion.name, suggestion.last_price, suggestion.last_ordered = name, price, order_date
+    ItemSuggestion.objects.bulk_create(suggestions.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name_key', models.CharField(db_index=True, max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('last_price', models.DecimalField(decimal_places=2, default=0, max_digits=6)),
+                ('last_ordered', models.DateField(default=None, null=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='payments.user')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'name_key'), name='item_suggestion_unique_user_name')],
+            },
+        ),
+        migrations.RunPython(backfill_suggestions, migrations.RunPython.noop),
+    ]
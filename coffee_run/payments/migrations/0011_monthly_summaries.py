@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_item_suggestions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('payer_count', models.PositiveIntegerField(default=0)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('net_change', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('last_order_date', models.DateField(default=None, null=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='payments.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month'], name='monthly_summary_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'month'), name='monthly_summary_unique_user_month')],
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:30
+
+import django.db.models.deletion
+import payments.models
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+
+def create_default_team(apps, schema_editor):
+    """
+    the team the existing users and group orders are put in, with the id the team fields default to
+    """
+    Team = apps.get_model('payments', 'Team')
+    Team.objects.create(pk=settings.DEFAULT_TEAM_ID, name='Default', slug='default')
+    # the id was given explicitly, so move the sequence past it for the teams created later
+    with schema_editor.connection.cursor() as cursor:
+        for sql in schema_editor.connection.ops.sequence_reset_sql(no_style(), [Team]):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_monthly_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Team',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('slug', models.SlugField(unique=True)),
+            ],
+        ),
+        migrations.RunPython(create_default_team, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='grouporder',
+            name='grouporder_date_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='grouporder',
+            name='grouporder_status_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='grouporder',
+            name='grouporder_status_id_idx',
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddField(
+            model_name='grouporder',
+            name='team',
+            field=models.ForeignKey(db_index=False, default=payments.models.default_team_id, on_delete=django.db.models.deletion.CASCADE, to='payments.team'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='team',
+            field=models.ForeignKey(db_index=False, default=payments.models.default_team_id, on_delete=django.db.models.deletion.CASCADE, to='payments.team'),
+        ),
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['team', '-order_date', '-id'], name='grouporder_team_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['team', 'status', '-order_date', '-id'], name='grouporder_team_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grouporder',
+            index=models.Index(fields=['team', 'status', 'id'], name='grouporder_team_status_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(fields=('team', 'name'), name='user_unique_team_name'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+# every column holding money, by model, with the decimal field it was until now
+MONEY_FIELDS = {
+    'user': {'net_credit': models.DecimalField(decimal_places=2, max_digits=6, default=0)},
+    'orderitem': {'price': models.DecimalField(decimal_places=2, max_digits=6)},
+    'grouporder': {'order_total': models.DecimalField(decimal_places=2, max_digits=8, default=0)},
+    'creditledgerentry': {'delta': models.DecimalField(decimal_places=2, max_digits=8)},
+    'balancesnapshot': {'net_credit': models.DecimalField(decimal_places=2, max_digits=8)},
+    'userstats': {
+        'total_spent': models.DecimalField(decimal_places=2, max_digits=10, default=0),
+        'total_paid': models.DecimalField(decimal_places=2, max_digits=10, default=0),
+    },
+    'itemsuggestion': {'last_price': models.DecimalField(decimal_places=2, max_digits=6, default=0)},
+    'monthlysummary': {
+        'total_spent': models.DecimalField(decimal_places=2, max_digits=10, default=0),
+        'total_paid': models.DecimalField(decimal_places=2, max_digits=10, default=0),
+        'net_change': models.DecimalField(decimal_places=2, max_digits=10, default=0),
+    },
+    'reconciliationbalance': {'net_credit': models.DecimalField(decimal_places=2, max_digits=10)},
+}
+
+
+def cents_field(model_name, name, field):
+    # order item prices and suggested prices are bounded by the order form, everything else is a sum
+    integer_field = models.IntegerField if model_name in ('orderitem', 'itemsuggestion') else models.BigIntegerField
+    if field.has_default():
+        return integer_field(default=0)
+    return integer_field()
+
+
+def update_money(apps, expression):
+    # one UPDATE per table
+    for model_name, fields in MONEY_FIELDS.items():
+        apps.get_model('payments', model_name).objects.update(**{name: expression(F(name)) for name in fields})
+
+
+def dollars_to_cents(apps, schema_editor):
+    # the decimal columns were widened first so the products fit. Rounding is a no-op on postgres,
+    # sqlite keeps decimals as floats where e.g. 0.07 * 100 is 7.000000000000001
+    update_money(apps, lambda amount: Round(amount * 100))
+
+
+def cents_to_dollars(apps, schema_editor):
+    # multiplied rather than divided, sqlite would divide the integers without a remainder
+    update_money(apps, lambda amount: amount * Decimal('0.01'))
+
+
+def alter_fields(field_for):
+    return [
+        migrations.AlterField(model_name=model_name, name=name, field=field_for(model_name, name, field))
+        for model_name, fields in MONEY_FIELDS.items()
+        for name, field in fields.items()
+    ]
+
+
+class Migration(migrations.Migration):
+    """
+    store money as integer cents (see payments.money): widen the decimal columns, multiply them by
+    100 and convert them to integers, which is exact as there is nothing left after the point
+    """
+
+    dependencies = [
+        ('payments', '0013_reconciliation_checkpoints'),
+    ]
+
+    operations = [
+        *alter_fields(lambda model_name, name, field: models.DecimalField(
+            decimal_places=2, max_digits=20, default=0 if field.has_default() else models.NOT_PROVIDED,
+        )),
+        migrations.RunPython(dollars_to_cents, cents_to_dollars),
+        *alter_fields(cents_field),
+    ]
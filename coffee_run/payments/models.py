@@ -1,12 +1,38 @@
-from django.db import models
-from decimal import Decimal
+from django.conf import settings
+from django.db import models, transaction
+from datetime import date
+from fractions import Fraction
 from django.urls import reverse
 
-class User(models.Model):
+from . import fairness
+from .money import format_cents
+
+def default_team_id() -> int:
+    return settings.DEFAULT_TEAM_ID
+
+class Team(models.Model):
+    """
+    one office, every user belongs to one and a group order is only ever made up of a single team's users
+    """
     name = models.CharField(unique=True, max_length=255)
+    slug = models.SlugField(unique=True)
+
+    def __str__(self) -> str:
+        return f"CoffeeRun Team {self.name}"
+
+class User(models.Model):
+    # indexed by user_unique_team_name, which leads with team
+    team = models.ForeignKey("Team", on_delete=models.CASCADE, default=default_team_id, db_index=False)
+    name = models.CharField(max_length=255)
     last_payment_date = models.DateField(default=None, null=True)
+    # in cents, like every amount of money (see payments.money)
     # positive number means they've spent more than they've paid, negative number the opposite
-    net_credit = models.DecimalField(decimal_places=2, max_digits=6, default=0)
+    net_credit = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['team', 'name'], name='user_unique_team_name'),
+        ]
     
     def __str__(self) -> str:
         return f"CoffeeRun User {self.name}"
@@ -14,11 +40,33 @@ class User(models.Model):
     def get_absolute_url(self):
         return reverse("user_update", kwargs={"pk": self.pk})
 
+def lock_users(user_ids) -> dict[int, User]:
+    """
+    SELECT ... FOR UPDATE the users, keyed by id, inside the caller's transaction
+
+    every path that changes balances locks its users through here, always in primary key order, so
+    transactions with overlapping users queue up behind each other rather than deadlocking. The lock
+    is FOR NO KEY UPDATE: by the time it is taken the caller has usually inserted order items or
+    ledger entries referencing these users, which holds FOR KEY SHARE on them, and a plain FOR
+    UPDATE would wait on every other transaction doing the same, deadlocking two orders with
+    overlapping users. Balances aren't keys, so the weaker lock still serializes their updates.
+    """
+    users = User.objects.select_for_update(no_key=True).filter(pk__in=user_ids).order_by('pk')
+    return {user.pk: user for user in users}
+
 class OrderItem(models.Model):
     name = models.CharField(max_length=255)
-    price = models.DecimalField(decimal_places=2, max_digits=6)
+    # in cents
+    price = models.IntegerField()
     ordered_by = models.ForeignKey("User", on_delete=models.CASCADE)
-    group_order = models.ForeignKey('GroupOrder', on_delete=models.CASCADE)
+    # indexed by orderitem_order_covering_idx, which leads with group_order
+    group_order = models.ForeignKey('GroupOrder', on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        # completing an order reads all of its items in id order, this answers that from the index alone
+        indexes = [
+            models.Index(fields=['group_order', 'id', 'ordered_by', 'price', 'name'], name='orderitem_order_covering_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"CoffeeRun OrderItem #{self.id} {self.name}"
@@ -29,38 +77,238 @@ GROUP_ORDER_STATUS = {
 }
 
 class GroupOrder(models.Model):
-    order_date = models.DateField(auto_now_add=True)
+    # indexed by the grouporder_team_* indexes, which all lead with team
+    team = models.ForeignKey("Team", on_delete=models.CASCADE, default=default_team_id, db_index=False)
+    # a default rather than auto_now_add so that seeded and imported history can keep its own dates
+    order_date = models.DateField(default=date.today, editable=False)
     status = models.CharField(max_length=255, choices=GROUP_ORDER_STATUS, default=GROUP_ORDER_STATUS['pending'])
     payer = models.ForeignKey("User", on_delete=models.CASCADE, null=True, default=None)
+    # in cents, denormalized when the order is completed so listing orders doesn't have to touch the items
+    order_total = models.BigIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # a team's order history is paged on (order_date, id), optionally filtered by status or payer,
+        # and the background worker takes each team's pending orders in id order. A payer belongs to
+        # a single team, so their index doesn't need the team in front.
+        indexes = [
+            models.Index(fields=['team', '-order_date', '-id'], name='grouporder_team_date_idx'),
+            models.Index(fields=['team', 'status', '-order_date', '-id'], name='grouporder_team_status_idx'),
+            models.Index(fields=['payer', '-order_date', '-id'], name='grouporder_payer_date_idx'),
+            models.Index(fields=['team', 'status', 'id'], name='grouporder_team_status_id_idx'),
+        ]
 
     def __str__(self) -> str:
-        return f"CoffeeRun GroupOrder #{self.id} {self.order_date} ${self.total_price}"
+        return f"CoffeeRun GroupOrder #{self.id} {self.order_date} ${format_cents(self.total_price)}"
     
     @property
-    def total_price(self) -> Decimal:
+    def total_price(self) -> int:
+        if self.status == GROUP_ORDER_STATUS['complete']:
+            return self.order_total
         return sum([item.price for item in self.orderitem_set.all()])
 
     def complete_order(self) -> 'GroupOrder':
-        # compute the user participating in the order who should pay
-        order_items = self.orderitem_set.all().select_related('ordered_by')
-        max_credit = order_items.aggregate(max_value=models.Max('ordered_by__net_credit'))['max_value']
-        payer = order_items.filter(ordered_by__net_credit=max_credit).order_by("ordered_by__last_payment_date").first().ordered_by
-
-        # update the net_credit and last_payment_date of the users
-        updated_users = []
-        for item in order_items:
-            user = item.ordered_by
-            if user == payer:
-                user.net_credit = user.net_credit - self.total_price + item.price
-                user.last_payment_date = self.order_date
-            else:
-                user.net_credit = user.net_credit + item.price
-            updated_users.append(user)
-
-        User.objects.bulk_update(updated_users, ["net_credit", "last_payment_date"])
-
-        # and then finally complete the group order
-        self.payer = payer
+        from .roster import invalidate_roster
+        from .stats import apply_stat_deltas, order_stat_deltas
+        from .suggestions import apply_suggestion_deltas, order_suggestion_deltas
+
+        with transaction.atomic():
+            # load the items once, net them per user so a user with several items is only written once
+            order_items = list(self.orderitem_set.order_by('id'))
+            if not order_items:
+                raise ValueError(f"GroupOrder #{self.id} has no order items to complete")
+            spent = {}
+            for item in order_items:
+                spent[item.ordered_by_id] = spent.get(item.ordered_by_id, 0) + item.price
+
+            # lock the participants and read their balances under the lock, so orders completing at the
+            # same time for overlapping users run one after the other instead of losing updates
+            users = lock_users(spent)
+            if any(user.team_id != self.team_id for user in users.values()):
+                raise ValueError(f"GroupOrder #{self.id} has items ordered by users of another team")
+
+            # pick the payer and update the net_credit and last_payment_date of the users
+            settlement = fairness.settle_order(spent, users)
+            fairness.apply_settlement(settlement, users, self.order_date)
+            User.objects.bulk_update(users.values(), ["net_credit", "last_payment_date"])
+            CreditLedgerEntry.objects.bulk_create([
+                CreditLedgerEntry(user_id=user_id, group_order=self, entry_date=self.order_date, delta=delta)
+                for user_id, delta in settlement.deltas.items()
+            ])
+
+            # and then finally complete the group order, unless someone else already has
+            completed = GroupOrder.objects.filter(pk=self.pk, status=GROUP_ORDER_STATUS['pending']).update(
+                payer=settlement.payer,
+                status=GROUP_ORDER_STATUS['complete'],
+                order_total=settlement.total_price,
+                item_count=len(order_items),
+            )
+            if not completed:
+                raise ValueError(f"GroupOrder #{self.id} is already complete")
+            apply_stat_deltas(order_stat_deltas(
+                self.order_date, [(item.ordered_by_id, item.price) for item in order_items], settlement,
+            ))
+            apply_suggestion_deltas(order_suggestion_deltas(
+                self.order_date, [(item.ordered_by_id, item.name, item.price) for item in order_items],
+            ))
+            # bulk_update doesn't send post_save, so the cached roster has to be dropped here
+            invalidate_roster([self.team_id])
+
+        self.payer = users[settlement.payer]
         self.status = GROUP_ORDER_STATUS['complete']
-        self.save()
-        return self
\ No newline at end of file
+        self.order_total = settlement.total_price
+        self.item_count = len(order_items)
+        return self
+
+class CreditLedgerEntry(models.Model):
+    """
+    append-only record of every change to a user's net_credit, one entry per user per completed group order
+    """
+    # indexed by ledger_user_date_idx, which leads with user
+    user = models.ForeignKey("User", on_delete=models.CASCADE, db_index=False)
+    group_order = models.ForeignKey("GroupOrder", on_delete=models.CASCADE)
+    entry_date = models.DateField()
+    # in cents
+    delta = models.BigIntegerField()
+
+    class Meta:
+        # delta is part of both so balance_at and balances_at sum the ledger from the index alone
+        indexes = [
+            models.Index(fields=['user', 'entry_date', 'delta'], name='ledger_user_date_idx'),
+            models.Index(fields=['entry_date', 'user', 'delta'], name='ledger_date_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"CoffeeRun CreditLedgerEntry #{self.id} {self.entry_date} {format_cents(self.delta, sign=True)}"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("CreditLedgerEntry is append-only and cannot be changed once written")
+        super().save(*args, **kwargs)
+
+class BalanceCheckpoint(models.Model):
+    """
+    a snapshot of every user's balance including all ledger entries up to and including as_of
+    """
+    as_of = models.DateField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"CoffeeRun BalanceCheckpoint {self.as_of}"
+
+class BalanceSnapshot(models.Model):
+    checkpoint = models.ForeignKey("BalanceCheckpoint", on_delete=models.CASCADE)
+    user = models.ForeignKey("User", on_delete=models.CASCADE)
+    # in cents
+    net_credit = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['checkpoint', 'user'], name='balance_snapshot_unique_user'),
+        ]
+
+    def __str__(self) -> str:
+        return f"CoffeeRun BalanceSnapshot {self.user_id} {format_cents(self.net_credit)}"
+
+class UserStats(models.Model):
+    """
+    running totals over every completed group order a user was part of, kept up to date by
+    payments.stats as orders complete and rebuilt from the history by `manage.py rebuild_stats`
+    """
+    user = models.OneToOneField("User", on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    payer_count = models.PositiveIntegerField(default=0)
+    # what the user's own items cost, and what they paid for whole orders as the payer, in cents
+    total_spent = models.BigIntegerField(default=0)
+    total_paid = models.BigIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    last_order_date = models.DateField(default=None, null=True)
+
+    def __str__(self) -> str:
+        return f"CoffeeRun UserStats {self.user_id}"
+
+    @property
+    def average_item_price(self) -> int:
+        if not self.item_count:
+            return 0
+        # rounded to the nearest cent, halves to even as Decimal.quantize does
+        return round(Fraction(self.total_spent, self.item_count))
+
+class ItemSuggestion(models.Model):
+    """
+    how often a user has ordered an item and what they last paid for it, one row per user and item
+    name, kept up to date by payments.suggestions as orders complete
+    """
+    # indexed by item_suggestion_unique_user_name, which leads with user
+    user = models.ForeignKey("User", on_delete=models.CASCADE, db_index=False)
+    # the name lowercased with its whitespace collapsed, searched by prefix
+    name_key = models.CharField(max_length=255, db_index=True)
+    # the name as it was last typed
+    name = models.CharField(max_length=255)
+    order_count = models.PositiveIntegerField(default=0)
+    # in cents
+    last_price = models.IntegerField(default=0)
+    last_ordered = models.DateField(default=None, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name_key'], name='item_suggestion_unique_user_name'),
+        ]
+
+    def __str__(self) -> str:
+        return f"CoffeeRun ItemSuggestion {self.user_id} {self.name_key}"
+
+class MonthlySummary(models.Model):
+    """
+    what a user's completed group orders in one month added up to, written by payments.archive when
+    that month's group orders, order items and ledger entries are moved out of the hot tables
+    """
+    # indexed by monthly_summary_unique_user_month, which leads with user
+    user = models.ForeignKey("User", on_delete=models.CASCADE, db_index=False)
+    # the first day of the month
+    month = models.DateField()
+    # orders the user had items in, and how many of their items there were and what they cost in cents
+    order_count = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    total_spent = models.BigIntegerField(default=0)
+    # orders the user paid for and what those cost in cents
+    payer_count = models.PositiveIntegerField(default=0)
+    total_paid = models.BigIntegerField(default=0)
+    # the sum of the user's ledger entries for the month, in cents
+    net_change = models.BigIntegerField(default=0)
+    last_order_date = models.DateField(default=None, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='monthly_summary_unique_user_month'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='monthly_summary_month_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"CoffeeRun MonthlySummary {self.user_id} {self.month:%Y-%m}"
+
+class ReconciliationCheckpoint(models.Model):
+    """
+    every user's balance as replaying the completed group orders up to and including as_of gives,
+    so `manage.py reconcile` only replays the orders after it (see payments.reconcile)
+    """
+    as_of = models.DateField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"CoffeeRun ReconciliationCheckpoint {self.as_of}"
+
+class ReconciliationBalance(models.Model):
+    checkpoint = models.ForeignKey("ReconciliationCheckpoint", on_delete=models.CASCADE)
+    user = models.ForeignKey("User", on_delete=models.CASCADE)
+    # in cents
+    net_credit = models.BigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['checkpoint', 'user'], name='reconciliation_unique_user'),
+        ]
+
+    def __str__(self) -> str:
+        return f"CoffeeRun ReconciliationBalance {self.user_id} {format_cents(self.net_credit)}"
@@ -0,0 +1,45 @@
+"""
+Money as integer cents.
+
+Every amount is stored as a whole number of cents (prices, balances, order totals, ledger deltas
+and the totals derived from them) and all of the arithmetic on it, from the payer selection to the
+SUM()s of the stats, runs on plain ints, the same as payments.simulation. Decimal only appears at
+the edges: to_cents reads the amounts users, files and JSON bodies send, and format_cents writes
+them back in the same "2.50" form the pages, the JSON API and the exports have always used.
+"""
+from decimal import Decimal, InvalidOperation
+
+CENT = Decimal('0.01')
+
+
+def to_cents(value) -> int:
+    """
+    an amount such as "2.5", "2.50", 2 or Decimal("2.50") in cents, rounded to the nearest cent
+
+    raises ValueError for anything that isn't a finite number
+    """
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount {value!r}")
+    try:
+        # amounts with more digits than the decimal context's precision, such as 1e100, can't be rounded to a cent
+        return int(amount.quantize(CENT).scaleb(2))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount {value!r}")
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(cents).scaleb(-2)
+
+
+def format_cents(cents: int, sign: bool = False) -> str:
+    """
+    "2.50" for 250, with a leading "+" on amounts that aren't negative if sign is set
+    """
+    text = str(from_cents(cents))
+    if sign and cents >= 0:
+        return f"+{text}"
+    return text
@@ -0,0 +1,105 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of LIMIT/OFFSET, each page is fetched with a WHERE clause on the sort key of the last row
+of the previous page, so every page costs the same index range scan no matter how deep it is.
+"""
+import base64
+import json
+from typing import Optional, Sequence
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q, QuerySet
+
+PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps([str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, count: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(f"Malformed cursor {cursor!r}")
+    if not isinstance(values, list) or len(values) != count:
+        raise InvalidCursor(f"Malformed cursor {cursor!r}")
+    return values
+
+
+def _after(keys: Sequence[str], values: Sequence) -> Q:
+    # (k1, k2, ...) > (v1, v2, ...) spelled out as
+    # k1 > v1 OR (k1 = v1 AND k2 > v2) OR ..., flipping the comparison for descending keys.
+    # The planner can't turn the ORs into an index range, so they are ANDed with the redundant
+    # k1 >= v1, which it can: the scan starts at the cursor and the ORs only filter its first rows
+    condition = Q()
+    for idx, key in enumerate(keys):
+        field = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+        term = Q(**{f'{field}__{lookup}': values[idx]})
+        for prev_key, prev_value in zip(keys[:idx], values[:idx]):
+            term &= Q(**{prev_key.lstrip('-'): prev_value})
+        condition |= term
+    if len(keys) > 1:
+        first = keys[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        condition = Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & condition
+    return condition
+
+
+def _page_queryset(queryset: QuerySet, keys: Sequence[str], cursor: Optional[str], page_size: int) -> QuerySet:
+    queryset = queryset.order_by(*keys)
+    if cursor:
+        values = decode_cursor(cursor, len(keys))
+        try:
+            values = [
+                queryset.model._meta.get_field(key.lstrip('-')).to_python(value)
+                for key, value in zip(keys, values)
+            ]
+        except ValidationError:
+            raise InvalidCursor(f"Malformed cursor {cursor!r}")
+        queryset = queryset.filter(_after(keys, values))
+    # one extra row tells us whether there is another page
+    return queryset[:page_size + 1]
+
+
+def _split_page(rows: list, keys: Sequence[str], page_size: int) -> tuple[list, Optional[str]]:
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor([getattr(rows[-1], key.lstrip('-')) for key in keys])
+
+
+def keyset_page(
+    queryset: QuerySet,
+    keys: Sequence[str],
+    cursor: Optional[str] = None,
+    page_size: int = PAGE_SIZE,
+) -> tuple[list, Optional[str]]:
+    """
+    Return one page of ``queryset`` ordered by ``keys`` and the cursor for the next page (None on the last page).
+
+    ``keys`` are field names, prefixed with '-' for descending order. The last key must be unique
+    (usually 'id' or '-id') so that the ordering is total.
+    """
+    rows = list(_page_queryset(queryset, keys, cursor, page_size))
+    return _split_page(rows, keys, page_size)
+
+
+async def akeyset_page(
+    queryset: QuerySet,
+    keys: Sequence[str],
+    cursor: Optional[str] = None,
+    page_size: int = PAGE_SIZE,
+) -> tuple[list, Optional[str]]:
+    """
+    async version of keyset_page
+    """
+    rows = [row async for row in _page_queryset(queryset, keys, cursor, page_size)]
+    return _split_page(rows, keys, page_size)
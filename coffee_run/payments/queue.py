@@ -0,0 +1,83 @@
+"""
+Completing pending group orders in the background.
+
+With COMPLETE_ORDERS_ASYNC on, create_group_order only saves the order as pending and the pending
+GroupOrder rows themselves are the queue. A worker (manage.py complete_pending_orders) claims the
+oldest pending orders with SELECT ... FOR UPDATE SKIP LOCKED, so no outside broker is needed, and
+completes a whole batch with one set of writes.
+
+Every team has a queue of its own, since orders only ever change the balances of their own team's
+users. Within a team orders are completed strictly in the order they were created: a worker only
+goes ahead when the batch it claimed starts at the head of that team's queue, otherwise another
+worker is still busy with the older orders and it backs off. A team with a long queue doesn't hold
+up the others, and workers can be dedicated to a single team. A worker that backed off can't tell
+an empty queue from one whose head another worker holds, has_pending_orders can.
+
+A pending order whose items are all gone, as deleting the only users in it cascades to their items,
+has no one left to charge. The worker logs and deletes it rather than stopping at it for good.
+"""
+import logging
+from typing import Optional
+
+from django.db import transaction
+
+from .bulk import NewOrder, insert_ledger_entries, settle_orders, update_stats, update_suggestions
+from .models import Team, User, GroupOrder, OrderItem, GROUP_ORDER_STATUS, lock_users
+from .roster import invalidate_roster
+
+QUEUE_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def complete_pending_batch(batch_size: int = QUEUE_BATCH_SIZE, team_id: Optional[int] = None) -> int:
+    """
+    complete up to batch_size of the oldest pending orders of every team, or only of team_id, and
+    return how many were completed (or deleted for having no items left)
+    """
+    team_ids = [team_id] if team_id is not None else list(Team.objects.order_by('pk').values_list('pk', flat=True))
+    return sum(complete_team_batch(team_id, batch_size) for team_id in team_ids)
+
+
+def has_pending_orders(team_id: Optional[int] = None) -> bool:
+    pending = GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['pending'])
+    if team_id is not None:
+        pending = pending.filter(team_id=team_id)
+    return pending.exists()
+
+
+def complete_team_batch(team_id: int, batch_size: int = QUEUE_BATCH_SIZE) -> int:
+    with transaction.atomic():
+        pending = GroupOrder.objects.filter(team_id=team_id, status=GROUP_ORDER_STATUS['pending']).order_by('id')
+        claimed = list(pending.select_for_update(skip_locked=True)[:batch_size])
+        if not claimed or claimed[0].pk != pending.values_list('pk', flat=True).first():
+            return 0
+
+        items = {group_order.pk: [] for group_order in claimed}
+        rows = OrderItem.objects.filter(group_order__in=claimed).order_by('group_order_id', 'id')
+        for group_order_id, user_id, name, price in rows.values_list('group_order_id', 'ordered_by_id', 'name', 'price'):
+            items[group_order_id].append((user_id, name, price))
+        empty = [group_order.pk for group_order in claimed if not items[group_order.pk]]
+        if empty:
+            for group_order_id in empty:
+                logger.warning("Deleting pending GroupOrder #%s of team #%s, it has no order items left", group_order_id, team_id)
+            GroupOrder.objects.filter(pk__in=empty).delete()
+            claimed = [group_order for group_order in claimed if items[group_order.pk]]
+            if not claimed:
+                return len(empty)
+
+        users = lock_users({user_id for order_items in items.values() for user_id, _, _ in order_items})
+        settled = settle_orders([NewOrder(team_id, group_order.order_date, items[group_order.pk]) for group_order in claimed], users)
+        for group_order, (order, settlement) in zip(claimed, settled):
+            group_order.payer_id = settlement.payer
+            group_order.status = GROUP_ORDER_STATUS['complete']
+            group_order.order_total = settlement.total_price
+            group_order.item_count = len(order.items)
+
+        User.objects.bulk_update(users.values(), ['net_credit', 'last_payment_date'])
+        GroupOrder.objects.bulk_update(claimed, ['payer', 'status', 'order_total', 'item_count'])
+        insert_ledger_entries(claimed, [settlement for _, settlement in settled])
+        update_stats(settled)
+        update_suggestions(settled)
+        invalidate_roster([team_id])
+    return len(claimed) + len(empty)
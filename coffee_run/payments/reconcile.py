@@ -0,0 +1,198 @@
+"""
+Balance reconciliation.
+
+The fairness rule keeps two invariants: the balances of a team's users sum to zero, and every
+user's net_credit is what replaying the completed group orders gives, crediting each user with
+their items and debiting the payer the order total. reconcile checks both without trusting any
+stored total or the ledger, and optionally repairs drifted balances.
+
+Each team's orders are streamed oldest first with a server-side cursor along the team's history
+index, and their items fetched a chunk of orders at a time, so memory only grows with the number
+of users and never with the length of the history. Archived months contribute the net change of
+their monthly summaries (see payments.archive).
+
+A run saves the replayed balances as of yesterday in a ReconciliationCheckpoint and the next run
+starts from there, so a nightly run only replays the last day. Like balance checkpoints they are
+only correct for closed days, pass full=True after backdating orders into a day they cover. A day
+with orders still waiting for the background worker isn't closed yet, the checkpoint stops the day
+before the oldest of them.
+Checkpoints from before the last archived month are skipped, that month's orders are gone.
+
+Everything is read in one REPEATABLE READ transaction on postgres, so the stored balances are
+compared against exactly the orders that were replayed, and drift is repaired by adding the
+difference under lock, which leaves orders completed since the snapshot in place. Called inside a
+transaction the caller opened, reconcile runs at that transaction's isolation level instead.
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Iterator, Optional
+
+from django.db import connection, transaction
+from django.db.models import F, Max, Sum
+
+from .archive import next_month
+from .ledger import closed_through
+from .models import (
+    Team, User, GroupOrder, OrderItem, MonthlySummary, ReconciliationCheckpoint, ReconciliationBalance,
+    GROUP_ORDER_STATUS, lock_users,
+)
+from .roster import invalidate_roster
+
+RECONCILE_CHUNK_SIZE = 2000
+
+
+@dataclass
+class Drift:
+    user_id: int
+    team_id: int
+    name: str
+    stored: int
+    expected: int
+
+    @property
+    def drift(self) -> int:
+        return self.stored - self.expected
+
+
+@dataclass
+class Reconciliation:
+    # the checkpoint the replay started from, None when it started from the beginning
+    resumed_from: Optional[date] = None
+    orders: int = 0
+    items: int = 0
+    drifts: list = field(default_factory=list)
+    # teams whose stored balances don't sum to zero, and what they sum to
+    unbalanced_teams: dict = field(default_factory=dict)
+    checkpoint: Optional[date] = None
+    repaired: int = 0
+
+
+def _archived_through() -> Optional[date]:
+    month = MonthlySummary.objects.aggregate(month=Max('month'))['month']
+    if month is None:
+        return None
+    return next_month(month) - timedelta(days=1)
+
+
+def starting_balances(full: bool = False) -> tuple[Optional[date], dict[int, int]]:
+    """
+    the date the replay resumes after and the balances as of it, from the latest usable checkpoint
+    or else from the archived monthly summaries
+    """
+    archived_through = _archived_through()
+    if not full:
+        checkpoints = ReconciliationCheckpoint.objects.order_by('-as_of')
+        if archived_through is not None:
+            checkpoints = checkpoints.filter(as_of__gte=archived_through)
+        checkpoint = checkpoints.first()
+        if checkpoint is not None:
+            return checkpoint.as_of, dict(checkpoint.reconciliationbalance_set.values_list('user_id', 'net_credit'))
+    archived = MonthlySummary.objects.values('user_id').annotate(net_change=Sum('net_change')).order_by()
+    return None, {row['user_id']: row['net_change'] for row in archived}
+
+
+def _chunks(rows: Iterator[tuple], size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def replay_team(team_id: int, expected: dict[int, int], after: Optional[date], closed: date,
+                result: Reconciliation, chunk_size: int = RECONCILE_CHUNK_SIZE) -> dict[int, int]:
+    """
+    add the team's completed orders after after to expected, in place, and return the team's
+    balances as of the end of closed
+    """
+    orders = GroupOrder.objects.filter(team_id=team_id, status=GROUP_ORDER_STATUS['complete'])
+    if after is not None:
+        orders = orders.filter(order_date__gt=after)
+    orders = orders.order_by('order_date', 'id').values_list('pk', 'order_date', 'payer_id')
+    team_users = set(User.objects.filter(team_id=team_id).values_list('pk', flat=True))
+    closed_balances = None
+    for chunk in _chunks(orders.iterator(chunk_size=chunk_size), chunk_size):
+        items = {}
+        rows = OrderItem.objects.filter(group_order_id__in=[pk for pk, _, _ in chunk]).values_list(
+            'group_order_id', 'ordered_by_id', 'price',
+        )
+        for group_order_id, user_id, price in rows:
+            items.setdefault(group_order_id, []).append((user_id, price))
+        for group_order_id, order_date, payer_id in chunk:
+            if closed_balances is None and order_date > closed:
+                closed_balances = {user_id: expected.get(user_id, 0) for user_id in team_users}
+            total = 0
+            for user_id, price in items.get(group_order_id, []):
+                expected[user_id] = expected.get(user_id, 0) + price
+                total += price
+            expected[payer_id] = expected.get(payer_id, 0) - total
+            result.orders += 1
+            result.items += len(items.get(group_order_id, []))
+    if closed_balances is None:
+        closed_balances = {user_id: expected.get(user_id, 0) for user_id in team_users}
+    return closed_balances
+
+
+def save_checkpoint(as_of: date, balances: dict[int, int]) -> None:
+    # a checkpoint is derived data, only the newest is kept
+    ReconciliationCheckpoint.objects.all().delete()
+    checkpoint = ReconciliationCheckpoint.objects.create(as_of=as_of)
+    ReconciliationBalance.objects.bulk_create([
+        ReconciliationBalance(checkpoint=checkpoint, user_id=user_id, net_credit=net_credit)
+        for user_id, net_credit in balances.items()
+    ], batch_size=RECONCILE_CHUNK_SIZE)
+
+
+def repair(drifts: list[Drift]) -> int:
+    """
+    move every drifted balance to its expected value, keeping whatever changed it since it was read
+    """
+    if not drifts:
+        return 0
+    with transaction.atomic():
+        lock_users([drift.user_id for drift in drifts])
+        User.objects.bulk_update(
+            [User(pk=drift.user_id, net_credit=F('net_credit') - drift.drift) for drift in drifts], ['net_credit'],
+        )
+        # bulk_update doesn't send post_save, so the cached rosters have to be dropped here
+        invalidate_roster({drift.team_id for drift in drifts})
+    return len(drifts)
+
+
+def reconcile(fix: bool = False, full: bool = False, checkpoint: bool = True,
+              chunk_size: int = RECONCILE_CHUNK_SIZE, today: Optional[date] = None) -> Reconciliation:
+    """
+    replay the completed orders, report every user whose stored balance drifted from the replay and
+    every team whose balances don't sum to zero, and repair the drift if fix is set
+    """
+    # SET TRANSACTION has to come before any query of the transaction, which an outer one already ran
+    own_transaction = not connection.in_atomic_block
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and own_transaction:
+            # must come first in the transaction, every query below then sees the same snapshot
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        closed = closed_through(today)
+        after, expected = starting_balances(full)
+        result = Reconciliation(resumed_from=after)
+        closed_balances = {}
+        for team_id in Team.objects.order_by('pk').values_list('pk', flat=True):
+            closed_balances.update(replay_team(team_id, expected, after, closed, result, chunk_size))
+
+        users = User.objects.order_by('team_id', 'name').values_list('pk', 'team_id', 'name', 'net_credit')
+        for user_id, team_id, name, net_credit in users.iterator(chunk_size=chunk_size):
+            drift = Drift(user_id, team_id, name, net_credit, expected.get(user_id, 0))
+            if drift.drift:
+                result.drifts.append(drift)
+        totals = User.objects.values('team_id').annotate(total=Sum('net_credit')).order_by('team_id')
+        result.unbalanced_teams = {row['team_id']: row['total'] for row in totals if row['total']}
+
+        if checkpoint and (after is None or closed > after):
+            save_checkpoint(closed, closed_balances)
+            result.checkpoint = closed
+    if fix:
+        result.repaired = repair(result.drifts)
+    return result
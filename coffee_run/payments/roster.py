@@ -0,0 +1,100 @@
+"""
+Cached user roster.
+
+Users change rarely, so the list of every user of a team and their balance is built with one query
+and kept in the cache, under a key of its own per team, until one of the team's users is saved or
+deleted (see payments.signals) or an order changes their balances. A busy team only ever drops its
+own roster.
+The roster carries an ETag and Last-Modified so repeat page loads can be answered with a 304
+straight from the cache.
+
+The default cache is per process; deployments with several worker processes should point CACHES
+at a shared backend so that invalidations reach every worker.
+"""
+import hashlib
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import User
+from .pagination import PAGE_SIZE, InvalidCursor, decode_cursor, encode_cursor
+
+# versioned, rosters cached before balances were kept in cents hold them in dollars
+ROSTER_CACHE_KEY = 'payments:roster:v2:{team_id}'
+# bounds how long a roster built from a transaction that was racing a write can stay stale
+ROSTER_CACHE_TIMEOUT = 300
+
+
+@dataclass(frozen=True)
+class Roster:
+    # id, name, net_credit and last_payment_date of every user of the team, ordered by name
+    users: tuple
+    etag: str
+    last_modified: datetime
+
+
+def _roster_queryset(team_id: int):
+    # always built from the primary, a lagging replica would otherwise put stale balances back in
+    # the cache right after an order invalidated it
+    return User.objects.using('default').filter(team_id=team_id).values('id', 'name', 'net_credit', 'last_payment_date')
+
+
+def _make_roster(users: list) -> Roster:
+    # sorted in python rather than trusting the database collation, so roster_page can bisect it
+    users.sort(key=lambda user: (user['name'], user['id']))
+    digest = hashlib.sha1(repr([sorted(user.items()) for user in users]).encode()).hexdigest()
+    return Roster(
+        users=tuple(users),
+        etag=f'"{digest}"',
+        last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+    )
+
+
+def get_roster(team_id: int) -> Roster:
+    key = ROSTER_CACHE_KEY.format(team_id=team_id)
+    roster = cache.get(key)
+    if roster is None:
+        roster = _make_roster(list(_roster_queryset(team_id)))
+        cache.set(key, roster, ROSTER_CACHE_TIMEOUT)
+    return roster
+
+
+async def aget_roster(team_id: int) -> Roster:
+    key = ROSTER_CACHE_KEY.format(team_id=team_id)
+    roster = await cache.aget(key)
+    if roster is None:
+        roster = _make_roster([user async for user in _roster_queryset(team_id)])
+        await cache.aset(key, roster, ROSTER_CACHE_TIMEOUT)
+    return roster
+
+
+def invalidate_roster(team_ids: Iterable[int]) -> None:
+    """
+    drop the cached rosters of the teams now, and again once the current transaction commits in
+    case a concurrent request cached the pre-commit balances in the meantime
+    """
+    keys = [ROSTER_CACHE_KEY.format(team_id=team_id) for team_id in set(team_ids)]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def roster_page(roster: Roster, cursor: Optional[str] = None, page_size: int = PAGE_SIZE) -> tuple[list, Optional[str]]:
+    """
+    one page of the roster with the same (name, id) cursors as keyset_page, sliced from the cached list
+    """
+    start = 0
+    if cursor:
+        name, user_id = decode_cursor(cursor, 2)
+        try:
+            after = (name, int(user_id))
+        except ValueError:
+            raise InvalidCursor(f"Malformed cursor {cursor!r}")
+        start = bisect_right(roster.users, after, key=lambda user: (user['name'], user['id']))
+    users = list(roster.users[start:start + page_size])
+    if start + page_size >= len(roster.users):
+        return users, None
+    return users, encode_cursor([users[-1]['name'], users[-1]['id']])
@@ -0,0 +1,125 @@
+"""
+Vectorized fairness simulator.
+
+Runs many independent simulations of the payer-selection rule in payments.fairness side by side
+with NumPy. Orders within one simulation still happen one after another, but each order is a handful
+of array operations across every simulation at once, so millions of simulated orders take seconds.
+
+Money is held in integer cents so that ties on net credit are exact, and each simulated order is
+assumed to happen on its own day (the order index stands in for last_payment_date).
+"""
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+# rank of candidates who have never paid (after everyone who has) and of users not in the order at all
+NEVER_PAID = np.iinfo(np.int64).max - 1
+NOT_PARTICIPATING = np.iinfo(np.int64).max
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    ordering habits of one simulated user: the prices (in cents) they pick from and how often they come along
+    """
+    name: str
+    prices: Sequence[int]
+    weights: Optional[Sequence[float]] = None
+    attendance: float = 1.0
+
+
+@dataclass
+class SimulationResult:
+    # every array is indexed by (simulation, user) unless noted
+    net_credit: np.ndarray
+    payer_count: np.ndarray
+    peak_abs_credit: np.ndarray
+    # indexed by simulation
+    max_order_total: np.ndarray
+
+
+MENU = {'cappucino': 500, 'black': 100, 'chai': 250, 'espresso': 300}
+
+# the office from TestFairness.test_simulation_1
+DEFAULT_PROFILES = [
+    Profile('Bob', [MENU['cappucino']]),
+    Profile('Jeremy', [MENU['black']]),
+    Profile('Pat', [MENU['chai']]),
+    Profile('Dan', list(MENU.values())),
+    Profile('Alice', list(MENU.values())),
+    Profile('Marisol', list(MENU.values())),
+    Profile('Sam', list(MENU.values())),
+]
+
+
+def sample_spend(profiles: Sequence[Profile], simulations: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    what every user spends on one order in every simulation, 0 for users who don't come along
+    """
+    columns = []
+    for profile in profiles:
+        weights = None
+        if profile.weights is not None:
+            weights = np.asarray(profile.weights, dtype=float)
+            weights = weights / weights.sum()
+        spend = rng.choice(np.asarray(profile.prices, dtype=np.int64), size=simulations, p=weights)
+        if profile.attendance < 1:
+            spend = np.where(rng.random(simulations) < profile.attendance, spend, 0)
+        columns.append(spend)
+    return np.stack(columns, axis=1)
+
+
+def settle_step(net_credit: np.ndarray, last_paid: np.ndarray, spent: np.ndarray, step: int) -> np.ndarray:
+    """
+    settle one order in every simulation in place and return each simulation's payer (-1 if nobody ordered)
+    """
+    participating = spent > 0
+    credit = np.where(participating, net_credit, np.iinfo(np.int64).min)
+    candidates = participating & (credit == credit.max(axis=1, keepdims=True))
+    rank = np.where(candidates, np.where(last_paid < 0, NEVER_PAID, last_paid), NOT_PARTICIPATING)
+    payer = rank.argmin(axis=1)
+
+    ordered = np.flatnonzero(participating.any(axis=1))
+    net_credit += spent
+    net_credit[ordered, payer[ordered]] -= spent[ordered].sum(axis=1)
+    last_paid[ordered, payer[ordered]] = step
+    payer[~participating.any(axis=1)] = -1
+    return payer
+
+
+def simulate_spend(spend: Iterable[np.ndarray], users: int, simulations: int) -> SimulationResult:
+    """
+    run the payer-selection rule over a sequence of (simulations, users) spend arrays, one per order
+    """
+    net_credit = np.zeros((simulations, users), dtype=np.int64)
+    last_paid = np.full((simulations, users), -1, dtype=np.int64)
+    payer_count = np.zeros((simulations, users), dtype=np.int64)
+    peak_abs_credit = np.zeros((simulations, users), dtype=np.int64)
+    max_order_total = np.zeros(simulations, dtype=np.int64)
+    rows = np.arange(simulations)
+
+    for step, spent in enumerate(spend):
+        payer = settle_step(net_credit, last_paid, spent, step)
+        paid = payer >= 0
+        payer_count[rows[paid], payer[paid]] += 1
+        np.maximum(peak_abs_credit, np.abs(net_credit), out=peak_abs_credit)
+        np.maximum(max_order_total, spent.sum(axis=1), out=max_order_total)
+
+    return SimulationResult(
+        net_credit=net_credit,
+        payer_count=payer_count,
+        peak_abs_credit=peak_abs_credit,
+        max_order_total=max_order_total,
+    )
+
+
+def simulate(
+    profiles: Sequence[Profile] = DEFAULT_PROFILES,
+    orders: int = 365,
+    simulations: int = 1000,
+    seed: Optional[int] = None,
+) -> SimulationResult:
+    rng = np.random.default_rng(seed)
+    spend = (sample_spend(profiles, simulations, rng) for _ in range(orders))
+    return simulate_spend(spend, len(profiles), simulations)
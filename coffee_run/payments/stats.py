@@ -0,0 +1,119 @@
+"""
+Per-user statistics.
+
+UserStats keeps running totals per user so the stats page reads one row per user instead of
+aggregating the whole order history. Every path that completes orders adds that order's deltas in
+the same transaction: order_stat_deltas works out what one order adds for each user, and
+apply_stat_deltas writes the deltas for any number of orders with a single UPDATE built from F()
+expressions, so concurrent completions add to the stored totals rather than overwriting them.
+rebuild_stats recomputes the table from the history, the remaining orders plus the monthly
+summaries of the archived ones (see payments.archive).
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import fairness
+from .models import User, GroupOrder, OrderItem, UserStats, MonthlySummary, GROUP_ORDER_STATUS
+
+STATS_BATCH_SIZE = 5000
+
+
+@dataclass
+class StatDelta:
+    payer_count: int = 0
+    total_spent: int = 0
+    total_paid: int = 0
+    item_count: int = 0
+    last_order_date: Optional[date] = None
+
+
+def order_stat_deltas(order_date: date, items: Iterable[tuple[int, int]], settlement: fairness.Settlement,
+                      deltas: Optional[dict] = None) -> dict[int, StatDelta]:
+    """
+    add what one completed order contributes, given its (user id, price) items, to deltas
+    """
+    if deltas is None:
+        deltas = {}
+    for user_id, price in items:
+        delta = deltas.setdefault(user_id, StatDelta())
+        delta.total_spent += price
+        delta.item_count += 1
+        if delta.last_order_date is None or order_date > delta.last_order_date:
+            delta.last_order_date = order_date
+    payer = deltas.setdefault(settlement.payer, StatDelta())
+    payer.payer_count += 1
+    payer.total_paid += settlement.total_price
+    return deltas
+
+
+def _delta_update(user_id: int, delta: StatDelta) -> UserStats:
+    stats = UserStats(
+        user_id=user_id,
+        payer_count=F('payer_count') + delta.payer_count,
+        total_spent=F('total_spent') + delta.total_spent,
+        total_paid=F('total_paid') + delta.total_paid,
+        item_count=F('item_count') + delta.item_count,
+        last_order_date=F('last_order_date'),
+    )
+    if delta.last_order_date is not None:
+        last_order_date = Value(delta.last_order_date)
+        stats.last_order_date = Greatest(Coalesce(F('last_order_date'), last_order_date), last_order_date)
+    return stats
+
+
+def apply_stat_deltas(deltas: dict[int, StatDelta]) -> None:
+    if not deltas:
+        return
+    fields = ['payer_count', 'total_spent', 'total_paid', 'item_count', 'last_order_date']
+    updated = UserStats.objects.bulk_update(
+        [_delta_update(user_id, delta) for user_id, delta in deltas.items()], fields, batch_size=STATS_BATCH_SIZE,
+    )
+    if updated == len(deltas):
+        return
+    # rows are created along with their users, this only catches users that somehow don't have one
+    existing = set(UserStats.objects.filter(pk__in=deltas).values_list('pk', flat=True))
+    missing = [user_id for user_id in deltas if user_id not in existing]
+    UserStats.objects.bulk_create([UserStats(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+    UserStats.objects.bulk_update([_delta_update(user_id, deltas[user_id]) for user_id in missing], fields)
+
+
+def rebuild_stats() -> int:
+    """
+    recompute every user's stats from the completed and archived orders and return how many users there are
+    """
+    complete = GROUP_ORDER_STATUS['complete']
+    with transaction.atomic():
+        stats = {user_id: UserStats(user_id=user_id) for user_id in User.objects.values_list('pk', flat=True)}
+        archived = MonthlySummary.objects.values('user_id').annotate(
+            payer_count=Sum('payer_count'), total_spent=Sum('total_spent'), total_paid=Sum('total_paid'),
+            item_count=Sum('item_count'), last_order_date=Max('last_order_date'),
+        ).order_by()
+        for row in archived:
+            user_stats = stats[row['user_id']]
+            user_stats.payer_count = row['payer_count']
+            user_stats.total_spent = row['total_spent']
+            user_stats.total_paid = row['total_paid']
+            user_stats.item_count = row['item_count']
+            user_stats.last_order_date = row['last_order_date']
+        spent = OrderItem.objects.filter(group_order__status=complete).values('ordered_by_id').annotate(
+            total_spent=Sum('price'), item_count=Count('id'), last_order_date=Max('group_order__order_date'),
+        ).order_by()
+        for row in spent:
+            user_stats = stats[row['ordered_by_id']]
+            user_stats.total_spent += row['total_spent']
+            user_stats.item_count += row['item_count']
+            user_stats.last_order_date = max(filter(None, [user_stats.last_order_date, row['last_order_date']]))
+        paid = GroupOrder.objects.filter(status=complete, payer__isnull=False).values('payer_id').annotate(
+            payer_count=Count('id'), total_paid=Sum('order_total'),
+        ).order_by()
+        for row in paid:
+            stats[row['payer_id']].payer_count += row['payer_count']
+            stats[row['payer_id']].total_paid += row['total_paid']
+        UserStats.objects.all().delete()
+        UserStats.objects.bulk_create(stats.values(), batch_size=STATS_BATCH_SIZE)
+    return len(stats)
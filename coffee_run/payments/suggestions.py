@@ -0,0 +1,147 @@
+"""
+Item name autocomplete.
+
+ItemSuggestion keeps one row per user and distinct item name (compared lowercased, with whitespace
+collapsed) with how often they ordered it and what they last paid. Every path that completes
+orders adds to it in the same transaction, with the same F() expression updates as payments.stats,
+so a suggestion query is a prefix range scan over this small table instead of a LIKE over every
+order item ever placed.
+
+Suggestions only come from the requesting team's users. They are ranked by how often the
+requesting user ordered the item, then by how often everyone on the team did, and come with the
+user's own last price for it, or the last price anyone on the team paid.
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import Case, F, Q, QuerySet, Value, When
+
+from .models import OrderItem, ItemSuggestion, GROUP_ORDER_STATUS
+
+SUGGESTION_LIMIT = 10
+# how many of the most ordered prefix matches are ranked for a single query
+SUGGESTION_SCAN_LIMIT = 500
+SUGGESTION_BATCH_SIZE = 5000
+
+
+def name_key(name: str) -> str:
+    return ' '.join(name.lower().split())
+
+
+@dataclass
+class SuggestionDelta:
+    name: str
+    last_price: int
+    last_ordered: date
+    order_count: int = 0
+
+
+def order_suggestion_deltas(order_date: date, items: Iterable[tuple[int, str, int]],
+                            deltas: Optional[dict] = None) -> dict[tuple[int, str], SuggestionDelta]:
+    """
+    add one completed order's (user id, item name, price) items to deltas, keyed by (user id, name key)
+    """
+    if deltas is None:
+        deltas = {}
+    for user_id, name, price in items:
+        key = (user_id, name_key(name))
+        delta = deltas.setdefault(key, SuggestionDelta(name=name, last_price=price, last_ordered=order_date))
+        delta.order_count += 1
+        if order_date >= delta.last_ordered:
+            delta.name, delta.last_price, delta.last_ordered = name, price, order_date
+    return deltas
+
+
+def _suggestion_pks(deltas: dict) -> dict[tuple[int, str], int]:
+    rows = ItemSuggestion.objects.filter(
+        user_id__in={user_id for user_id, _ in deltas}, name_key__in={key for _, key in deltas},
+    ).values_list('pk', 'user_id', 'name_key')
+    return {(user_id, key): pk for pk, user_id, key in rows}
+
+
+def _delta_update(pk: int, delta: SuggestionDelta) -> ItemSuggestion:
+    # the name and price are only replaced by ones at least as recent, whichever completion commits first
+    newer = Q(last_ordered__isnull=True) | Q(last_ordered__lte=delta.last_ordered)
+    return ItemSuggestion(
+        pk=pk,
+        order_count=F('order_count') + delta.order_count,
+        name=Case(When(newer, then=Value(delta.name)), default=F('name')),
+        last_price=Case(When(newer, then=Value(delta.last_price)), default=F('last_price')),
+        last_ordered=Case(When(newer, then=Value(delta.last_ordered)), default=F('last_ordered')),
+    )
+
+
+def apply_suggestion_deltas(deltas: dict[tuple[int, str], SuggestionDelta]) -> None:
+    if not deltas:
+        return
+    pks = _suggestion_pks(deltas)
+    missing = [key for key in deltas if key not in pks]
+    if missing:
+        # an upsert rather than ignore_conflicts so the rows come back with their primary keys, even
+        # the ones a concurrent completion created first
+        created = ItemSuggestion.objects.bulk_create(
+            [ItemSuggestion(user_id=user_id, name_key=key, name=deltas[user_id, key].name) for user_id, key in missing],
+            update_conflicts=True, unique_fields=['user', 'name_key'], update_fields=['name_key'],
+            batch_size=SUGGESTION_BATCH_SIZE,
+        )
+        pks.update({(suggestion.user_id, suggestion.name_key): suggestion.pk for suggestion in created})
+    ItemSuggestion.objects.bulk_update(
+        [_delta_update(pks[key], delta) for key, delta in deltas.items()],
+        ['order_count', 'name', 'last_price', 'last_ordered'],
+        batch_size=SUGGESTION_BATCH_SIZE,
+    )
+
+
+def rebuild_suggestions() -> int:
+    """
+    recompute every suggestion from the completed orders and return how many there are
+    """
+    items = OrderItem.objects.filter(group_order__status=GROUP_ORDER_STATUS['complete']).order_by(
+        'group_order__order_date', 'group_order_id', 'id',
+    ).values_list('group_order__order_date', 'ordered_by_id', 'name', 'price')
+    with transaction.atomic():
+        deltas = {}
+        for order_date, user_id, name, price in items.iterator(chunk_size=SUGGESTION_BATCH_SIZE):
+            order_suggestion_deltas(order_date, [(user_id, name, price)], deltas)
+        ItemSuggestion.objects.all().delete()
+        ItemSuggestion.objects.bulk_create([
+            ItemSuggestion(
+                user_id=user_id, name_key=key, name=delta.name, order_count=delta.order_count,
+                last_price=delta.last_price, last_ordered=delta.last_ordered,
+            )
+            for (user_id, key), delta in deltas.items()
+        ], batch_size=SUGGESTION_BATCH_SIZE)
+    return len(deltas)
+
+
+def suggestion_queryset(prefix: str, team_id: int) -> QuerySet:
+    suggestions = ItemSuggestion.objects.filter(name_key__startswith=name_key(prefix), user__team_id=team_id)
+    return suggestions.order_by('-order_count').values_list(
+        'user_id', 'name_key', 'name', 'order_count', 'last_price', 'last_ordered',
+    )[:SUGGESTION_SCAN_LIMIT]
+
+
+def rank_suggestions(rows: Iterable[tuple], user_id: Optional[int] = None, limit: int = SUGGESTION_LIMIT) -> list[dict]:
+    """
+    merge the per-user rows of suggestion_queryset into one suggestion per item name
+    """
+    merged = {}
+    for row_user_id, key, name, order_count, last_price, last_ordered in rows:
+        suggestion = merged.setdefault(key, {'user_count': 0, 'order_count': 0, 'last_ordered': None})
+        suggestion['order_count'] += order_count
+        if suggestion['last_ordered'] is None or last_ordered > suggestion['last_ordered']:
+            suggestion.update(last_ordered=last_ordered, name=name, price=last_price)
+        if row_user_id == user_id:
+            suggestion.update(user_count=order_count, user_name=name, user_price=last_price)
+    ranked = sorted(merged.items(), key=lambda item: (-item[1]['user_count'], -item[1]['order_count'], item[0]))
+    return [
+        {
+            'name': suggestion.get('user_name', suggestion['name']),
+            'price': suggestion.get('user_price', suggestion['price']),
+            'order_count': suggestion['order_count'],
+            'user_order_count': suggestion['user_count'],
+        }
+        for _, suggestion in ranked[:limit]
+    ]
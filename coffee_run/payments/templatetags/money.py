@@ -0,0 +1,13 @@
+from django import template
+
+from payments.money import format_cents
+
+register = template.Library()
+
+
+@register.filter
+def dollars(cents: int) -> str:
+    """
+    an amount in cents as the pages show it, 250 as 2.50
+    """
+    return format_cents(cents)
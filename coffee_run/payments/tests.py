@@ -1,9 +1,43 @@
-from django.test import TestCase
-from .models import User, OrderItem, GroupOrder, GROUP_ORDER_STATUS
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from coffee_run.testing import QueryBudgetMixin
+from coffee_run.db_router import PrimaryReplicaRouter, read_database, request_routing
+from coffee_run.middleware import PRIMARY_COOKIE, PROFILE_LOCK, ReplicaRoutingMiddleware
+from .middleware import TEAM_COOKIE
+from .models import Team, User, OrderItem, GroupOrder, GROUP_ORDER_STATUS, CreditLedgerEntry, BalanceCheckpoint
+from .ledger import balance_at, balances_at, take_checkpoint
+from .fairness import Account, apply_settlement, choose_payer, settle_order
+from .simulation import DEFAULT_PROFILES, Profile, sample_spend, simulate, simulate_spend
+from .pagination import PAGE_SIZE, keyset_page
+from .benchmarks import compare, explain_access_paths, run_benchmarks, seed
+from .roster import get_roster, roster_page
+from .queue import complete_pending_batch, has_pending_orders
+from .loadtest import check_invariants
+from .stats import rebuild_stats
+from .suggestions import rebuild_suggestions
+from .models import UserStats, ItemSuggestion, MonthlySummary
+from .archive import archive_orders
+from .reconcile import reconcile
+from .money import format_cents, from_cents, to_cents
 from datetime import date as date
 from datetime import timedelta
+from decimal import Decimal
 import random
 from typing import Optional
+import json
+import csv
+import gzip
+import io
+import os
+import pstats
+import tempfile
+import numpy as np
 
 class TestGroupOrder(TestCase):
     def test_can_save_models(self):
@@ -13,8 +47,8 @@ class TestGroupOrder(TestCase):
         user1 = User.objects.create(name='Dan')
         user2 = User.objects.create(name='Jim')
         group_order_1 = GroupOrder.objects.create()
-        order_item_1 = OrderItem.objects.create(name='black coffee', price=1, ordered_by=user1, group_order=group_order_1)
-        order_item_2 = OrderItem.objects.create(name='cappucino', price=5, ordered_by=user2, group_order=group_order_1)
+        order_item_1 = OrderItem.objects.create(name='black coffee', price=100, ordered_by=user1, group_order=group_order_1)
+        order_item_2 = OrderItem.objects.create(name='cappucino', price=500, ordered_by=user2, group_order=group_order_1)
 
         self.assertEqual(
             sum([order_item_1.price, order_item_2.price]),
@@ -26,11 +60,11 @@ class TestGroupOrder(TestCase):
         """
         Scenario: Dan has the highest net credit before the group order and should pay for this one
         """
-        user1 = User.objects.create(name='Dan', net_credit=10, last_payment_date=date(2024, 3, 1))
-        user2 = User.objects.create(name='Jim', net_credit=-5, last_payment_date=date(2024, 3, 2))
+        user1 = User.objects.create(name='Dan', net_credit=1000, last_payment_date=date(2024, 3, 1))
+        user2 = User.objects.create(name='Jim', net_credit=-500, last_payment_date=date(2024, 3, 2))
         group_order_1 = GroupOrder.objects.create()
-        OrderItem.objects.create(name='black coffee', price=1, ordered_by=user1, group_order=group_order_1)
-        OrderItem.objects.create(name='cappucino', price=5, ordered_by=user2, group_order=group_order_1)
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=user1, group_order=group_order_1)
+        OrderItem.objects.create(name='cappucino', price=500, ordered_by=user2, group_order=group_order_1)
 
         self.assertEqual(group_order_1.status, GROUP_ORDER_STATUS['pending'])
 
@@ -40,20 +74,27 @@ class TestGroupOrder(TestCase):
         user1.refresh_from_db()
         user2.refresh_from_db()
         self.assertEqual(group_order_1.payer, user1)
-        self.assertEqual(user1.net_credit, 5) # 10 to begin with -6 (the order) +1 (their item) for this order
-        self.assertEqual(user2.net_credit, 0) # -5 to begin with plus 5 (their item) for the price of their order item
+        self.assertEqual(user1.net_credit, 500) # $10 to begin with -$6 (the order) +$1 (their item) for this order
+        self.assertEqual(user2.net_credit, 0) # -$5 to begin with plus $5 (their item) for the price of their order item
         self.assertEqual(user1.last_payment_date, group_order_1.order_date)
         self.assertEqual(group_order_1.status, GROUP_ORDER_STATUS['complete'])
 
+        # the total and item count are stored on the order when it completes
+        group_order_1.refresh_from_db()
+        self.assertEqual(group_order_1.order_total, 600)
+        self.assertEqual(group_order_1.item_count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(group_order_1.total_price, 600)
+
     def test_group_order_complete_order_resolves_ties_by_last_payment_date(self):
         """
         Scenario: Dan and Jim are tied on net_credit, but Dan paid least recently, so he should pay
         """
-        user1 = User.objects.create(name='Dan', net_credit=10, last_payment_date=date(2024, 3, 1))
-        user2 = User.objects.create(name='Jim', net_credit=10, last_payment_date=date(2024, 3, 2))
+        user1 = User.objects.create(name='Dan', net_credit=1000, last_payment_date=date(2024, 3, 1))
+        user2 = User.objects.create(name='Jim', net_credit=1000, last_payment_date=date(2024, 3, 2))
         group_order_1 = GroupOrder.objects.create()
-        OrderItem.objects.create(name='black coffee', price=1, ordered_by=user1, group_order=group_order_1)
-        OrderItem.objects.create(name='cappucino', price=5, ordered_by=user2, group_order=group_order_1)
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=user1, group_order=group_order_1)
+        OrderItem.objects.create(name='cappucino', price=500, ordered_by=user2, group_order=group_order_1)
 
         self.assertEqual(group_order_1.status, GROUP_ORDER_STATUS['pending'])
         group_order_1.complete_order()
@@ -62,8 +103,8 @@ class TestGroupOrder(TestCase):
         user1.refresh_from_db()
         user2.refresh_from_db()
         self.assertEqual(group_order_1.payer, user1)
-        self.assertEqual(user1.net_credit, 5) # 10 to begin with -6 (the order) +1 (their item)
-        self.assertEqual(user2.net_credit, 15) # 10 to begin with +5 (their item)
+        self.assertEqual(user1.net_credit, 500) # $10 to begin with -$6 (the order) +$1 (their item)
+        self.assertEqual(user2.net_credit, 1500) # $10 to begin with +$5 (their item)
         self.assertEqual(user1.last_payment_date, group_order_1.order_date)
         self.assertEqual(user2.last_payment_date, date(2024, 3, 2))
         self.assertEqual(group_order_1.status, GROUP_ORDER_STATUS['complete'])
@@ -72,12 +113,12 @@ class TestGroupOrder(TestCase):
         """
         Scenario: Dan has the highest net credit but is not participating in the order so he shouldn't pay
         """
-        user1 = User.objects.create(name='Dan', net_credit=100, last_payment_date=date(2024, 3, 1))
-        user2 = User.objects.create(name='Jim', net_credit=10, last_payment_date=date(2024, 3, 2)) # Jim should pay
-        user3 = User.objects.create(name='Alice', net_credit=5, last_payment_date=date(2024, 3, 3))
+        user1 = User.objects.create(name='Dan', net_credit=10000, last_payment_date=date(2024, 3, 1))
+        user2 = User.objects.create(name='Jim', net_credit=1000, last_payment_date=date(2024, 3, 2)) # Jim should pay
+        user3 = User.objects.create(name='Alice', net_credit=500, last_payment_date=date(2024, 3, 3))
         group_order_1 = GroupOrder.objects.create()
-        OrderItem.objects.create(name='black coffee', price=1, ordered_by=user2, group_order=group_order_1)
-        OrderItem.objects.create(name='Cappucino', price=5, ordered_by=user3, group_order=group_order_1)
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=user2, group_order=group_order_1)
+        OrderItem.objects.create(name='Cappucino', price=500, ordered_by=user3, group_order=group_order_1)
 
         self.assertEqual(group_order_1.status, GROUP_ORDER_STATUS['pending'])
         group_order_1.complete_order()
@@ -88,6 +129,1488 @@ class TestGroupOrder(TestCase):
         user3.refresh_from_db()
         self.assertEqual(group_order_1.payer, user2)
 
+    def test_group_order_complete_order_nets_multiple_items_per_user(self):
+        """
+        Scenario: Dan pays and also ordered two items himself, both of them should be credited to him
+        """
+        user1 = User.objects.create(name='Dan', net_credit=1000, last_payment_date=date(2024, 3, 1))
+        user2 = User.objects.create(name='Jim', net_credit=-500, last_payment_date=date(2024, 3, 2))
+        group_order_1 = GroupOrder.objects.create()
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=user1, group_order=group_order_1)
+        OrderItem.objects.create(name='croissant', price=300, ordered_by=user1, group_order=group_order_1)
+        OrderItem.objects.create(name='cappucino', price=500, ordered_by=user2, group_order=group_order_1)
+
+        group_order_1.complete_order()
+
+        user1.refresh_from_db()
+        user2.refresh_from_db()
+        self.assertEqual(group_order_1.payer, user1)
+        self.assertEqual(user1.net_credit, 500) # $10 to begin with -$9 (the order) +$1 +$3 (their items)
+        self.assertEqual(user2.net_credit, 0) # -$5 to begin with +$5 (their item)
+
+    def test_group_order_cannot_be_completed_twice(self):
+        """
+        Scenario: two requests load the same pending order and both try to complete it, only the first may
+        """
+        user1 = User.objects.create(name='Dan', net_credit=1000)
+        user2 = User.objects.create(name='Jim')
+        group_order = GroupOrder.objects.create()
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=user1, group_order=group_order)
+        OrderItem.objects.create(name='cappucino', price=500, ordered_by=user2, group_order=group_order)
+        stale_copy = GroupOrder.objects.get(pk=group_order.pk)
+
+        group_order.complete_order()
+        with self.assertRaisesMessage(ValueError, 'is already complete'):
+            stale_copy.complete_order()
+
+        self.assertEqual(stale_copy.status, GROUP_ORDER_STATUS['pending'])
+        self.assertEqual(CreditLedgerEntry.objects.count(), 2)
+        self.assertEqual(sorted(User.objects.values_list('net_credit', flat=True)), [500, 500])
+
+    def test_load_test_invariants(self):
+        users = [User.objects.create(name=name) for name in ['Dan', 'Jim', 'Alice']]
+        for i in range(4):
+            group_order = GroupOrder.objects.create()
+            OrderItem.objects.create(name='chai', price=250, ordered_by=users[i % 3], group_order=group_order)
+            OrderItem.objects.create(name='espresso', price=300, ordered_by=users[(i + 1) % 3], group_order=group_order)
+            group_order.complete_order()
+        self.assertEqual(check_invariants(4), [])
+
+        # what a lost update looks like
+        users[0].refresh_from_db()
+        User.objects.filter(pk=users[0].pk).update(net_credit=F('net_credit') + 300)
+        problems = check_invariants(5)
+        self.assertEqual(problems[0], 'balances sum to 3.00 instead of 0')
+        self.assertEqual(problems[1], f'Dan has a balance of {format_cents(users[0].net_credit + 300)} but ledger entries adding up to {format_cents(users[0].net_credit)}')
+        self.assertEqual(problems[2:], ['4 orders were completed but 5 were accepted'])
+
+    def test_group_order_complete_order_query_count_is_constant(self):
+        """
+        completing an order costs the same number of queries regardless of how many items are in it
+        """
+        users = [User.objects.create(name=f'User {i}') for i in range(10)]
+        small_order = GroupOrder.objects.create()
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=users[0], group_order=small_order)
+        large_order = GroupOrder.objects.create()
+        for i in range(50):
+            OrderItem.objects.create(name='cappucino', price=500, ordered_by=users[i % 10], group_order=large_order)
+
+        # load items, lock and update users, append to the ledger, update the group order and the users'
+        # stats, look up, insert and update the item suggestions, plus the savepoint around it all
+        with self.assertNumQueries(11):
+            small_order.complete_order()
+        with self.assertNumQueries(11):
+            large_order.complete_order()
+
+class TestCreateGroupOrderView(TestCase):
+    def put_order(self, payload):
+        return self.client.put('/group_orders/create/', data=json.dumps(payload), content_type='application/json')
+
+    def test_put_creates_and_completes_group_order(self):
+        user1 = User.objects.create(name='Dan', net_credit=1000, last_payment_date=date(2024, 3, 1))
+        user2 = User.objects.create(name='Jim', net_credit=-500, last_payment_date=date(2024, 3, 2))
+
+        response = self.put_order([
+            {'user': str(user1.pk), 'name': 'black coffee', 'price': '1.00'},
+            {'user': str(user2.pk), 'name': 'cappucino', 'price': '5.00'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        group_order = GroupOrder.objects.get()
+        self.assertEqual(response.content.decode(), f"/group_orders/{group_order.pk}/detail/")
+        self.assertEqual(group_order.orderitem_set.count(), 2)
+        self.assertEqual(group_order.payer, user1)
+        self.assertEqual(group_order.status, GROUP_ORDER_STATUS['complete'])
+
+    def test_put_rejects_unknown_users(self):
+        user1 = User.objects.create(name='Dan')
+
+        response = self.put_order([
+            {'user': str(user1.pk), 'name': 'black coffee', 'price': '1.00'},
+            {'user': str(user1.pk + 1000), 'name': 'cappucino', 'price': '5.00'},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'1': {'user': 'User does not exist for row 1'}})
+        self.assertFalse(GroupOrder.objects.exists())
+
+    def test_put_rejects_invalid_prices(self):
+        user1 = User.objects.create(name='Dan')
+
+        response = self.put_order([
+            {'user': str(user1.pk), 'name': 'black coffee', 'price': 'one dollar'},
+            {'user': str(user1.pk), 'name': 'cappucino', 'price': '99.01'},
+            {'user': str(user1.pk), 'name': 'espresso', 'price': '99.00'},
+            {'user': str(user1.pk), 'name': 'latte', 'price': '1e100'},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            '0': {'price': 'Price must be a number for row 0'},
+            '1': {'price': 'Price must be less than 100 for row 1'},
+            '3': {'price': 'Price must be a number for row 3'},
+        })
+
+    def test_prices_round_trip_exactly(self):
+        users = [User.objects.create(name=name) for name in ['Dan', 'Jim', 'Pat']]
+        prices = ['0.01', '0.10', '0.29', '1.15', '2.50', '4.35', '33.33', '99.00']
+
+        response = self.put_order([
+            {'user': str(users[i % 3].pk), 'name': f'item {i}', 'price': price} for i, price in enumerate(prices)
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        group_order = GroupOrder.objects.get()
+        self.assertEqual(list(group_order.orderitem_set.order_by('id').values_list('price', flat=True)),
+                         [1, 10, 29, 115, 250, 435, 3333, 9900])
+        self.assertEqual(group_order.order_total, 14073)
+        self.assertEqual(sum(User.objects.values_list('net_credit', flat=True)), 0)
+        items = self.client.get(f'/api/order_items/?group_order={group_order.pk}&fields=price').json()['results']
+        self.assertEqual([item['price'] for item in items], prices)
+        rows = list(csv.DictReader(io.StringIO(b''.join(self.client.get('/export/items.csv').streaming_content).decode())))
+        self.assertEqual([row['price'] for row in rows], prices)
+        self.assertContains(self.client.get(f'/group_orders/{group_order.pk}/detail/'), 'Total Price: $140.73')
+
+    def preview_order(self, payload):
+        return self.client.post('/group_orders/preview/', data=json.dumps(payload), content_type='application/json')
+
+    def test_preview_matches_completed_order_without_writing(self):
+        cache.clear()
+        user1 = User.objects.create(name='Dan', net_credit=1000, last_payment_date=date(2024, 3, 1))
+        user2 = User.objects.create(name='Jim', net_credit=-500, last_payment_date=date(2024, 3, 2))
+        payload = [
+            {'user': str(user1.pk), 'name': 'black coffee', 'price': '1.00'},
+            {'user': str(user1.pk), 'name': 'croissant', 'price': '3'},
+            {'user': str(user2.pk), 'name': 'cappucino', 'price': '5.00'},
+        ]
+
+        self.preview_order(payload)
+        # answered from the cached roster once it is warm
+        with self.assertNumQueries(0):
+            response = self.preview_order(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'payer': user1.pk,
+            'payer_name': 'Dan',
+            'total_price': '9.00',
+            'users': [
+                {'id': user1.pk, 'name': 'Dan', 'net_credit': '10.00', 'change': '-5.00', 'projected_net_credit': '5.00'},
+                {'id': user2.pk, 'name': 'Jim', 'net_credit': '-5.00', 'change': '5.00', 'projected_net_credit': '0.00'},
+            ],
+        })
+        self.assertFalse(GroupOrder.objects.exists())
+
+        # completing the order for real invalidates the roster, so the next preview sees the new balances
+        self.put_order(payload)
+        user1.refresh_from_db()
+        self.assertEqual(user1.net_credit, 500)
+        response = self.preview_order(payload)
+        self.assertEqual(response.json()['users'][0]['net_credit'], '5.00')
+
+    def test_preview_validates_like_put(self):
+        user1 = User.objects.create(name='Dan')
+        response = self.preview_order([{'user': str(user1.pk + 1000), 'name': 'cappucino', 'price': '5.00'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'0': {'user': 'User does not exist for row 0'}})
+        self.assertEqual(self.client.get('/group_orders/preview/').status_code, 405)
+
+    def test_put_query_count_is_constant(self):
+        """
+        validating, inserting and completing an order costs the same number of queries for any number of rows
+        """
+        users = [User.objects.create(name=f'User {i}') for i in range(10)]
+        small_payload = [{'user': str(users[0].pk), 'name': 'black coffee', 'price': '1.00'}]
+        large_payload = [
+            {'user': str(users[i % 10].pk), 'name': 'cappucino', 'price': '5.00'}
+            for i in range(50)
+        ]
+
+        with self.assertNumQueries(16):
+            self.put_order(small_payload)
+        with self.assertNumQueries(16):
+            self.put_order(large_payload)
+
+class TestCreateGroupOrderBatchView(TestCase):
+    def put_batch(self, payload):
+        return self.client.put('/group_orders/batch/', data=json.dumps(payload), content_type='application/json')
+
+    def order(self, *items, order_date=None):
+        order = {'items': [{'user': str(user.pk), 'name': 'coffee', 'price': price} for user, price in items]}
+        if order_date:
+            order['order_date'] = order_date
+        return order
+
+    def test_batch_matches_submitting_orders_one_at_a_time(self):
+        dan = User.objects.create(name='Dan')
+        jim = User.objects.create(name='Jim')
+        pat = User.objects.create(name='Pat')
+        batch = [
+            self.order((dan, '1.00'), (jim, '5.00'), order_date='2024-03-01'),
+            self.order((jim, '5.00'), (jim, '3.00'), (pat, '2.50'), order_date='2024-03-02'),
+            self.order((dan, '3.00'), (pat, '2.50'), order_date='2024-03-02'),
+        ]
+
+        with transaction.atomic():
+            for order in batch:
+                self.client.put('/group_orders/create/', data=json.dumps(order['items']), content_type='application/json')
+            expected = list(User.objects.order_by('id').values_list('net_credit', flat=True))
+            payers = list(GroupOrder.objects.order_by('id').values_list('payer', flat=True))
+            transaction.set_rollback(True)
+
+        response = self.put_batch(batch)
+        self.assertEqual(response.status_code, 200)
+        group_orders = GroupOrder.objects.order_by('id')
+        self.assertEqual(response.json()['detail_urls'], [f"/group_orders/{order.pk}/detail/" for order in group_orders])
+        self.assertEqual(list(User.objects.order_by('id').values_list('net_credit', flat=True)), expected)
+        self.assertEqual([order.payer_id for order in group_orders], payers)
+        self.assertEqual([order.order_date for order in group_orders], [date(2024, 3, 1), date(2024, 3, 2), date(2024, 3, 2)])
+        self.assertEqual(sum(expected), 0)
+
+    def test_batch_query_count_is_constant(self):
+        users = [User.objects.create(name=f'User {i}') for i in range(10)]
+        small_batch = [self.order((users[0], '1.00'))]
+        # (kept under sqlite's limit on query parameters, which would split the bulk inserts)
+        large_batch = [self.order(*[(users[(i + j) % 10], '2.50') for j in range(4)]) for i in range(30)]
+
+        # look up users and the latest order, then lock the users, check for pending orders, insert orders,
+        # items and ledger entries, update stats, look up, insert and update item suggestions and update
+        # users inside the transaction
+        with self.assertNumQueries(14):
+            self.put_batch(small_batch)
+        with self.assertNumQueries(14):
+            self.put_batch(large_batch)
+        self.assertEqual(GroupOrder.objects.count(), 31)
+
+    def test_batch_queues_behind_pending_orders(self):
+        dan = User.objects.create(name='Dan')
+        jim = User.objects.create(name='Jim')
+        first = self.order((dan, '1.00'), (jim, '5.00'))
+        second = self.order((jim, '5.00'), (dan, '3.00'))
+        third = self.order((dan, '2.00'))
+
+        with transaction.atomic():
+            for order in [first, second, third]:
+                self.client.put('/group_orders/create/', data=json.dumps(order['items']), content_type='application/json')
+            expected = list(User.objects.order_by('id').values_list('net_credit', flat=True))
+            payers = list(GroupOrder.objects.order_by('id').values_list('payer', flat=True))
+            transaction.set_rollback(True)
+
+        with override_settings(COMPLETE_ORDERS_ASYNC=True):
+            self.client.put('/group_orders/create/', data=json.dumps(first['items']), content_type='application/json')
+            self.assertEqual(self.put_batch([second]).status_code, 200)
+        # also once the setting is off, while the team still has orders waiting
+        self.assertEqual(self.put_batch([third]).status_code, 200)
+        self.assertEqual(GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['pending']).count(), 3)
+        self.assertEqual(list(User.objects.values_list('net_credit', flat=True)), [0, 0])
+
+        self.assertEqual(complete_pending_batch(), 3)
+        self.assertEqual(list(User.objects.order_by('id').values_list('net_credit', flat=True)), expected)
+        self.assertEqual(list(GroupOrder.objects.order_by('id').values_list('payer', flat=True)), payers)
+
+    def test_batch_rejects_invalid_orders(self):
+        dan = User.objects.create(name='Dan')
+        response = self.put_batch([
+            self.order((dan, '1.00')),
+            self.order((dan, '1.00'), order_date='yesterday'),
+            {'items': []},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'1', '2'})
+        self.assertEqual(response.json()['2'], {'items': {'general': 'Form cannot be blank'}})
+        self.assertFalse(GroupOrder.objects.exists())
+
+        self.assertEqual(self.put_batch([]).status_code, 400)
+
+    def test_batch_rejects_malformed_orders(self):
+        dan = User.objects.create(name='Dan')
+        malformed_rows = [
+            {'user': str(dan.pk)},
+            {'user': 'abc', 'name': 'tea', 'price': '1.00'},
+            {'user': [dan.pk], 'name': 'tea', 'price': '1.00'},
+            {'user': dan.pk + 0.9, 'name': 'tea', 'price': '1.00'},
+            {'user': f'{dan.pk}.9', 'name': ['tea'], 'price': '1.00'},
+            {'user': dan.pk, 'name': 'tea' * 100, 'price': '1.00'},
+        ]
+        response = self.put_batch([
+            self.order((dan, '1.00')), 'coffee', [1], {'items': 'coffee'}, {'items': ['coffee']}, {'items': malformed_rows},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            '1': {'general': 'Group order must be an object'},
+            '2': {'general': 'Group order must be an object'},
+            '3': {'items': {'general': 'Items must be a list of order items'}},
+            '4': {'items': {'0': {'general': 'Row 0 must be an object'}}},
+            '5': {'items': {
+                '0': {'name': 'Name is required for row 0', 'price': 'Price is required for row 0'},
+                '1': {'user': 'User must be a user id for row 1'},
+                '2': {'user': 'User must be a user id for row 2'},
+                '3': {'user': 'User must be a user id for row 3'},
+                '4': {'name': 'Name must be text for row 4', 'user': 'User must be a user id for row 4'},
+                '5': {'name': 'Name must be at most 255 characters for row 5'},
+            }},
+        })
+        self.assertFalse(GroupOrder.objects.exists())
+        # the same rows on their own, and rows that aren't a list
+        self.assertEqual(self.client.put('/group_orders/create/', data=json.dumps([{'user': 'abc'}]),
+                                         content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.put('/group_orders/create/', data=json.dumps(5),
+                                         content_type='application/json').status_code, 400)
+        self.assertEqual(self.client.post('/group_orders/preview/', data=json.dumps({'user': dan.pk}),
+                                          content_type='application/json').status_code, 400)
+
+    def test_batch_rejects_backdated_orders(self):
+        dan = User.objects.create(name='Dan')
+        jim = User.objects.create(name='Jim')
+        self.assertEqual(self.put_batch([self.order((dan, '1.00'), (jim, '5.00'), order_date='2024-03-02')]).status_code, 200)
+
+        response = self.put_batch([
+            self.order((dan, '1.00'), order_date='2024-03-01'),
+            self.order((dan, '1.00'), order_date='2024-03-03'),
+            self.order((jim, '1.00'), order_date='2024-03-02'),
+            self.order((jim, '1.00'), order_date=(date.today() + timedelta(days=1)).isoformat()),
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['0'], {'order_date': 'Orders must be sorted oldest first, 2024-03-01 comes after 2024-03-02'})
+        self.assertEqual(set(response.json()), {'0', '2', '3'})
+        self.assertEqual(GroupOrder.objects.count(), 1)
+        self.assertEqual(User.objects.get(pk=dan.pk).last_payment_date, date(2024, 3, 2))
+
+class TestCompletePendingOrders(TestCase):
+    def put_order(self, *items):
+        payload = [{'user': str(user.pk), 'name': 'coffee', 'price': price} for user, price in items]
+        return self.client.put('/group_orders/create/', data=json.dumps(payload), content_type='application/json')
+
+    def test_worker_completes_orders_like_the_synchronous_path(self):
+        dan = User.objects.create(name='Dan')
+        jim = User.objects.create(name='Jim')
+        orders = [[(dan, '1.00'), (jim, '5.00')], [(jim, '5.00'), (jim, '3.00')], [(dan, '3.00'), (jim, '2.50')]]
+
+        with transaction.atomic():
+            for items in orders:
+                self.put_order(*items)
+            expected = list(User.objects.order_by('id').values_list('net_credit', 'last_payment_date'))
+            payers = list(GroupOrder.objects.order_by('id').values_list('payer', flat=True))
+            transaction.set_rollback(True)
+
+        with override_settings(COMPLETE_ORDERS_ASYNC=True):
+            for items in orders:
+                response = self.put_order(*items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['pending']).count(), 3)
+        self.assertEqual(list(User.objects.values_list('net_credit', flat=True)), [0, 0])
+
+        pending = GroupOrder.objects.order_by('id').last()
+        response = self.client.get(f'/group_orders/{pending.pk}/detail/')
+        self.assertContains(response, 'Payer: not chosen yet, this order is pending')
+        self.assertContains(self.client.get('/group_orders/'), 'Total Price: $5.50 | Payer: pending')
+
+        out = io.StringIO()
+        call_command('complete_pending_orders', '--once', '--batch-size', '2', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Completed 2 group orders', 'Completed 1 group orders', 'Completed 3 group orders in total'
+        ])
+        self.assertEqual(list(User.objects.order_by('id').values_list('net_credit', 'last_payment_date')), expected)
+        self.assertEqual(list(GroupOrder.objects.order_by('id').values_list('payer', flat=True)), payers)
+        self.assertEqual(CreditLedgerEntry.objects.count(), 5)
+        self.assertContains(self.client.get(f'/group_orders/{pending.pk}/detail/'), 'Payer: Jim')
+
+    def test_orders_left_without_items_are_dropped(self):
+        dan = User.objects.create(name='Dan')
+        jim = User.objects.create(name='Jim')
+        pat = User.objects.create(name='Pat')
+        with override_settings(COMPLETE_ORDERS_ASYNC=True):
+            self.put_order((pat, '2.00'))
+            self.put_order((dan, '1.00'), (jim, '3.00'))
+        orphaned, waiting = GroupOrder.objects.order_by('id')
+        # deleting the only participant of the head of the queue takes its items with it
+        self.client.post(f'/users/{pat.pk}/delete/')
+        self.assertFalse(User.objects.filter(pk=pat.pk).exists())
+
+        with self.assertLogs('payments.queue', level='WARNING') as logs:
+            call_command('complete_pending_orders', '--once', stdout=io.StringIO())
+        self.assertIn(f'Deleting pending GroupOrder #{orphaned.pk}', logs.output[0])
+        self.assertFalse(GroupOrder.objects.filter(pk=orphaned.pk).exists())
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.status, GROUP_ORDER_STATUS['complete'])
+        self.assertEqual(sum(User.objects.values_list('net_credit', flat=True)), 0)
+
+    def test_empty_queue(self):
+        self.assertEqual(complete_pending_batch(), 0)
+        self.assertFalse(has_pending_orders())
+
+    def test_pending_orders_are_per_team(self):
+        office = Team.objects.create(name='Office', slug='office')
+        GroupOrder.objects.create()
+        self.assertTrue(has_pending_orders())
+        self.assertFalse(has_pending_orders(office.pk))
+        GroupOrder.objects.create(team=office)
+        self.assertTrue(has_pending_orders(office.pk))
+
+class TestGroupOrderViews(TestCase):
+    def create_completed_orders(self, count):
+        users = [User.objects.create(name=f'User {i}') for i in range(5)]
+        for i in range(count):
+            group_order = GroupOrder.objects.create()
+            OrderItem.objects.create(name='black coffee', price=100, ordered_by=users[i % 5], group_order=group_order)
+            OrderItem.objects.create(name='cappucino', price=500, ordered_by=users[(i + 1) % 5], group_order=group_order)
+            group_order.complete_order()
+
+    def test_list_group_orders_query_count_is_constant(self):
+        self.create_completed_orders(20)
+
+        # one query for the page of orders and one for the payer filter options
+        with self.assertNumQueries(2):
+            response = self.client.get('/group_orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Total Price: $6.00', count=20)
+
+    def test_keyset_page_walks_every_order_once_newest_first(self):
+        self.create_completed_orders(5)
+        GroupOrder.objects.filter(pk__in=GroupOrder.objects.order_by('id').values('pk')[:3]).update(order_date=date(2024, 3, 1))
+
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = keyset_page(GroupOrder.objects.all(), ['-order_date', '-id'], cursor, page_size=2)
+            self.assertLessEqual(len(page), 2)
+            seen.extend(order.pk for order in page)
+            if cursor is None:
+                break
+        self.assertEqual(seen, list(GroupOrder.objects.order_by('-order_date', '-id').values_list('pk', flat=True)))
+
+    def test_keyset_filter_bounds_the_first_key(self):
+        self.create_completed_orders(3)
+        _, cursor = keyset_page(GroupOrder.objects.all(), ['-order_date', '-id'], page_size=1)
+        with CaptureQueriesContext(connection) as queries:
+            keyset_page(GroupOrder.objects.all(), ['-order_date', '-id'], cursor, page_size=1)
+        # the range the order_date index is scanned from, the ORs alone can't be used as one
+        self.assertIn('"payments_grouporder"."order_date" <= ', queries[0]['sql'])
+
+    def test_list_group_orders_next_page_url_keeps_filters(self):
+        self.create_completed_orders(PAGE_SIZE + 1)
+
+        response = self.client.get('/group_orders/', {'status': 'complete'})
+        self.assertEqual(len(response.context['group_orders']), PAGE_SIZE)
+        response = self.client.get(response.context['next_page_url'])
+        self.assertEqual(len(response.context['group_orders']), 1)
+        self.assertEqual(response.context['filters']['status'], 'complete')
+        self.assertIsNone(response.context['next_page_url'])
+
+    def test_list_group_orders_filters(self):
+        self.create_completed_orders(5)
+        first, second = GroupOrder.objects.order_by('id')[:2]
+        GroupOrder.objects.filter(pk=first.pk).update(order_date=date(2024, 1, 1))
+
+        response = self.client.get('/group_orders/', {'date_to': '2024-01-31'})
+        self.assertEqual([order.pk for order in response.context['group_orders']], [first.pk])
+
+        response = self.client.get('/group_orders/', {'payer': second.payer_id, 'status': 'complete'})
+        self.assertEqual(
+            [order.pk for order in response.context['group_orders']],
+            list(GroupOrder.objects.filter(payer=second.payer).order_by('-order_date', '-id').values_list('pk', flat=True))
+        )
+
+        response = self.client.get('/group_orders/', {'status': 'cancelled', 'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'status', 'date_from'})
+
+    def test_list_group_orders_rejects_malformed_cursor(self):
+        response = self.client.get('/group_orders/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_group_order_query_count_is_constant(self):
+        self.create_completed_orders(1)
+        group_order = GroupOrder.objects.get()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/group_orders/{group_order.pk}/detail/')
+        self.assertContains(response, 'Total Price: $6.00')
+
+class TestRequestTiming(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        users = [User.objects.create(name=f'User {i}') for i in range(3)]
+        for i in range(5):
+            group_order = GroupOrder.objects.create()
+            OrderItem.objects.create(name='chai', price=250, ordered_by=users[i % 3], group_order=group_order)
+            group_order.complete_order()
+        self.group_order = group_order
+
+    def test_views_stay_within_query_budget(self):
+        self.assertQueryBudget(self.client.get('/users/'), 1)
+        self.assertQueryBudget(self.client.get('/group_orders/'), 2)
+        self.assertQueryBudget(self.client.get(f'/group_orders/{self.group_order.pk}/detail/'), 2)
+        with self.assertMaxQueries(2):
+            self.client.get('/group_orders/')
+
+    async def test_async_views_under_asgi(self):
+        response = await self.async_client.get('/group_orders/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget(response, 2)
+
+        response = await self.async_client.get(f'/group_orders/{self.group_order.pk}/detail/')
+        self.assertContains(response, 'Total Price: $2.50')
+        self.assertQueryBudget(response, 2)
+
+        response = await self.async_client.get('/group_orders/create/')
+        self.assertEqual(len(response.context['users']), 3)
+
+        user = await User.objects.afirst()
+        response = await self.async_client.put(
+            '/group_orders/create/',
+            data=json.dumps([{'user': str(user.pk), 'name': 'chai', 'price': '2.50'}]),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['complete']).acount(), 6)
+
+    async def test_missing_group_order_is_404(self):
+        response = await self.async_client.get('/group_orders/0/detail/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_server_timing_header(self):
+        response = self.client.get('/group_orders/')
+        self.assertRegex(response['Server-Timing'], r'^db;desc="2 queries";dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(SLOW_REQUEST_QUERIES=2)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('coffee_run.requests', level='WARNING') as logs:
+            self.client.get('/group_orders/')
+        self.assertIn('Slow request GET /group_orders/', logs.output[0])
+
+    def test_sampled_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(PROFILE_REQUESTS=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=profile_dir):
+                self.client.get('/users/')
+            profiles = os.listdir(profile_dir)
+            self.assertEqual(len(profiles), 1)
+            self.assertTrue(profiles[0].endswith('-GET-users.prof'))
+
+    async def test_async_requests_profile_their_queries(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(PROFILE_REQUESTS=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=profile_dir):
+                await self.async_client.get('/group_orders/')
+            [profile] = os.listdir(profile_dir)
+            functions = pstats.Stats(os.path.join(profile_dir, profile)).stats
+            # the ORM's work happens on the request's sync thread, not on the event loop
+            self.assertTrue(any(name == 'execute_sql' for _, _, name in functions))
+
+    def test_overlapping_requests_are_not_profiled(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(PROFILE_REQUESTS=True, PROFILE_SAMPLE_RATE=1, PROFILE_DIR=profile_dir):
+                # another request is being profiled
+                with PROFILE_LOCK:
+                    response = self.client.get('/users/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(os.listdir(profile_dir), [])
+                self.client.get('/users/')
+            self.assertEqual(len(os.listdir(profile_dir)), 1)
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class TestReplicaRouting(TestCase):
+    def route(self, request):
+        routed = []
+        def view(request):
+            routed.append(read_database())
+            if request.method == 'PUT':
+                User.objects.create(name='Written')
+            return HttpResponse()
+        response = ReplicaRoutingMiddleware(view)(request)
+        return routed[0], response
+
+    def test_reads_use_the_primary_outside_requests(self):
+        self.assertEqual(read_database(), 'default')
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(User), 'default')
+        with request_routing(replica_reads=True):
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(User), 'replica1')
+            self.assertEqual(PrimaryReplicaRouter().db_for_write(User), 'default')
+
+    def test_related_reads_follow_the_instance(self):
+        group_order = GroupOrder.objects.create()
+        with request_routing(replica_reads=True):
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(OrderItem, instance=group_order), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        with request_routing(replica_reads=True):
+            self.assertEqual(read_database(), 'default')
+
+    def test_gets_read_from_replica_and_writes_pin_to_primary(self):
+        factory = RequestFactory()
+        database, response = self.route(factory.get('/group_orders/'))
+        self.assertEqual(database, 'replica1')
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+        database, response = self.route(factory.put('/group_orders/create/'))
+        self.assertEqual(database, 'default')
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'], 10)
+
+        # a POST that doesn't write reads from the primary but doesn't pin the client to it
+        database, response = self.route(factory.post('/group_orders/preview/'))
+        self.assertEqual(database, 'default')
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+        request = factory.get('/group_orders/')
+        request.COOKIES[PRIMARY_COOKIE] = '1'
+        database, _ = self.route(request)
+        self.assertEqual(database, 'default')
+        self.assertEqual(read_database(), 'default')
+
+    def test_successful_writes_set_the_sticky_cookie(self):
+        user = User.objects.create(name='Bob')
+        response = self.client.put(
+            '/group_orders/create/',
+            data=json.dumps([{'user': str(user.pk), 'name': 'chai', 'price': '2.50'}]),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+
+        response = self.client.post(
+            '/group_orders/preview/',
+            data=json.dumps([{'user': str(user.pk), 'name': 'chai', 'price': '2.50'}]),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+class TestRoster(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dan = User.objects.create(name='Dan', net_credit=1000)
+        self.jim = User.objects.create(name='Jim', net_credit=-1000)
+
+    def test_roster_is_cached_until_a_user_changes(self):
+        with self.assertNumQueries(1):
+            self.client.get('/users/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/users/')
+        self.assertContains(response, 'Dan | Net Credit: 10.00')
+
+        self.dan.name = 'Daniel'
+        self.dan.save()
+        with self.assertNumQueries(1):
+            response = self.client.get('/users/')
+        self.assertContains(response, 'Daniel | Net Credit: 10.00')
+
+        self.jim.delete()
+        self.assertNotContains(self.client.get('/users/'), 'Jim')
+
+    def test_complete_order_invalidates_roster(self):
+        get_roster(self.jim.team_id)
+        group_order = GroupOrder.objects.create()
+        OrderItem.objects.create(name='chai', price=250, ordered_by=self.jim, group_order=group_order)
+        group_order.complete_order()
+
+        self.assertEqual([user['net_credit'] for user in get_roster(self.jim.team_id).users], [1000, -1000])
+
+    def test_conditional_get_returns_304_without_queries(self):
+        response = self.client.get('/users/')
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/users/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/users/', headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+        User.objects.create(name='Pat')
+        response = self.client.get('/users/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+
+    def test_roster_page_matches_keyset_page(self):
+        for i in range(5):
+            User.objects.create(name=f'User {i}')
+        roster = get_roster(self.dan.team_id)
+        cursor = None
+        expected_cursor = None
+        while True:
+            users, cursor = roster_page(roster, cursor, page_size=3)
+            expected, expected_cursor = keyset_page(User.objects.all(), ['name', 'id'], expected_cursor, page_size=3)
+            self.assertEqual([user['id'] for user in users], [user.pk for user in expected])
+            self.assertEqual(cursor, expected_cursor)
+            if cursor is None:
+                break
+
+class TestTeams(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.office = Team.objects.create(name='Office', slug='office')
+        self.dan = User.objects.create(name='Dan', net_credit=1000)
+        self.jim = User.objects.create(name='Jim', net_credit=-1000)
+        # the same name is fine on another team
+        self.other_dan = User.objects.create(team=self.office, name='Dan')
+        self.pat = User.objects.create(team=self.office, name='Pat')
+
+    def use_team(self, team_id):
+        self.client.cookies[TEAM_COOKIE] = str(team_id)
+
+    def create_order(self, *users):
+        return self.client.put('/group_orders/create/', data=json.dumps([
+            {'user': str(user.pk), 'name': 'chai', 'price': '2.50'} for user in users
+        ]), content_type='application/json')
+
+    def test_users_are_listed_per_team(self):
+        response = self.client.get('/users/')
+        self.assertContains(response, 'Jim')
+        self.assertNotContains(response, 'Pat')
+        self.assertIn('Cookie', response['Vary'])
+        self.use_team(self.office.pk)
+        response = self.client.get('/users/')
+        self.assertContains(response, 'Pat')
+        self.assertNotContains(response, 'Jim')
+
+    def test_select_team(self):
+        response = self.client.post('/teams/', {'team': self.office.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[TEAM_COOKIE].value, str(self.office.pk))
+        self.assertContains(self.client.get('/teams/'), f'value="{self.office.pk}" checked')
+        self.assertEqual(self.client.post('/teams/', {'team': 'nope'}).status_code, 400)
+
+    def test_orders_stay_within_their_team(self):
+        self.use_team(self.office.pk)
+        # a user of another team can't be added to the order
+        self.assertEqual(self.create_order(self.pat, self.dan).status_code, 400)
+        response = self.create_order(self.pat, self.other_dan)
+        self.assertEqual(response.status_code, 200)
+        group_order = GroupOrder.objects.get()
+        self.assertEqual(group_order.team, self.office)
+        self.assertEqual(self.client.get(response.content.decode()).status_code, 200)
+
+        self.use_team(self.dan.team_id)
+        self.assertEqual(self.client.get(response.content.decode()).status_code, 404)
+        self.assertEqual(self.client.get('/group_orders/').context['group_orders'], [])
+        self.assertEqual(json.loads(self.client.get('/api/order_items/').content)['results'], [])
+
+        group_order = GroupOrder.objects.create(team=self.office)
+        OrderItem.objects.create(name='chai', price=100, ordered_by=self.dan, group_order=group_order)
+        with self.assertRaises(ValueError):
+            group_order.complete_order()
+
+    def test_another_team_leaves_the_roster_cached(self):
+        self.client.get('/users/')
+        self.use_team(self.office.pk)
+        self.assertEqual(self.create_order(self.pat, self.other_dan).status_code, 200)
+        self.use_team(self.dan.team_id)
+        with self.assertNumQueries(0):
+            self.client.get('/users/')
+
+    def test_user_names_are_unique_per_team(self):
+        response = self.client.post('/users/create/', {'name': 'Jim'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'already exists in this team')
+        self.use_team(self.office.pk)
+        self.assertEqual(self.client.post('/users/create/', {'name': 'Jim'}).status_code, 302)
+        self.assertEqual(User.objects.get(team=self.office, name='Jim').team, self.office)
+        # and users of another team can't be edited
+        self.assertEqual(self.client.get(f'/users/{self.dan.pk}/update/').status_code, 404)
+
+    def test_delete_user(self):
+        # users of another team can't be deleted
+        self.use_team(self.office.pk)
+        self.assertEqual(self.client.post(f'/users/{self.dan.pk}/delete/').status_code, 404)
+        self.use_team(self.dan.team_id)
+        response = self.client.post(f'/users/{self.dan.pk}/delete/')
+        self.assertRedirects(response, '/users/')
+        self.assertFalse(User.objects.filter(pk=self.dan.pk).exists())
+        self.assertTrue(User.objects.filter(pk=self.other_dan.pk).exists())
+
+    def test_pending_orders_are_queued_per_team(self):
+        with override_settings(COMPLETE_ORDERS_ASYNC=True):
+            self.create_order(self.dan, self.jim)
+            self.use_team(self.office.pk)
+            self.create_order(self.pat, self.other_dan)
+        self.assertEqual(complete_pending_batch(team_id=self.office.pk), 1)
+        self.assertEqual(GroupOrder.objects.get(status=GROUP_ORDER_STATUS['complete']).team, self.office)
+        self.assertEqual(complete_pending_batch(), 1)
+
+class TestJsonApi(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(name=name) for name in ['Dan', 'Jim', 'Alice']]
+        for day in range(1, 8):
+            group_order = GroupOrder.objects.create(order_date=date(2024, 3, day))
+            for user in self.users:
+                OrderItem.objects.create(name='chai', price=250, ordered_by=user, group_order=group_order)
+            group_order.complete_order()
+        self.latest = group_order
+
+    def test_group_orders_with_embedded_payer_and_items(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/group_orders/?fields=id,order_total&embed=payer,items&limit=5')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        body = response.json()
+        self.assertEqual(len(body['results']), 5)
+        first = body['results'][0]
+        self.assertEqual(set(first), {'id', 'order_total', 'payer', 'items'})
+        self.assertEqual(first['id'], self.latest.pk)
+        self.assertEqual(first['order_total'], '7.50')
+        self.assertEqual(first['payer'], {'id': self.latest.payer_id, 'name': self.latest.payer.name})
+        self.assertEqual([item['ordered_by_id'] for item in first['items']], [user.pk for user in self.users])
+        self.assertEqual(first['items'][0], {
+            'id': first['items'][0]['id'], 'name': 'chai', 'price': '2.50', 'ordered_by_id': self.users[0].pk,
+        })
+
+        # the next page continues where the first stopped, and costs the same
+        with self.assertNumQueries(2):
+            body = self.client.get(body['next']).json()
+        self.assertEqual(len(body['results']), 2)
+        self.assertIsNone(body['next'])
+        self.assertEqual(body['results'][-1]['items'][0]['name'], 'chai')
+
+    def test_order_items_filtered_with_embedded_user(self):
+        dan = self.users[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/order_items/?user={dan.pk}&fields=price,group_order_id&embed=ordered_by')
+        results = response.json()['results']
+        self.assertEqual(len(results), 7)
+        self.assertEqual(results[0], {
+            'price': '2.50', 'group_order_id': results[0]['group_order_id'], 'ordered_by': {'id': dan.pk, 'name': 'Dan'},
+        })
+        response = self.client.get(f'/api/order_items/?group_order={self.latest.pk}')
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_users_come_from_the_roster(self):
+        self.client.get('/api/users/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/?fields=name,net_credit&limit=2')
+        body = response.json()
+        self.assertEqual([user['name'] for user in body['results']], ['Alice', 'Dan'])
+        self.assertEqual(set(body['results'][0]), {'name', 'net_credit'})
+        self.assertEqual([user['name'] for user in self.client.get(body['next']).json()['results']], ['Jim'])
+
+    def test_etag(self):
+        response = self.client.get('/api/group_orders/?limit=3')
+        etag = response['ETag']
+        response = self.client.get('/api/group_orders/?limit=3', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        self.latest.orderitem_set.update(price=300)
+        GroupOrder.objects.filter(pk=self.latest.pk).update(order_total=900)
+        response = self.client.get('/api/group_orders/?limit=3', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.client.get('/api/users/?fields=password').json(), {
+            'fields': 'Unknown fields password, expected some of id, name, net_credit, last_payment_date',
+        })
+        self.assertEqual(self.client.get('/api/group_orders/?embed=ordered_by').status_code, 400)
+        self.assertEqual(self.client.get('/api/group_orders/?status=lost').status_code, 400)
+        self.assertEqual(self.client.get('/api/order_items/?limit=0').json(), {'limit': 'limit must be between 1 and 500'})
+        self.assertEqual(self.client.get('/api/order_items/?cursor=nope').status_code, 400)
+
+class TestExports(TestCase):
+    def setUp(self):
+        self.dan = User.objects.create(name='Dan', net_credit=1000)
+        self.jim = User.objects.create(name='Jim', net_credit=-500)
+        self.group_order = GroupOrder.objects.create()
+        OrderItem.objects.create(name='black coffee', price=100, ordered_by=self.dan, group_order=self.group_order)
+        OrderItem.objects.create(name='cappucino, large', price=500, ordered_by=self.jim, group_order=self.group_order)
+        self.group_order.complete_order()
+
+    def test_export_items_csv(self):
+        response = self.client.get('/export/items.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:3], ['id', 'group_order_id', 'group_order__order_date'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2][4:], ['cappucino, large', '5.00', str(self.jim.pk), 'Jim'])
+
+    def test_export_users_ndjson(self):
+        response = self.client.get('/export/users.ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Dan', 'Jim'])
+        self.assertEqual(rows[0]['net_credit'], '5.00')
+        self.assertEqual(rows[0]['last_payment_date'], self.group_order.order_date.isoformat())
+
+    async def test_export_streams_under_asgi(self):
+        response = await self.async_client.get('/export/users.ndjson')
+        # an async iterator, the ASGI handler would read a sync one into a list first
+        self.assertTrue(response.is_async)
+        content = b''.join([part async for part in response.streaming_content])
+        self.assertEqual([json.loads(line)['name'] for line in content.decode().splitlines()], ['Dan', 'Jim'])
+
+    def test_export_unknown_dataset_or_format(self):
+        self.assertEqual(self.client.get('/export/secrets.csv').status_code, 404)
+        self.assertEqual(self.client.get('/export/users.xlsx').status_code, 404)
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command('export', 'orders', '--format', 'ndjson', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['payer__name'], 'Dan')
+        self.assertEqual(rows[0]['order_total'], '6.00')
+
+class TestCreditLedger(TestCase):
+    def setUp(self):
+        self.dan = User.objects.create(name='Dan')
+        self.jim = User.objects.create(name='Jim')
+        for day, (dan_price, jim_price) in enumerate([(100, 500), (100, 500), (200, 300), (400, 100)], start=1):
+            group_order = GroupOrder.objects.create()
+            GroupOrder.objects.filter(pk=group_order.pk).update(order_date=date(2024, 3, day))
+            group_order.refresh_from_db()
+            OrderItem.objects.create(name='coffee', price=dan_price, ordered_by=self.dan, group_order=group_order)
+            OrderItem.objects.create(name='coffee', price=jim_price, ordered_by=self.jim, group_order=group_order)
+            group_order.complete_order()
+
+    def test_ledger_matches_balances(self):
+        self.dan.refresh_from_db()
+        self.jim.refresh_from_db()
+        self.assertEqual(CreditLedgerEntry.objects.count(), 8)
+        self.assertEqual(balances_at(date(2024, 3, 4)), {self.dan.pk: self.dan.net_credit, self.jim.pk: self.jim.net_credit})
+        self.assertEqual(sum(balances_at(date(2024, 3, 4)).values()), 0)
+
+    def test_ledger_entries_are_append_only(self):
+        entry = CreditLedgerEntry.objects.first()
+        entry.delta = 100
+        with self.assertRaises(ValueError):
+            entry.save()
+
+    def test_balance_at_uses_nearest_checkpoint(self):
+        expected = {day: balances_at(date(2024, 3, day)) for day in range(1, 5)}
+        call_command('snapshot_balances', '--as-of', '2024-03-02', stdout=io.StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.get().balancesnapshot_set.count(), 2)
+
+        for day in range(1, 5):
+            self.assertEqual(balances_at(date(2024, 3, day)), expected[day])
+            self.assertEqual(balance_at(self.dan, date(2024, 3, day)), expected[day][self.dan.pk])
+
+        # checkpoint plus a one day tail of ledger entries
+        with self.assertNumQueries(3):
+            balances_at(date(2024, 3, 3))
+
+    def test_checkpoints_wait_for_pending_orders(self):
+        pending = GroupOrder.objects.create()
+        GroupOrder.objects.filter(pk=pending.pk).update(order_date=date(2024, 3, 3))
+        pending.refresh_from_db()
+        OrderItem.objects.create(name='tea', price=300, ordered_by=self.dan, group_order=pending)
+        OrderItem.objects.create(name='tea', price=200, ordered_by=self.jim, group_order=pending)
+
+        # the pending order's ledger entries will be dated March 3rd
+        with self.assertRaisesMessage(CommandError, 'the last closed day is 2024-03-02'):
+            call_command('snapshot_balances', '--as-of', '2024-03-03', stdout=io.StringIO())
+        with self.assertRaises(ValueError):
+            take_checkpoint(date.today())
+        take_checkpoint(date(2024, 3, 2))
+
+        pending.complete_order()
+        take_checkpoint(date(2024, 3, 4))
+        self.dan.refresh_from_db()
+        self.jim.refresh_from_db()
+        self.assertEqual(balances_at(date(2024, 3, 4)), {self.dan.pk: self.dan.net_credit, self.jim.pk: self.jim.net_credit})
+        self.assertEqual(balance_at(self.dan, date(2024, 3, 5)), self.dan.net_credit)
+
+class TestUserStats(TestCase):
+    def setUp(self):
+        self.dan = User.objects.create(name='Dan', net_credit=1000, last_payment_date=date(2024, 3, 1))
+        self.jim = User.objects.create(name='Jim')
+        self.alice = User.objects.create(name='Alice')
+
+    def complete(self, order_date, *items):
+        group_order = GroupOrder.objects.create(order_date=order_date)
+        for user, name, price in items:
+            OrderItem.objects.create(name=name, price=price, ordered_by=user, group_order=group_order)
+        return group_order.complete_order()
+
+    def stats(self):
+        return {
+            stats.user.name: (stats.payer_count, stats.total_spent, stats.total_paid, stats.item_count, stats.last_order_date)
+            for stats in UserStats.objects.select_related('user')
+        }
+
+    def test_complete_order_updates_stats(self):
+        self.complete(date(2024, 3, 4), (self.dan, 'black coffee', 100), (self.dan, 'croissant', 300), (self.jim, 'chai', 250))
+        self.complete(date(2024, 3, 5), (self.dan, 'cappucino', 500), (self.jim, 'chai', 250))
+
+        stats = self.stats()
+        # Dan still has the most credit after paying for the first order, so pays for both
+        self.assertEqual(stats['Dan'], (2, 900, 1400, 3, date(2024, 3, 5)))
+        self.assertEqual(stats['Jim'], (0, 500, 0, 2, date(2024, 3, 5)))
+        self.assertEqual(stats['Alice'], (0, 0, 0, 0, None))
+        self.assertEqual(UserStats.objects.get(user=self.dan).average_item_price, 300)
+        self.assertContains(self.client.get('/users/stats/'), '<td>9.00</td>')
+
+    def test_every_completion_path_matches_a_rebuild(self):
+        self.complete(date(2024, 3, 4), (self.dan, 'black coffee', 100), (self.jim, 'chai', 250))
+        self.client.put('/group_orders/batch/', data=json.dumps([
+            {'order_date': '2024-03-05', 'items': [{'user': str(self.alice.pk), 'name': 'espresso', 'price': '3.00'}]},
+            {'order_date': '2024-03-06', 'items': [
+                {'user': str(self.jim.pk), 'name': 'chai', 'price': '2.50'},
+                {'user': str(self.alice.pk), 'name': 'chai', 'price': '2.50'},
+            ]},
+        ]), content_type='application/json')
+        with override_settings(COMPLETE_ORDERS_ASYNC=True):
+            self.client.put('/group_orders/create/', data=json.dumps([
+                {'user': str(self.dan.pk), 'name': 'cappucino', 'price': '5.00'},
+                {'user': str(self.alice.pk), 'name': 'black coffee', 'price': '1.00'},
+            ]), content_type='application/json')
+        complete_pending_batch()
+        call_command('import_orders', self.write_import(), create_users=True, stdout=io.StringIO())
+
+        incremental = self.stats()
+        rebuild_stats()
+        self.assertEqual(incremental, self.stats())
+        self.assertEqual(incremental['Bob'], (1, 400, 400, 1, date(2099, 1, 1)))
+
+    def write_import(self):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        self.addCleanup(os.unlink, f.name)
+        with f:
+            f.write('order,order_date,user,name,price\n1,2099-01-01,Bob,latte,4.00\n')
+        return f.name
+
+    def test_rebuild_command(self):
+        self.complete(date(2024, 3, 4), (self.dan, 'black coffee', 100), (self.jim, 'chai', 250))
+        expected = self.stats()
+        UserStats.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['Rebuilt stats for 3 users', 'Rebuilt 2 item suggestions'])
+        self.assertEqual(self.stats(), expected)
+
+    def test_stats_page_is_one_query(self):
+        for day in range(1, 6):
+            self.complete(date(2024, 4, day), (self.dan, 'black coffee', 100), (self.jim, 'chai', 250), (self.alice, 'espresso', 300))
+        with self.assertNumQueries(1):
+            response = self.client.get('/users/stats/')
+        payer_counts = [stats.payer_count for stats in response.context['stats']]
+        self.assertEqual(payer_counts, sorted(payer_counts, reverse=True))
+        self.assertEqual(sum(payer_counts), 5)
+        self.assertContains(response, 'Alice')
+
+class TestArchive(TestCase):
+    def setUp(self):
+        self.dan = User.objects.create(name='Dan')
+        self.jim = User.objects.create(name='Jim')
+        self.alice = User.objects.create(name='Alice')
+        for order_date, dan_price, jim_price, alice_price in [
+            (date(2024, 1, 10), 100, 500, 300), (date(2024, 1, 20), 200, 300, 400),
+            (date(2024, 2, 5), 400, 100, 200), (date(2024, 2, 29), 300, 300, 300),
+            (date(2024, 3, 1), 500, 200, 100), (date(2024, 3, 8), 100, 100, 600),
+        ]:
+            group_order = GroupOrder.objects.create(order_date=order_date)
+            for user, price in [(self.dan, dan_price), (self.jim, jim_price), (self.alice, alice_price)]:
+                OrderItem.objects.create(name='coffee', price=price, ordered_by=user, group_order=group_order)
+            group_order.complete_order()
+
+    def stats(self):
+        return {stats.user_id: (stats.payer_count, stats.total_spent, stats.total_paid, stats.item_count, stats.last_order_date)
+                for stats in UserStats.objects.all()}
+
+    def test_archive_keeps_balances_and_stats_reproducible(self):
+        stats = self.stats()
+        days = [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 1), date(2024, 3, 8)]
+        balances = {day: balances_at(day) for day in days}
+
+        months = archive_orders(date(2024, 3, 20))
+        self.assertEqual([(archived.month, archived.orders, archived.items, archived.summaries) for archived in months],
+                         [(date(2024, 1, 1), 2, 6, 3), (date(2024, 2, 1), 2, 6, 3)])
+        self.assertEqual(GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['complete']).count(), 2)
+        self.assertEqual(OrderItem.objects.count(), 6)
+        self.assertEqual(CreditLedgerEntry.objects.count(), 6)
+        self.assertEqual(MonthlySummary.objects.count(), 6)
+
+        self.assertEqual({day: balances_at(day) for day in days}, balances)
+        with self.assertRaises(ValueError):
+            balances_at(date(2024, 2, 10))
+        for user in User.objects.all():
+            archived = sum(MonthlySummary.objects.filter(user=user).values_list('net_change', flat=True))
+            ledger = sum(CreditLedgerEntry.objects.filter(user=user).values_list('delta', flat=True))
+            self.assertEqual(archived + ledger, user.net_credit)
+        rebuild_stats()
+        self.assertEqual(self.stats(), stats)
+
+        # nothing is left to archive the second time around
+        self.assertEqual(sum(archived.orders for archived in archive_orders(date(2024, 3, 20))), 0)
+
+    def test_archive_stops_at_pending_orders(self):
+        pending = GroupOrder.objects.create(order_date=date(2024, 2, 10))
+        # February isn't closed until its pending order is completed, nor is any month after it
+        months = archive_orders(date(2024, 3, 20))
+        self.assertEqual([(archived.month, archived.orders) for archived in months], [(date(2024, 1, 1), 2)])
+        self.assertEqual(GroupOrder.objects.filter(order_date__gte=date(2024, 2, 1)).count(), 5)
+        self.assertFalse(BalanceCheckpoint.objects.filter(as_of=date(2024, 2, 29)).exists())
+
+        OrderItem.objects.create(name='tea', price=250, ordered_by=self.dan, group_order=pending)
+        pending.complete_order()
+        months = archive_orders(date(2024, 3, 20))
+        self.assertEqual([(archived.month, archived.orders) for archived in months], [(date(2024, 2, 1), 3)])
+
+    def late_order(self, order_date):
+        group_order = GroupOrder.objects.create(order_date=order_date)
+        for user, price in [(self.dan, 250), (self.jim, 150)]:
+            OrderItem.objects.create(name='tea', price=price, ordered_by=user, group_order=group_order)
+        group_order.complete_order()
+        return group_order
+
+    def test_archive_checkpoints_cover_late_orders(self):
+        take_checkpoint(date(2024, 1, 31))
+        # completed after the checkpoint it belongs to was taken, which archiving retakes
+        self.late_order(date(2024, 1, 25))
+        archive_orders(date(2024, 2, 1))
+        january = dict(MonthlySummary.objects.filter(month=date(2024, 1, 1)).values_list('user_id', 'net_change'))
+        self.assertEqual(balances_at(date(2024, 1, 31)), january)
+
+        # January's checkpoint doesn't include an order completed after January was archived, so it is kept
+        late = self.late_order(date(2024, 1, 28))
+        months = archive_orders(date(2024, 3, 1))
+        self.assertEqual([(archived.month, archived.orders, archived.skipped) for archived in months],
+                         [(date(2024, 1, 1), 0, 1), (date(2024, 2, 1), 2, 0)])
+        self.assertTrue(CreditLedgerEntry.objects.filter(group_order=late).exists())
+        self.assertEqual(balances_at(date(2024, 1, 31)), january)
+
+    def test_archive_command_dump(self):
+        complete = GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['complete'])
+        expected = list(complete.order_by('order_date', 'id').values_list('pk', 'order_total'))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        dump = os.path.join(directory.name, 'archive.ndjson.gz')
+        # orders archived by an earlier run are kept
+        with gzip.open(dump, 'wt') as f:
+            f.write(json.dumps({'id': 0}) + '\n')
+        out = io.StringIO()
+        call_command('archive_orders', '--older-than-days', '30', '--dump', dump, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Archived 2024-01: 2 group orders and 6 items into 3 summaries')
+        self.assertEqual(lines[-1].split(' from ')[0], 'Archived 6 group orders')
+        self.assertFalse(complete.exists())
+
+        with gzip.open(dump, 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows.pop(0), {'id': 0})
+        self.assertEqual([(row['id'], to_cents(row['order_total'])) for row in rows], expected)
+        self.assertEqual(rows[0]['items'][0], {'id': rows[0]['items'][0]['id'], 'name': 'coffee', 'price': '1.00', 'ordered_by_id': self.dan.pk})
+        for row in rows:
+            self.assertEqual(len(row['items']), 3)
+            self.assertEqual(sum(to_cents(entry['delta']) for entry in row['ledger']), 0)
+
+class TestReconcile(TestCase):
+    def setUp(self):
+        self.dan = User.objects.create(name='Dan')
+        self.jim = User.objects.create(name='Jim')
+        self.office = Team.objects.create(name='Office', slug='office')
+        self.pat = User.objects.create(team=self.office, name='Pat')
+        self.sam = User.objects.create(team=self.office, name='Sam')
+        for order_date, first, second in [
+            (date(2024, 1, 10), self.dan, self.jim), (date(2024, 2, 5), self.jim, self.dan),
+            (date(2024, 2, 6), self.pat, self.sam), (date(2024, 3, 1), self.dan, self.jim),
+        ]:
+            group_order = GroupOrder.objects.create(team=first.team, order_date=order_date)
+            OrderItem.objects.create(name='coffee', price=300, ordered_by=first, group_order=group_order)
+            OrderItem.objects.create(name='chai', price=250, ordered_by=second, group_order=group_order)
+            OrderItem.objects.create(name='croissant', price=400, ordered_by=first, group_order=group_order)
+            group_order.complete_order()
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile', *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_consistent_history_resumes_from_checkpoint(self):
+        self.assertEqual(self.reconcile(), [
+            'Replayed 4 group orders with 12 items from the beginning',
+            f'Checkpointed the replay as of {date.today() - timedelta(days=1)}',
+        ])
+        group_order = GroupOrder.objects.create(order_date=date.today())
+        OrderItem.objects.create(name='coffee', price=300, ordered_by=self.jim, group_order=group_order)
+        OrderItem.objects.create(name='coffee', price=300, ordered_by=self.dan, group_order=group_order)
+        group_order.complete_order()
+        result = reconcile()
+        self.assertEqual((result.resumed_from, result.orders, result.drifts), (date.today() - timedelta(days=1), 1, []))
+
+    def test_checkpoint_stops_before_pending_orders(self):
+        # queued for the background worker two days ago and only completed after the nightly run
+        pending = GroupOrder.objects.create(order_date=date.today() - timedelta(days=2))
+        OrderItem.objects.create(name='coffee', price=300, ordered_by=self.jim, group_order=pending)
+        OrderItem.objects.create(name='coffee', price=300, ordered_by=self.dan, group_order=pending)
+        self.assertEqual(reconcile().checkpoint, date.today() - timedelta(days=3))
+        pending.complete_order()
+        result = reconcile()
+        self.assertEqual((result.orders, result.drifts, result.checkpoint), (1, [], date.today() - timedelta(days=1)))
+
+    def test_drift_is_reported_and_repaired(self):
+        User.objects.filter(pk=self.jim.pk).update(net_credit=F('net_credit') + 125)
+        User.objects.filter(pk=self.sam.pk).update(net_credit=F('net_credit') - 100)
+        self.jim.refresh_from_db()
+        with self.assertRaises(CommandError):
+            self.reconcile('--no-checkpoint')
+        result = reconcile(checkpoint=False)
+        self.assertEqual([(drift.name, drift.drift) for drift in result.drifts], [('Jim', 125), ('Sam', -100)])
+        self.assertEqual(result.unbalanced_teams, {self.jim.team_id: 125, self.office.pk: -100})
+
+        lines = self.reconcile('--repair', '--no-checkpoint')
+        self.assertEqual(lines[1], f'Jim (#{self.jim.pk}) has a balance of {format_cents(self.jim.net_credit)} but the orders add up to '
+                                   f'{format_cents(self.jim.net_credit - 125)}, a drift of +1.25')
+        self.assertEqual(lines[-1], 'Repaired 2 balances')
+        self.assertEqual(reconcile(checkpoint=False).drifts, [])
+        self.assertEqual(set(CreditLedgerEntry.objects.values_list('user_id').annotate(total=Sum('delta')).order_by()),
+                         set(User.objects.values_list('pk', 'net_credit')))
+
+    def test_archived_orders_still_reconcile(self):
+        reconcile()
+        archive_orders(date(2024, 3, 1))
+        # the checkpoint is newer than the archived months so it still holds, a full replay starts from their summaries
+        self.assertEqual((reconcile().orders, reconcile(full=True).orders), (0, 1))
+        self.assertEqual(reconcile(full=True).drifts, [])
+
+class TestItemSuggestions(TestCase):
+    def setUp(self):
+        self.dan = User.objects.create(name='Dan', net_credit=1000)
+        self.jim = User.objects.create(name='Jim')
+
+    def complete(self, order_date, *items):
+        group_order = GroupOrder.objects.create(order_date=order_date)
+        for user, name, price in items:
+            OrderItem.objects.create(name=name, price=price, ordered_by=user, group_order=group_order)
+        return group_order.complete_order()
+
+    def suggest(self, q, user=None):
+        params = {'q': q} if user is None else {'q': q, 'user': user.pk}
+        return self.client.get('/group_orders/suggestions/', params).json()['suggestions']
+
+    def suggestions(self):
+        return set(ItemSuggestion.objects.values_list('user_id', 'name_key', 'name', 'order_count', 'last_price', 'last_ordered'))
+
+    def seed_orders(self):
+        self.complete(date(2024, 3, 1), (self.dan, 'Cappucino', 500), (self.dan, 'chai', 250))
+        self.complete(date(2024, 3, 2), (self.dan, 'cappucino', 500), (self.jim, 'cortado', 300))
+        self.complete(date(2024, 3, 3), (self.jim, '  Cappucino ', 450))
+
+    def test_suggestions_are_ranked_and_priced(self):
+        self.seed_orders()
+        with self.assertNumQueries(1):
+            suggestions = self.suggest('C')
+        self.assertEqual(suggestions, [
+            {'name': '  Cappucino ', 'price': '4.50', 'order_count': 3, 'user_order_count': 0},
+            {'name': 'chai', 'price': '2.50', 'order_count': 1, 'user_order_count': 0},
+            {'name': 'cortado', 'price': '3.00', 'order_count': 1, 'user_order_count': 0},
+        ])
+        # ranked and priced for the user first
+        self.assertEqual(self.suggest('c', self.jim)[:2], [
+            {'name': '  Cappucino ', 'price': '4.50', 'order_count': 3, 'user_order_count': 1},
+            {'name': 'cortado', 'price': '3.00', 'order_count': 1, 'user_order_count': 1},
+        ])
+        self.assertEqual(self.suggest('capp', self.dan), [
+            {'name': 'cappucino', 'price': '5.00', 'order_count': 3, 'user_order_count': 2},
+        ])
+        self.assertEqual(self.suggest('latte'), [])
+        self.assertEqual(self.suggest(''), [])
+        self.assertEqual(self.client.get('/group_orders/suggestions/', {'q': 'c', 'user': 'x'}).status_code, 400)
+
+    def test_older_orders_do_not_replace_the_last_price(self):
+        self.complete(date(2024, 3, 5), (self.dan, 'chai', 250))
+        self.complete(date(2024, 3, 4), (self.dan, 'Chai', 200))
+        self.assertEqual(self.suggestions(), {(self.dan.pk, 'chai', 'chai', 2, 250, date(2024, 3, 5))})
+
+    def test_every_completion_path_matches_a_rebuild(self):
+        self.seed_orders()
+        self.client.put('/group_orders/batch/', data=json.dumps([
+            {'order_date': '2024-03-04', 'items': [{'user': str(self.jim.pk), 'name': 'chai', 'price': '2.75'}]},
+        ]), content_type='application/json')
+        with override_settings(COMPLETE_ORDERS_ASYNC=True):
+            self.client.put('/group_orders/create/', data=json.dumps([
+                {'user': str(self.dan.pk), 'name': 'espresso', 'price': '3.00'},
+                {'user': str(self.dan.pk), 'name': 'cortado', 'price': '3.00'},
+            ]), content_type='application/json')
+        complete_pending_batch()
+
+        incremental = self.suggestions()
+        self.assertEqual(len(incremental), 7)
+        rebuild_suggestions()
+        self.assertEqual(self.suggestions(), incremental)
+
+class TestBenchmarks(TestCase):
+    def test_seed_and_run_benchmarks(self):
+        users = seed(users=5, orders=30, items_per_order=4)
+        self.assertEqual(GroupOrder.objects.filter(status=GROUP_ORDER_STATUS['complete']).count(), 30)
+        self.assertEqual(OrderItem.objects.count(), 120)
+        self.assertEqual(sum(user.net_credit for user in User.objects.all()), 0)
+        self.assertEqual(GroupOrder.objects.order_by('order_date').first().order_date, date.today() - timedelta(days=30))
+
+        results = {'benchmarks': run_benchmarks(users, items_per_order=4, repeat=2)}
+        self.assertEqual(
+            set(results['benchmarks']),
+            {'create_group_order_put', 'complete_order', 'list_group_orders', 'detail_group_order', 'list_users'}
+        )
+        self.assertEqual(compare(results, results, tolerance=1.0), [])
+
+        slower = {'benchmarks': {
+            name: dict(result, queries=result['queries'] + 1) for name, result in results['benchmarks'].items()
+        }}
+        self.assertEqual(len(compare(slower, results, tolerance=1.0)), 5)
+
+class TestAccessPaths(TransactionTestCase):
+    # not wrapped in a transaction, so postgres can VACUUM the seeded tables for index-only scans
+    serialized_rollback = True
+
+    def test_access_paths_use_their_indexes(self):
+        # the bench command's default volume, analyzed so the planner costs the plans on it
+        users = seed(users=50, orders=1000, items_per_order=7)
+        group_order = GroupOrder.objects.create()
+        OrderItem.objects.create(name='chai', price=250, ordered_by=users[0], group_order=group_order)
+
+        plans = explain_access_paths()
+        # sqlite skip-scans the covering user index for the last week of the ledger instead
+        expected_misses = {'ledger_tail'} if connection.vendor == 'sqlite' else set()
+        misses = {name for name, plan in plans.items() if not plan['uses_index']}
+        self.assertEqual(misses, expected_misses, "\n".join(f"{name}:\n{plans[name]['plan']}" for name in misses))
+        self.assertEqual({name for name, plan in plans.items() if plan['index_only']},
+                         {'order_items', 'pending_head', 'user_balance', 'ledger_tail'})
+
+        unindexed = {name: dict(plan, uses_index=False) for name, plan in plans.items()}
+        regressions = compare({'access_paths': unindexed}, {'access_paths': plans}, tolerance=1.0)
+        self.assertIn('order_items: no longer uses orderitem_order_covering_idx', regressions)
+
+class TestImportOrders(TestCase):
+    rows = [
+        {'order': 'a', 'order_date': '2024-03-01', 'user': 'Dan', 'name': 'black coffee', 'price': '1.00'},
+        {'order': 'a', 'order_date': '2024-03-01', 'user': 'Jim', 'name': 'cappucino', 'price': '5.00'},
+        {'order': 'b', 'order_date': '2024-03-02', 'user': 'Jim', 'name': 'cappucino', 'price': '5.00'},
+        {'order': 'b', 'order_date': '2024-03-02', 'user': 'Jim', 'name': 'croissant', 'price': '3.00'},
+        {'order': 'b', 'order_date': '2024-03-02', 'user': 'Pat', 'name': 'chai', 'price': '2.50'},
+        {'order': 'c', 'order_date': '2024-03-02', 'user': 'Dan', 'name': 'espresso', 'price': '3.00'},
+        {'order': 'c', 'order_date': '2024-03-02', 'user': 'Pat', 'name': 'chai', 'price': '2.50'},
+    ]
+
+    def write_file(self, fmt, rows):
+        f = tempfile.NamedTemporaryFile('w', suffix=f'.{fmt}', delete=False, newline='')
+        self.addCleanup(os.remove, f.name)
+        with f:
+            if fmt == 'csv':
+                writer = csv.DictWriter(f, fieldnames=['order', 'order_date', 'user', 'name', 'price'])
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(row) + '\n' for row in rows)
+        return f.name
+
+    def replay_through_complete_order(self):
+        """
+        the balances the app ends up with when the same orders are completed one at a time
+        """
+        users = {name: User.objects.create(name=name) for name in ['Dan', 'Jim', 'Pat']}
+        for key in ['a', 'b', 'c']:
+            rows = [row for row in self.rows if row['order'] == key]
+            group_order = GroupOrder.objects.create(order_date=date.fromisoformat(rows[0]['order_date']))
+            for row in rows:
+                OrderItem.objects.create(name=row['name'], price=to_cents(row['price']), ordered_by=users[row['user']], group_order=group_order)
+            group_order.complete_order()
+        expected = {user.name: (user.net_credit, user.last_payment_date) for user in User.objects.all()}
+        payers = list(GroupOrder.objects.order_by('id').values_list('payer__name', flat=True))
+        GroupOrder.objects.all().delete()
+        User.objects.all().delete()
+        return expected, payers
+
+    def test_import_matches_completing_orders_one_at_a_time(self):
+        expected, payers = self.replay_through_complete_order()
+
+        for fmt in ['csv', 'ndjson']:
+            out = io.StringIO()
+            call_command('import_orders', self.write_file(fmt, self.rows), '--create-users', '--batch-size', '2', stdout=out)
+            self.assertEqual(out.getvalue().strip(), 'Imported 3 orders with 7 items, created 3 users')
+            self.assertEqual({user.name: (user.net_credit, user.last_payment_date) for user in User.objects.all()}, expected)
+            self.assertEqual(list(GroupOrder.objects.order_by('id').values_list('payer__name', flat=True)), payers)
+            self.assertEqual(list(GroupOrder.objects.order_by('id').values_list('item_count', flat=True)), [2, 3, 2])
+            self.assertEqual(CreditLedgerEntry.objects.count(), 6)
+            GroupOrder.objects.all().delete()
+            User.objects.all().delete()
+
+    def test_import_rejects_bad_files(self):
+        with self.assertRaisesMessage(CommandError, "User 'Dan' does not exist"):
+            call_command('import_orders', self.write_file('csv', self.rows))
+
+        unsorted = self.rows[2:5] + self.rows[:2]
+        with self.assertRaisesMessage(CommandError, 'sorted oldest first'):
+            call_command('import_orders', self.write_file('csv', unsorted), '--create-users')
+
+        split = self.rows[:1] + self.rows[2:5] + self.rows[1:2]
+        with self.assertRaisesMessage(CommandError, 'not next to each other'):
+            call_command('import_orders', self.write_file('ndjson', split), '--create-users')
+
+        GroupOrder.objects.create()
+        with self.assertRaisesMessage(CommandError, 'The team has 1 pending group orders'):
+            call_command('import_orders', self.write_file('csv', self.rows), '--create-users')
+        GroupOrder.objects.all().delete()
+
+        huge = [dict(self.rows[0], price='1e100')] + self.rows[1:]
+        with self.assertRaisesMessage(CommandError, "Row 1 has an invalid price '1e100'"):
+            call_command('import_orders', self.write_file('csv', huge), '--create-users')
+
+        # nothing is left behind by a failed import
+        self.assertFalse(GroupOrder.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+class TestMoney(SimpleTestCase):
+    def test_cents_round_trip_through_strings(self):
+        for cents in list(range(-1000, 1001)) + [10 ** 15 + 1, -(10 ** 15) - 99, 2 ** 63 - 1]:
+            self.assertEqual(to_cents(format_cents(cents)), cents)
+            self.assertEqual(to_cents(from_cents(cents)), cents)
+        for text in ['0.00', '0.01', '-0.01', '2.50', '-1.25', '99.99', '123456789.10']:
+            self.assertEqual(format_cents(to_cents(text)), text)
+
+    def test_to_cents(self):
+        for value in ['2.5', '2.50', ' 2.50 ', '2.500', Decimal('2.50'), 2.5, '25e-1']:
+            self.assertEqual(to_cents(value), 250)
+        self.assertEqual(to_cents(3), 300)
+        self.assertEqual(to_cents('-1.25'), -125)
+        # rounded to the nearest cent, halves to even
+        self.assertEqual((to_cents('2.505'), to_cents('2.515'), to_cents('2.5051')), (250, 252, 251))
+        for value in ['', 'abc', '1,50', 'NaN', 'Infinity', None, '1e30', '1e100']:
+            with self.assertRaises(ValueError):
+                to_cents(value)
+
+    def test_format_cents(self):
+        self.assertEqual([format_cents(cents) for cents in [0, 5, -5, 250, -1999]], ['0.00', '0.05', '-0.05', '2.50', '-19.99'])
+        self.assertEqual((format_cents(125, sign=True), format_cents(0, sign=True), format_cents(-125, sign=True)),
+                         ('+1.25', '+0.00', '-1.25'))
+
+class TestFairnessEngine(SimpleTestCase):
+    def test_choose_payer_highest_credit_then_least_recent_payment(self):
+        accounts = {
+            'dan': Account(net_credit=1000, last_payment_date=date(2024, 3, 2)),
+            'jim': Account(net_credit=1000, last_payment_date=date(2024, 3, 1)),
+            'pat': Account(net_credit=1000, last_payment_date=None),
+            'sam': Account(net_credit=-500, last_payment_date=None),
+        }
+        self.assertEqual(choose_payer(accounts), 'jim')
+        del accounts['jim']
+        self.assertEqual(choose_payer(accounts), 'dan')
+        del accounts['dan']
+        self.assertEqual(choose_payer(accounts), 'pat')
+
+    def test_settle_order_keeps_the_sum_of_balances(self):
+        accounts = {'dan': Account(net_credit=1000), 'jim': Account(net_credit=-1000)}
+        settlement = settle_order({'dan': 400, 'jim': 500}, accounts)
+        self.assertEqual(settlement.payer, 'dan')
+        self.assertEqual(settlement.total_price, 900)
+        self.assertEqual(settlement.deltas, {'dan': -500, 'jim': 500})
+
+        apply_settlement(settlement, accounts, date(2024, 3, 1))
+        self.assertEqual(accounts['dan'], Account(net_credit=500, last_payment_date=date(2024, 3, 1)))
+        self.assertEqual(accounts['jim'], Account(net_credit=-500, last_payment_date=None))
+
+    def test_vectorized_simulator_matches_engine(self):
+        rng = np.random.default_rng(7)
+        profiles = [Profile(f'User {i}', [100, 250, 300, 500], attendance=0.7) for i in range(5)]
+        spend = [sample_spend(profiles, 20, rng) for _ in range(50)]
+        result = simulate_spend(spend, users=5, simulations=20)
+
+        for sim in range(20):
+            accounts = {user: Account() for user in range(5)}
+            payer_count = [0] * 5
+            for step, spent in enumerate(spend):
+                order = {user: int(price) for user, price in enumerate(spent[sim]) if price}
+                if not order:
+                    continue
+                settlement = settle_order(order, accounts)
+                apply_settlement(settlement, accounts, date(2024, 1, 1) + timedelta(days=step))
+                payer_count[settlement.payer] += 1
+            self.assertEqual([accounts[user].net_credit for user in range(5)], result.net_credit[sim].tolist())
+            self.assertEqual(payer_count, result.payer_count[sim].tolist())
+
 class TestFairness(TestCase):
 
     def make_order_item(self, 
@@ -96,10 +1619,10 @@ class TestFairness(TestCase):
         item_name: Optional[str]=None
     )-> OrderItem:
         menu = {
-            'cappucino': 5,
-            'black': 1,
-            'chai': 2.5,
-            'espresso': 3
+            'cappucino': 500,
+            'black': 100,
+            'chai': 250,
+            'espresso': 300
         }
         if item_name is None:
             item_name = random.choice(list(menu.keys()))
@@ -178,5 +1701,15 @@ class TestFairness(TestCase):
             user.refresh_from_db()
             self.assertTrue(abs(user.net_credit) < max_order_price)
 
+    def test_vectorized_simulation(self):
+        """
+        the same scenario as test_simulation_1, repeated over a thousand simulated years
+        """
+        result = simulate(DEFAULT_PROFILES, orders=365, simulations=1000, seed=1)
+        names = [profile.name for profile in DEFAULT_PROFILES]
+        average_payer_count = result.payer_count.mean(axis=0)
 
-
+        self.assertEqual(average_payer_count.argmax(), names.index('Bob'))
+        self.assertEqual(average_payer_count.argmin(), names.index('Jeremy'))
+        self.assertTrue((result.net_credit.sum(axis=1) == 0).all())
+        self.assertTrue((result.peak_abs_credit < result.max_order_total[:, None]).all())
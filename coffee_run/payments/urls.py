@@ -4,11 +4,20 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("teams/", views.select_team, name="team_list"),
     path("users/", views.list_users, name="user_list"),
+    path("users/stats/", views.user_stats, name="user_stats"),
     path("users/create/", views.UserCreateView.as_view(), name="user_create"),
     path("users/<int:pk>/update/", views.UserUpdateView.as_view(), name="user_update"),
     path("users/<int:pk>/delete/", views.UserDeleteView.as_view(), name="user_delete"),
     path("group_orders/", views.list_group_orders, name="group_order_list"),
     path("group_orders/create/", views.create_group_order, name="group_order_create"),
-    path("group_orders/<int:pk>/detail/", views.detail_group_order, name="group_order_detail")
+    path("group_orders/preview/", views.preview_group_order, name="group_order_preview"),
+    path("group_orders/suggestions/", views.item_suggestions, name="item_suggestions"),
+    path("group_orders/batch/", views.create_group_order_batch, name="group_order_batch"),
+    path("group_orders/<int:pk>/detail/", views.detail_group_order, name="group_order_detail"),
+    path("api/users/", views.api_users, name="api_users"),
+    path("api/group_orders/", views.api_group_orders, name="api_group_orders"),
+    path("api/order_items/", views.api_order_items, name="api_order_items"),
+    path("export/<str:dataset>.<str:fmt>", views.export_data, name="export_data"),
 ]
\ No newline at end of file
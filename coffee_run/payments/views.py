@@ -1,67 +1,250 @@
 from django.shortcuts import render
-from django.http import HttpResponse, HttpRequest, JsonResponse
+from django.http import HttpResponse, HttpRequest, JsonResponse, StreamingHttpResponse, Http404, HttpResponseNotAllowed
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Max
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from asgiref.sync import sync_to_async
 
-from .models import User, GroupOrder, GROUP_ORDER_STATUS, OrderItem
+from .models import Team, User, GroupOrder, GROUP_ORDER_STATUS, OrderItem, UserStats, lock_users
+from .middleware import TEAM_COOKIE, TEAM_COOKIE_MAX_AGE
+from .pagination import InvalidCursor, akeyset_page
+from .exports import EXPORT_FORMATS, astream, stream_export
+from .roster import aget_roster, invalidate_roster, roster_page
+from .bulk import NewOrder, insert_completed_orders, insert_pending_orders, settle_orders
+from . import fairness
+from .money import format_cents, to_cents
+from . import api
+from .suggestions import rank_suggestions, suggestion_queryset
 
 import json
+from datetime import date
+from typing import Optional
+
+# the most a single order item can cost, in cents
+MAX_ITEM_PRICE = 9900
+ITEM_NAME_MAX_LENGTH = OrderItem._meta.get_field('name').max_length
 
 def index(request: HttpRequest) -> HttpResponse:
     context = {}
     return render(request, "payments/index.html", context)
 
-def list_users(request: HttpRequest) -> HttpResponse:
-    users = User.objects.all()
-    context = {'users': users}
-    return render(request, "payments/user_list.html", context)
+async def select_team(request: HttpRequest) -> HttpResponse:
+    """
+    GET lists the teams, POST {"team": <id>} makes that the team every other page works on
+    """
+    if request.method == "POST":
+        try:
+            team = await Team.objects.aget(pk=int(request.POST.get('team', '')))
+        except (ValueError, Team.DoesNotExist):
+            return JsonResponse({'team': f"Unknown team {request.POST.get('team')}"}, status=400)
+        response = redirect("index")
+        response.set_cookie(TEAM_COOKIE, str(team.pk), max_age=TEAM_COOKIE_MAX_AGE, samesite='Lax')
+        return response
+    context = {'teams': [team async for team in Team.objects.order_by('name')], 'team_id': request.team_id}
+    return render(request, "payments/team_list.html", context)
+
+def next_page_url(request: HttpRequest, cursor: Optional[str]) -> Optional[str]:
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f"{request.path}?{params.urlencode()}"
+
+def set_roster_validators(response: HttpResponse, roster) -> HttpResponse:
+    response['ETag'] = roster.etag
+    response['Last-Modified'] = http_date(roster.last_modified.timestamp())
+    return response
+
+async def list_users(request: HttpRequest) -> HttpResponse:
+    roster = await aget_roster(request.team_id)
+    not_modified = get_conditional_response(
+        request,
+        etag=roster.etag,
+        last_modified=int(roster.last_modified.timestamp()),
+    )
+    if not_modified is not None:
+        return set_roster_validators(not_modified, roster)
+    try:
+        users, cursor = roster_page(roster, request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'cursor': str(e)}, status=400)
+    context = {'users': users, 'next_page_url': next_page_url(request, cursor)}
+    return set_roster_validators(render(request, "payments/user_list.html", context), roster)
+
+async def user_stats(request: HttpRequest) -> HttpResponse:
+    """
+    leaderboard of the running totals of every user of the team, read straight from UserStats with one query
+    """
+    stats = UserStats.objects.select_related('user').filter(user__team_id=request.team_id).order_by(
+        '-payer_count', '-total_paid', 'user__name',
+    )
+    context = {'stats': [user_stats async for user_stats in stats]}
+    return render(request, "payments/user_stats.html", context)
 
-class UserCreateView(CreateView):
+class TeamScopedMixin:
+    """
+    only the users of the request's team can be edited or deleted
+    """
+    def get_queryset(self):
+        return User.objects.filter(team_id=self.request.team_id)
+
+class TeamUserMixin(TeamScopedMixin):
+    """
+    new and renamed users join the request's team, under a name that is unique within it
+    """
+    def form_valid(self, form):
+        form.instance.team_id = self.request.team_id
+        # the form leaves team out, so it can't check the (team, name) constraint itself
+        taken = User.objects.filter(team_id=self.request.team_id, name=form.instance.name).exclude(pk=form.instance.pk)
+        if taken.exists():
+            form.add_error('name', "A user with this name already exists in this team")
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+class UserCreateView(TeamUserMixin, CreateView):
     model = User
     fields= ['name']
     success_url = reverse_lazy("user_list")
 
-class UserUpdateView(UpdateView):
+class UserUpdateView(TeamUserMixin, UpdateView):
     model = User
     fields = ['name']
     success_url = reverse_lazy("user_list")
 
-class UserDeleteView(DeleteView):
+class UserDeleteView(TeamScopedMixin, DeleteView):
     model = User
     success_url = reverse_lazy("user_list")
 
-def list_group_orders(request: HttpRequest) -> HttpResponse:
-    group_orders = GroupOrder.objects.all()
-    context = {'group_orders': group_orders}
+def filter_group_orders(params) -> tuple[dict, dict]:
+    """
+    turn the status, payer and date range query parameters into queryset filters
+    """
+    filters = {}
+    errors = {}
+    status = params.get('status')
+    if status:
+        if status in GROUP_ORDER_STATUS:
+            filters['status'] = status
+        else:
+            errors['status'] = f'Unknown status {status}'
+    payer = params.get('payer')
+    if payer:
+        try:
+            filters['payer_id'] = int(payer)
+        except ValueError:
+            errors['payer'] = f'Invalid payer {payer}'
+    for param, lookup in [('date_from', 'order_date__gte'), ('date_to', 'order_date__lte')]:
+        value = params.get(param)
+        if value:
+            try:
+                filters[lookup] = date.fromisoformat(value)
+            except ValueError:
+                errors[param] = f'Invalid date {value}, expected YYYY-MM-DD'
+    return filters, errors
+
+async def list_group_orders(request: HttpRequest) -> HttpResponse:
+    filters, errors = filter_group_orders(request.GET)
+    if errors:
+        return JsonResponse(errors, status=400)
+    # newest first, keyed on (order_date, id) so each page is a range scan of the team's part of the index
+    group_orders = GroupOrder.objects.select_related('payer').filter(team_id=request.team_id, **filters)
+    try:
+        group_orders, cursor = await akeyset_page(group_orders, ['-order_date', '-id'], request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'cursor': str(e)}, status=400)
+    context = {
+        'group_orders': group_orders,
+        'next_page_url': next_page_url(request, cursor),
+        'payers': [payer async for payer in User.objects.filter(team_id=request.team_id).order_by('name').values('id', 'name')],
+        'statuses': GROUP_ORDER_STATUS,
+        'filters': request.GET,
+    }
     return render(request, "payments/group_order_list.html", context)
 
-def detail_group_order(request: HttpRequest, pk: int) -> HttpResponse:
-    group_order = GroupOrder.objects.get(id=pk)
-    context =  {'group_order': group_order, 'order_items': group_order.orderitem_set.all()}
+async def detail_group_order(request: HttpRequest, pk: int) -> HttpResponse:
+    try:
+        group_order = await GroupOrder.objects.select_related('payer').aget(id=pk, team_id=request.team_id)
+    except GroupOrder.DoesNotExist:
+        raise Http404(f"GroupOrder #{pk} does not exist")
+    order_items = [item async for item in group_order.orderitem_set.select_related('ordered_by').order_by('id')]
+    context =  {
+        'group_order': group_order,
+        'order_items': order_items,
+        'total_price': sum(item.price for item in order_items),
+    }
     return render(request, "payments/group_order_detail.html", context)
 
-def validate_order_item_json(order_items):
+def export_data(request: HttpRequest, dataset: str, fmt: str) -> HttpResponse:
+    try:
+        lines = stream_export(dataset, fmt, team_id=request.team_id)
+    except ValueError as e:
+        raise Http404(str(e))
+    if isinstance(request, ASGIRequest):
+        lines = astream(lines)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="coffee_run_{dataset}.{fmt}"'
+    return response
+
+def parse_user_id(value) -> Optional[int]:
+    """
+    the user of an order item row, a whole number or a string of one as the order form sends it, None for anything else
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def order_item_user_ids(order_items) -> set[int]:
+    user_ids = set()
+    if not isinstance(order_items, list):
+        return user_ids
+    for item in order_items:
+        user_id = parse_user_id(item.get('user')) if isinstance(item, dict) else None
+        if user_id is not None:
+            user_ids.add(user_id)
+    return user_ids
+
+def validate_order_item_json(order_items, users):
+    """
+    users maps user ids to the users referenced by the rows, looked up with a single IN query beforehand
+    """
     errors = {}
+    if not isinstance(order_items, list):
+        return False, {'general': "Order items must be a list"}
     if not order_items:
         errors['general'] = "Form cannot be blank"
     for idx, item in enumerate(order_items):
+        if not isinstance(item, dict):
+            errors[idx] = {'general': f'Row {idx} must be an object'}
+            continue
         row_errors = {}
-        if 'name' not in item:
+        if not item.get('name'):
             row_errors['name'] = f'Name is required for row {idx}'
-        if not item['name']:
-            row_errors['name'] = f'Name is required for row {idx}'
-        if 'price' not in item:
-            row_errors['price'] = f'Price is required for row {idx}'
-        if not item['price']:
+        elif not isinstance(item['name'], str):
+            row_errors['name'] = f'Name must be text for row {idx}'
+        elif len(item['name']) > ITEM_NAME_MAX_LENGTH:
+            row_errors['name'] = f'Name must be at most {ITEM_NAME_MAX_LENGTH} characters for row {idx}'
+        if not item.get('price'):
             row_errors['price'] = f'Price is required for row {idx}'
-        if float(item['price']) > 99:
-            row_errors['price'] = f'Price must be less than 100 for row {idx}'
-        if 'user' not in item:
+        else:
+            try:
+                if to_cents(item['price']) > MAX_ITEM_PRICE:
+                    row_errors['price'] = f'Price must be less than 100 for row {idx}'
+            except ValueError:
+                row_errors['price'] = f'Price must be a number for row {idx}'
+        if not item.get('user'):
             row_errors['user'] = f'User is required for row {idx}'
-        if not item['user']:
-            row_errors['user'] = f'User is required for row {idx}'
-        if 'user' in item and item['user'] and not User.objects.filter(pk=item['user']).exists():
+        elif parse_user_id(item['user']) is None:
+            row_errors['user'] = f'User must be a user id for row {idx}'
+        elif parse_user_id(item['user']) not in users:
             row_errors['user'] = f'User does not exist for row {idx}'
         if row_errors:
             errors[idx] = row_errors
@@ -69,32 +252,266 @@ def validate_order_item_json(order_items):
         return True, {}
     return False, errors
 
-def create_group_order(request: HttpRequest) -> HttpResponse:
+def save_group_order(order_items, users, team_id: int) -> GroupOrder:
+    """
+    insert a validated group order of the team's users and complete it, all in one transaction
+
+    with COMPLETE_ORDERS_ASYNC on the order is only saved as pending, for the complete_pending_orders worker
+    """
+    items = [
+        OrderItem(
+            name=order_item['name'],
+            price=to_cents(order_item['price']),
+            ordered_by=users[int(order_item['user'])],
+        )
+        for order_item in order_items
+    ]
+    with transaction.atomic():
+        group_order = GroupOrder.objects.create(
+            team_id=team_id,
+            order_total=sum(item.price for item in items),
+            item_count=len(items),
+        )
+        for item in items:
+            item.group_order = group_order
+        OrderItem.objects.bulk_create(items)
+        if not settings.COMPLETE_ORDERS_ASYNC:
+            group_order.complete_order()
+    return group_order
+
+async def create_group_order(request: HttpRequest) -> HttpResponse:
     if request.method == 'GET':
-        users = []
-        for user in User.objects.all():
-            users.append({
-                'id': user.id,
-                'name': user.name
-            })
+        roster = await aget_roster(request.team_id)
+        users = [{'id': user['id'], 'name': user['name']} for user in roster.users]
         context = {'users': users}
         return render(request, "payments/group_order_create.html", context)
     
     if request.method == "PUT":
         json_payload = json.loads(request.body)
-        valid, errors = validate_order_item_json(json_payload)
+        # users of other teams are left out, so they fail validation like users that don't exist
+        users = await User.objects.filter(team_id=request.team_id).ain_bulk(order_item_user_ids(json_payload))
+        valid, errors = validate_order_item_json(json_payload, users)
         if not valid:
             return JsonResponse(errors, status=400)
 
-        group_order = GroupOrder.objects.create()
-        for order_item in json_payload:
-            user = User.objects.get(pk=order_item['user'])
-            OrderItem.objects.create(
-                name=order_item['name'],
-                price=order_item['price'],
-                ordered_by=user,
-                group_order=group_order
-            )
-        group_order.complete_order()
+        # the async ORM can't run transactions, so the writes cross into sync code once
+        group_order = await sync_to_async(save_group_order)(json_payload, users, request.team_id)
         detail_url = f"/group_orders/{group_order.pk}/detail/"
-        return HttpResponse(detail_url)
\ No newline at end of file
+        return HttpResponse(detail_url)
+
+    return HttpResponseNotAllowed(['GET', 'PUT'])
+
+async def preview_group_order(request: HttpRequest) -> HttpResponse:
+    """
+    POST the same rows create_group_order takes to find out who would pay and how everyone's net
+    credit would change, without saving anything
+
+    balances come from the cached roster, so this normally runs no queries at all. Orders still
+    waiting for the background worker are not taken into account.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(['POST'])
+
+    json_payload = json.loads(request.body)
+    roster = await aget_roster(request.team_id)
+    user_ids = order_item_user_ids(json_payload)
+    users = {user['id']: user for user in roster.users if user['id'] in user_ids}
+    valid, errors = validate_order_item_json(json_payload, users)
+    if not valid:
+        return JsonResponse(errors, status=400)
+
+    spent = {}
+    for order_item in json_payload:
+        user_id = int(order_item['user'])
+        spent[user_id] = spent.get(user_id, 0) + to_cents(order_item['price'])
+    accounts = {
+        user_id: fairness.Account(net_credit=user['net_credit'], last_payment_date=user['last_payment_date'])
+        for user_id, user in users.items()
+    }
+    settlement = fairness.settle_order(spent, accounts)
+    return JsonResponse({
+        'payer': settlement.payer,
+        'payer_name': users[settlement.payer]['name'],
+        'total_price': format_cents(settlement.total_price),
+        'users': [
+            {
+                'id': user_id,
+                'name': users[user_id]['name'],
+                'net_credit': format_cents(users[user_id]['net_credit']),
+                'change': format_cents(delta),
+                'projected_net_credit': format_cents(users[user_id]['net_credit'] + delta),
+            }
+            for user_id, delta in settlement.deltas.items()
+        ],
+    })
+
+async def item_suggestions(request: HttpRequest) -> HttpResponse:
+    """
+    GET ?q=<start of an item name>&user=<id> for the items whose name starts with q, ranked by how
+    often that user (if given) and then everyone on the team ordered them, each with a price to fill in
+    """
+    prefix = request.GET.get('q', '').strip()
+    if not prefix:
+        return JsonResponse({'suggestions': []})
+    try:
+        user_id = api.parse_id(request.GET, 'user')
+    except api.InvalidQuery as e:
+        return JsonResponse({e.param: str(e)}, status=400)
+    rows = [row async for row in suggestion_queryset(prefix, request.team_id)]
+    suggestions = rank_suggestions(rows, user_id)
+    for suggestion in suggestions:
+        suggestion['price'] = format_cents(suggestion['price'])
+    return JsonResponse({'suggestions': suggestions})
+
+def save_group_order_batch(orders: list[NewOrder], users, team_id: int) -> list[GroupOrder]:
+    """
+    complete a batch of validated group orders in sequence against the current balances of users,
+    then write the orders, their items and every user's new balance in one transaction
+
+    with COMPLETE_ORDERS_ASYNC on, or while the team has orders waiting for the worker, the batch
+    is only saved as pending behind them: completing it first would settle the older orders
+    against balances that already include it
+    """
+    with transaction.atomic():
+        # settle against balances read under lock rather than the ones the batch was validated with
+        users = lock_users(users)
+        pending = GroupOrder.objects.filter(team_id=team_id, status=GROUP_ORDER_STATUS['pending'])
+        if settings.COMPLETE_ORDERS_ASYNC or pending.exists():
+            return insert_pending_orders(orders)
+        group_orders = insert_completed_orders(settle_orders(orders, users))
+        User.objects.bulk_update(users.values(), ["net_credit", "last_payment_date"])
+        invalidate_roster([team_id])
+    return group_orders
+
+async def create_group_order_batch(request: HttpRequest) -> HttpResponse:
+    """
+    PUT an ordered list of group orders, each {"items": [...], "order_date": "YYYY-MM-DD"} where the
+    items are the same rows create_group_order takes and order_date is optional (defaults to today)
+
+    like an import the orders must be sorted oldest first and can't go back before the team's latest
+    order: a backdated order would be settled against balances that already include later orders,
+    move its payer's last_payment_date backwards and land under ledger and reconcile checkpoints
+    """
+    if request.method != "PUT":
+        return HttpResponseNotAllowed(['PUT'])
+
+    json_payload = json.loads(request.body)
+    if not json_payload or not isinstance(json_payload, list):
+        return JsonResponse({'general': "Batch must be a non-empty list of group orders"}, status=400)
+
+    # one IN query for the users of every order in the batch
+    user_ids = set()
+    for order in json_payload:
+        if isinstance(order, dict) and isinstance(order.get('items'), list):
+            user_ids |= order_item_user_ids(order['items'])
+    users = await User.objects.filter(team_id=request.team_id).ain_bulk(user_ids)
+    latest = await GroupOrder.objects.filter(team_id=request.team_id).aaggregate(latest=Max('order_date'))
+    latest = latest['latest']
+
+    errors = {}
+    orders = []
+    for idx, order in enumerate(json_payload):
+        if not isinstance(order, dict):
+            errors[idx] = {'general': "Group order must be an object"}
+            continue
+        order_errors = {}
+        items = order.get('items') or []
+        if not isinstance(items, list):
+            order_errors['items'] = {'general': "Items must be a list of order items"}
+        else:
+            valid, item_errors = validate_order_item_json(items, users)
+            if not valid:
+                order_errors['items'] = item_errors
+        order_date = date.today()
+        if order.get('order_date'):
+            try:
+                order_date = date.fromisoformat(order['order_date'])
+            except ValueError:
+                order_errors['order_date'] = f"Invalid date {order['order_date']}, expected YYYY-MM-DD"
+        if 'order_date' not in order_errors:
+            if order_date > date.today():
+                order_errors['order_date'] = f"Invalid date {order_date}, it is in the future"
+            elif latest is not None and order_date < latest:
+                order_errors['order_date'] = f"Orders must be sorted oldest first, {order_date} comes after {latest}"
+            else:
+                latest = order_date
+        if order_errors:
+            errors[idx] = order_errors
+            continue
+        orders.append(NewOrder(request.team_id, order_date, [
+            (int(item['user']), item['name'], to_cents(item['price']))
+            for item in order['items']
+        ]))
+    if errors:
+        return JsonResponse(errors, status=400)
+
+    group_orders = await sync_to_async(save_group_order_batch)(orders, users, request.team_id)
+    return JsonResponse({
+        'detail_urls': [f"/group_orders/{group_order.pk}/detail/" for group_order in group_orders]
+    })
+
+def api_response(request: HttpRequest, results: list, cursor: Optional[str]) -> HttpResponse:
+    body = api.encode({'results': results, 'next': next_page_url(request, cursor)})
+    etag = api.body_etag(body)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    return response
+
+async def api_users(request: HttpRequest) -> HttpResponse:
+    """
+    the team's users ordered by name, served from its cached roster
+    """
+    try:
+        fields = api.parse_fields(request.GET, api.USER_FIELDS)
+        limit = api.parse_limit(request.GET)
+        users, cursor = roster_page(await aget_roster(request.team_id), request.GET.get('cursor'), limit)
+    except api.InvalidQuery as e:
+        return JsonResponse({e.param: str(e)}, status=400)
+    except InvalidCursor as e:
+        return JsonResponse({'cursor': str(e)}, status=400)
+    return api_response(request, [api.row_json(user, fields) for user in users], cursor)
+
+async def api_group_orders(request: HttpRequest) -> HttpResponse:
+    """
+    the team's group orders newest first, filtered like the group order list and optionally embedding their payer and items
+    """
+    filters, errors = filter_group_orders(request.GET)
+    if errors:
+        return JsonResponse(errors, status=400)
+    try:
+        fields = api.parse_fields(request.GET, api.GROUP_ORDER_FIELDS)
+        embeds = api.parse_embeds(request.GET, api.GROUP_ORDER_EMBEDS)
+        limit = api.parse_limit(request.GET)
+        group_orders = api.group_order_queryset(fields, embeds).filter(team_id=request.team_id, **filters)
+        group_orders, cursor = await akeyset_page(group_orders, api.GROUP_ORDER_KEYS, request.GET.get('cursor'), limit)
+    except api.InvalidQuery as e:
+        return JsonResponse({e.param: str(e)}, status=400)
+    except InvalidCursor as e:
+        return JsonResponse({'cursor': str(e)}, status=400)
+    return api_response(request, [api.group_order_json(group_order, fields, embeds) for group_order in group_orders], cursor)
+
+async def api_order_items(request: HttpRequest) -> HttpResponse:
+    """
+    the team's order items in id order, optionally only those of one group_order or one user, and optionally embedding who ordered them
+    """
+    try:
+        fields = api.parse_fields(request.GET, api.ORDER_ITEM_FIELDS)
+        embeds = api.parse_embeds(request.GET, api.ORDER_ITEM_EMBEDS)
+        limit = api.parse_limit(request.GET)
+        order_items = api.order_item_queryset(fields, embeds).filter(group_order__team_id=request.team_id)
+        group_order_id = api.parse_id(request.GET, 'group_order')
+        if group_order_id is not None:
+            order_items = order_items.filter(group_order_id=group_order_id)
+        user_id = api.parse_id(request.GET, 'user')
+        if user_id is not None:
+            order_items = order_items.filter(ordered_by_id=user_id)
+        order_items, cursor = await akeyset_page(order_items, api.ORDER_ITEM_KEYS, request.GET.get('cursor'), limit)
+    except api.InvalidQuery as e:
+        return JsonResponse({e.param: str(e)}, status=400)
+    except InvalidCursor as e:
+        return JsonResponse({'cursor': str(e)}, status=400)
+    return api_response(request, [api.order_item_json(order_item, fields, embeds) for order_item in order_items], cursor)